@@ -1,19 +1,22 @@
 import re
 from collections import defaultdict
 from datetime import datetime
-import subprocess as subp
 from pathlib import Path
 from textwrap import dedent
 import yaml
 
-import pandocfilters as pf
 import misaka
 
 from colorama import Fore
 
+from . import bib
+from . import build
+from . import render
+from . import blocks
 from . import task
 from . import utils
 from . import convert
+from . import pool
 
 # captures base link, anchors, display text; any combo of them
 link_regex = re.compile('\[\[([^\]]*?)(#[^\]]*?)?(?:\|([^\]]*?))?\]\]')
@@ -23,6 +26,95 @@ bookmark_regex = re.compile('\[([a-zA-Z]{1,2})\]: (http[^\s]*) ?(?:\(([^\)]*)\))
 heading_regex = re.compile('(#{1,6}) (.*)')
 data_regex = re.compile('# Data\s+```yaml\s([\s\S]*?)\s+```')
 
+# Markdown transforms applied before conversion; see `Article.apply_transforms`
+task_line_regex = re.compile(r'\* (\[.\]) (.*?) ?(!{1,3})? ?(\(\d[^\)]*\))? ?(\+\+)?(  #\w{8})')
+task_header_regex = re.compile(r'#{1,6} (.*?) \| (.+)\n((?:.+(?:\n|$))*)')
+tikz_regex = re.compile(r'!\[(.*?)\]\(\s*(\\begin{tikzpicture}.*?\\end{tikzpicture})\s*\)', re.DOTALL)
+tex_image_regex = re.compile(r'!\[(.*?)\]\(\s*(\\.*?)\s*\)', re.DOTALL)
+pdftex_regex = re.compile(r'!\[(.*?)\]\((.*?)\.pdf_tex\)')
+pdf_image_regex = re.compile(r'!\[((?:[\s\S](?!!\[))*)\]\((docs\/.*?\.pdf#\d.*?)\)')
+audio_regex = re.compile(r'!\[((?:[\s\S](?!!\[))*)\]\((audio\/.*?\.wav)\)')
+
+# text every match of a transform regex contains, for skipping it on a cheap search
+transform_triggers = {
+    task_line_regex:   re.compile(r'  #\w{8}'),
+    task_header_regex: re.compile(r' \| '),
+    tikz_regex:        re.compile(r'\\begin{tikzpicture}'),
+    tex_image_regex:   re.compile(r'\]\(\s*\\'),
+    pdftex_regex:      re.compile(r'\.pdf_tex\)'),
+    pdf_image_regex:   re.compile(r'\.pdf#\d'),
+    audio_regex:       re.compile(r'\]\(audio/'),
+    footnote_regex:    re.compile(r'\[\^'),
+}
+
+class LazyMetadata(dict):
+    '''
+    Metadata dict whose expensive keys are computed on first access. `groups` are
+    `(keys, func)` pairs (see `Article.metadata_groups`); looking up any of `keys`
+    runs `func(self)` once. Iterating over or copying the dict computes everything.
+    '''
+    def __init__(self, data, groups):
+        super().__init__(data)
+        self.pending = {}
+        for keys, func in groups:
+            for key in keys:
+                self.pending[key] = (keys, func)
+
+    def compute(self, key):
+        group = self.pending.get(key)
+        if group is None: return
+        keys, func = group
+        for k in keys:
+            self.pending.pop(k, None)
+        func(self)
+
+    def compute_all(self):
+        while self.pending:
+            self.compute(next(iter(self.pending)))
+
+    def __getitem__(self, key):
+        self.compute(key)
+        return super().__getitem__(key)
+
+    def __contains__(self, key):
+        self.compute(key)
+        return super().__contains__(key)
+
+    def get(self, key, default=None):
+        self.compute(key)
+        return super().get(key, default)
+
+    def __iter__(self):
+        self.compute_all()
+        return super().__iter__()
+
+    def __len__(self):
+        self.compute_all()
+        return super().__len__()
+
+    def keys(self):
+        self.compute_all()
+        return super().keys()
+
+    def values(self):
+        self.compute_all()
+        return super().values()
+
+    def items(self):
+        self.compute_all()
+        return super().items()
+
+    def copy(self):
+        return dict(self.items())
+
+    def __repr__(self):
+        self.compute_all()
+        return super().__repr__()
+
+    def __reduce__(self):
+        return (dict, (dict(self.items()),))
+
+
 class Article:
     '''
     Article object for operating on Markdown files. The class takes care of a lot of
@@ -37,12 +129,40 @@ class Article:
 
     :param verbose:
 
+    :param lazy: only read the YAML front matter up front; the body and the expensive
+                 metadata keys (carousels, reflinks, headings, bib data, tasks...) are
+                 computed on first access
+
+    :param builds: submit the note's `build` targets while parsing metadata; off for
+                   graph ingest, where the targets are submitted when the page is
+                   converted
+
     :var link:
 
     '''
-    def __init__(self, fullpath, name, verbose=True):
+    # source of block structure for context trees; see `structure_events`
+    structure_mode = 'native'
+
+    # how `apply_transforms` runs a transform chain: 'gated' (skip transforms whose
+    # `transform_triggers` entry doesn't occur) or 'chain' (every transform)
+    transform_mode = 'gated'
+
+    # queue live TeX figures on `render.get_queue()` instead of rendering in place; see
+    # `render_figure`
+    render_async = True
+
+    # attributes read from the note body; see `read_header`
+    body_attrs = ('raw_content', 'raw_lines', 'content')
+
+    # submit `build` targets while parsing metadata; see `meta_build_tgts`
+    builds = True
+
+    def __init__(self, fullpath, name, verbose=True, lazy=False, builds=True):
         self.fullpath = fullpath
         self.name = name
+        self.lazy = lazy
+        self.builds = builds
+        self.lazy_body = False
 
         self.link = name
         self.html = {}
@@ -53,7 +173,7 @@ class Article:
         self.valid = True
         self.verbose = verbose
         self.ctime = datetime.now().timestamp()
-        self.headings = []
+        self._line_index = None
 
         # lightweight parsing
         self.metadata = self.process_metadata()
@@ -63,167 +183,294 @@ class Article:
 
         # could build in backlink processing to a process_links-like function
 
-    def process_metadata(self):
-        if not Path(self.fullpath).is_file(): return {}
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_line_index', None)
+        return state
+
+    def to_record(self):
+        '''
+        The article's state without its body text or context tree, e.g. for sending it
+        between processes. `from_record` rebuilds an article that reads its body from
+        disk on first access.
+        '''
+        record = self.__getstate__()
+        for attr in Article.body_attrs + ('tree',):
+            record.pop(attr, None)
+
+        # link contexts point back at the article; restored by `from_record`
+        record['linkdata'] = {
+            name: [{k: v for k, v in link.items() if k != 'ref'} for link in links]
+            for name, links in self.linkdata.items()
+        }
+        return record
+
+    @classmethod
+    def from_record(cls, record):
+        article = cls.__new__(cls)
+        article.__dict__.update(record)
+        article.tree = {}
+        article.lazy_body = True
+        article._line_index = None
+
+        article.linkdata = defaultdict(list)
+        for name, links in record['linkdata'].items():
+            article.linkdata[name] = [{'ref': article, **link} for link in links]
+        return article
+
+    def __getattr__(self, attr):
+        # body attributes of a lazily loaded article are read on first access
+        if attr in Article.body_attrs and self.__dict__.get('lazy_body'):
+            self.load_body()
+            return self.__dict__[attr]
+        raise AttributeError(attr)
+
+    def read_file(self):
+        '''Read the whole note, returning the front matter match (or None).'''
         with open(self.fullpath, 'r') as f:
             ft = f.read()
             f.seek(0)
             self.raw_content = ft
             self.raw_lines   = f.readlines()
 
-            metadata = {'name':self.name}
-            mt = re.match('---\n(.*?)\n(---|\.\.\.)', ft, flags=re.DOTALL)
+        mt = re.match('---\n(.*?)\n(---|\.\.\.)', ft, flags=re.DOTALL)
+        self.content = ft if mt is None else ft.replace(mt.group(0), '')
+        return mt
 
-            if mt is None:
-                self.content = ft
-                self.valid = False
+    def read_header(self):
+        '''
+        Read only the YAML front matter, returning its match (or None). The body
+        attributes are loaded by `load_body` when first accessed.
+        '''
+        header = ''
+        with open(self.fullpath, 'r') as f:
+            for i, line in enumerate(f):
+                header += line
+                if i == 0 and not line.startswith('---'): break
+                if i > 0 and line.startswith(('---', '...')): break
 
-                if self.verbose:
-                    print(Fore.RED + '[invalid metadata] ' + Fore.RESET + self.name)
+        for attr in Article.body_attrs:
+            self.__dict__.pop(attr, None)
+        self.lazy_body = True
 
-                return metadata
+        return re.match('---\n(.*?)\n(---|\.\.\.)', header, flags=re.DOTALL)
 
-            self.raw_metadata = mt.group(0)
-            self.content = ft.replace(mt.group(0), '')
-            #for line in mt.group(1).split('\n'):
-                #split = [line.split(':')[0], ':'.join(line.split(':')[1:])]
-                #attr, val = map(str.strip, split)
-                #metadata[attr.lower()] = val
+    def load_body(self):
+        self.lazy_body = False
+        self.read_file()
 
-            # doesnt face issues if metadata components have colon and are only
-            # one line, but when multiline colons can have unexpected effects
-            self.raw_metadata_dict = {}
-            for m in re.findall('.*:[^:]*$', mt.group(1), flags=re.MULTILINE):
-                split = [m.split(':')[0], ':'.join(m.split(':')[1:])]
-                attr, val = map(str.strip, split)
-                metadata[attr.lower()] = val
-                self.raw_metadata_dict[attr.lower()] = val
+    def process_metadata(self):
+        if not Path(self.fullpath).is_file(): return {}
 
-            if 'tags' in metadata:
-                metadata['tag_links'] = self.process_links(metadata['tags'])
-            
-            if 'series' in metadata:
-                metadata['series_links'] = self.process_links(metadata['series'])
-                metadata['series_structure'] = self.process_series(metadata['series'])
-
-            if metadata.get('files'):
-                metadata['files_links'] = self.process_links(metadata['files'])
-            elif metadata.get('cite_source'):
-                metadata['files_links'] = self.process_links(metadata['cite_source'])
-
-            public_carousel_html, local_carousel_html, public_files, local_files = self.get_carousels(metadata)
-            metadata['public_carousel_html'] = public_carousel_html
-            metadata['local_carousel_html']  = local_carousel_html
-            metadata['public_files']         = public_files
-            metadata['local_files']          = local_files
-
-            # parse ref links
-            metadata['reflinks'], metadata['sources'], metadata['reflink_list'] = self.process_reflinks(self.content)
-            metadata['bookmarks'], _, metadata['bookmark_list'] = self.process_bookmarks(self.content)
-
-            # parse heading IDs
-            metadata['heading_map'] = self.process_headings(self.content)
-
-            # process data
-            metadata['filedata'] = self.process_data(self.content)
-
-            # process data
-            metadata['citedata'] = self.process_bibdata(
-                metadata.get('source'),
-                metadata.get('citekey'),
-                metadata.get('url'),
-            )
-            metadata['bibtex'] = metadata['citedata'].get('bibtex','')
-            metadata['bibtex_quote'] = '```\n{}\n```'.format(metadata['bibtex'])
+        metadata = {'name':self.name}
+        mt = self.read_header() if self.lazy else self.read_file()
+
+        if mt is None:
+            self.valid = False
 
-            if metadata.get('citekey'):
-                metadata['citegen'] = '<b>[inline]</b> @{}'.format(metadata['citekey'])
-            elif metadata['citedata'].get('citekey'):
-                metadata['citegen'] = '<b>[inline]</b> @{}'.format(metadata['citedata']['citekey'])
+            if self.verbose:
+                print(Fore.RED + '[invalid metadata] ' + Fore.RESET + self.name)
 
-            # process build targets
-            if metadata.get('build'):
-                metadata['build_tgts'] = {}
-                tgt_lst = metadata['build'].split(' ')
+            return metadata
 
-                for tgt in tgt_lst:
-                    wiki_dir  = Path('/home/smgr/Documents/notes/')
-                    build_dir = Path(wiki_dir, 'build')
+        self.raw_metadata = mt.group(0)
+        #for line in mt.group(1).split('\n'):
+            #split = [line.split(':')[0], ':'.join(line.split(':')[1:])]
+            #attr, val = map(str.strip, split)
+            #metadata[attr.lower()] = val
 
-                    if tgt in convert.alias_map:
-                        outp = Path(build_dir, tgt)
-                        outp.mkdir(parents=True, exist_ok=True)
+        # doesnt face issues if metadata components have colon and are only
+        # one line, but when multiline colons can have unexpected effects
+        self.raw_metadata_dict = {}
+        for m in re.findall('.*:[^:]*$', mt.group(1), flags=re.MULTILINE):
+            split = [m.split(':')[0], ':'.join(m.split(':')[1:])]
+            attr, val = map(str.strip, split)
+            metadata[attr.lower()] = val
+            self.raw_metadata_dict[attr.lower()] = val
 
-                        outp = Path(outp, Path(self.fullpath).stem+'.pdf')
-                        out = convert.alias_map[tgt](self.fullpath, outp)
+        if 'tags' in metadata:
+            metadata['tag_links'] = self.process_links(metadata['tags'])
+        
+        if 'series' in metadata:
+            metadata['series_links'] = self.process_links(metadata['series'])
+            metadata['series_structure'] = self.process_series(metadata['series'])
 
-                        if out:
-                            metadata['build_tgts'][tgt] = str(Path(out).relative_to(wiki_dir))
+        if metadata.get('files'):
+            metadata['files_links'] = self.process_links(metadata['files'])
+        elif metadata.get('cite_source'):
+            metadata['files_links'] = self.process_links(metadata['cite_source'])
 
-            # task groups (for gantt primarily)
-            metadata['task_groups'], metadata['task_list'] = self.process_task_groups(self.content)
+        # only needs the header, and submits builds that should start right away
+        self.meta_build_tgts(metadata)
 
-            if metadata['task_groups']:
-                metadata['task_gantt'] = task.taskdict_to_gantt_raw({
-                    section: task.get_tasks_from_ids(tasks)
-                    for section, tasks in metadata['task_groups'].items()
-                }, 'Task Gantt')
+        if self.lazy:
+            return LazyMetadata(metadata, self.metadata_groups())
 
-                metadata['task_comp'] = ''.join([
-                    self.transform_task_headers(self.transform_tasks(m), op=True)
-                    for m in metadata['task_list']
-                ])
+        for keys, func in self.metadata_groups():
+            func(metadata)
 
         return metadata
 
-    def context_tree(self):
+    def metadata_groups(self):
+        '''
+        Expensive metadata keys as `(keys, func)` pairs, where `func(metadata)` fills in
+        (some of) `keys`. Run in order by `process_metadata`, or on first access to one
+        of the keys for lazy articles.
+        '''
+        return [
+            (['public_carousel_html', 'local_carousel_html', 'public_files', 'local_files'],
+             self.meta_carousels),
+            (['reflinks', 'sources', 'reflink_list'], self.meta_reflinks),
+            (['bookmarks', 'bookmark_list'], self.meta_bookmarks),
+            (['heading_map'], self.meta_headings),
+            (['filedata'], self.meta_filedata),
+            (['citedata', 'bibtex', 'bibtex_quote', 'citegen'], self.meta_citedata),
+            (['task_groups', 'task_list', 'task_gantt', 'task_comp'], self.meta_tasks),
+        ]
+
+    def meta_carousels(self, metadata):
+        public_carousel_html, local_carousel_html, public_files, local_files = self.get_carousels(metadata)
+        metadata['public_carousel_html'] = public_carousel_html
+        metadata['local_carousel_html']  = local_carousel_html
+        metadata['public_files']         = public_files
+        metadata['local_files']          = local_files
+
+    def meta_reflinks(self, metadata):
+        # parse ref links
+        metadata['reflinks'], metadata['sources'], metadata['reflink_list'] = self.process_reflinks(self.content)
+
+    def meta_bookmarks(self, metadata):
+        metadata['bookmarks'], _, metadata['bookmark_list'] = self.process_bookmarks(self.content)
+
+    def meta_headings(self, metadata):
+        # parse heading IDs
+        metadata['heading_map'] = self.process_headings(self.content)
+
+    def meta_filedata(self, metadata):
+        # process data
+        metadata['filedata'] = self.process_data(self.content)
+
+    def meta_citedata(self, metadata):
+        metadata['citedata'] = self.process_bibdata(
+            metadata.get('source'),
+            metadata.get('citekey'),
+            metadata.get('url'),
+        )
+        metadata['bibtex'] = metadata['citedata'].get('bibtex','')
+        metadata['bibtex_quote'] = '```\n{}\n```'.format(metadata['bibtex'])
+
+        if metadata.get('citekey'):
+            metadata['citegen'] = '<b>[inline]</b> @{}'.format(metadata['citekey'])
+        elif metadata['citedata'].get('citekey'):
+            metadata['citegen'] = '<b>[inline]</b> @{}'.format(metadata['citedata']['citekey'])
+
+    def meta_build_tgts(self, metadata):
+        # build targets whose output exists, or with `builds` also those submitted to
+        # the background `build.BuildQueue` (see `submit_builds`)
+        if self.builds:
+            self.submit_builds(metadata)
+        elif metadata.get('build'):
+            metadata['build_tgts'] = {
+                tgt: str(outp.relative_to(build.WIKI_PATH))
+                for tgt, outp in self.build_outputs(metadata).items()
+                if outp.exists()
+            }
+
+    def build_outputs(self, metadata=None):
+        '''Output path of each known target in the note's `build` attribute.'''
+        if metadata is None: metadata = self.metadata
+        return {
+            tgt: Path(build.BUILD_PATH, tgt, Path(self.fullpath).stem+'.pdf')
+            for tgt in metadata.get('build', '').split(' ')
+            if tgt in convert.alias_map
+        }
+
+    def submit_builds(self, metadata=None):
+        '''
+        Submit the note's build targets to `build.get_queue()` (returns immediately) and
+        list in `build_tgts` the ones whose output exists or is on its way.
+        '''
+        if metadata is None: metadata = self.metadata
+        if not metadata.get('build'): return
+
+        queue = build.get_queue()
+        metadata['build_tgts'] = {}
+        for tgt, outp in self.build_outputs(metadata).items():
+            job = queue.submit(self.fullpath, tgt, outp)
+            if job['state'] in ('queued', 'running', 'done') or outp.exists():
+                metadata['build_tgts'][tgt] = str(outp.relative_to(build.WIKI_PATH))
+
+    def meta_tasks(self, metadata):
+        # task groups (for gantt primarily)
+        metadata['task_groups'], metadata['task_list'] = self.process_task_groups(self.content)
+
+        if metadata['task_groups']:
+            metadata['task_gantt'] = task.taskdict_to_gantt_raw({
+                section: task.get_tasks_from_ids(tasks)
+                for section, tasks in metadata['task_groups'].items()
+            }, 'Task Gantt')
+
+            metadata['task_comp'] = ''.join([
+                self.transform_task_headers(self.transform_tasks(m), op=True)
+                for m in metadata['task_list']
+            ])
+
+    def build_status(self, queue=None):
+        '''State of each build target (see `build.BuildQueue.status`), for templates.'''
+        if queue is None: queue = build.get_queue()
+        return {
+            tgt: queue.status(Path(build.WIKI_PATH, rel))['state']
+            for tgt, rel in self.metadata.get('build_tgts', {}).items()
+        }
+
+    def fingerprint(self):
+        '''Digest of the article's name and raw source, e.g. for build manifests.'''
+        return utils.src_hash('', self.name + '\0' + self.raw_content)
+
+    def structure_events(self, mode=None):
+        '''
+        Block structure of the article as `blocks.scan` events. `mode` is 'native' (scan
+        `raw_lines` in process), 'pandoc' (commonmark+sourcepos JSON from a pandoc
+        subprocess) or 'verify' (both, reporting differences and trusting pandoc);
+        defaults to `structure_mode`.
+        '''
+        if mode is None: mode = self.structure_mode
+        if mode == 'pandoc':
+            return blocks.pandoc_events(self.fullpath)
+
+        events = blocks.scan(self.raw_lines)
+        if mode == 'verify':
+            expected = blocks.pandoc_events(self.fullpath)
+            if events != expected:
+                print(Fore.YELLOW + '[structure mismatch] ' + Fore.RESET + self.name)
+                for got, exp in zip(events, expected):
+                    if got != exp:
+                        print('  native: {}\n  pandoc: {}'.format(got, exp))
+                        break
+                return expected
+        return events
+
+    def context_tree(self, mode=None):
         tree = {}
-        current_header = {'c': ''}
-
-        def comp(key, value, format, meta):
-            if key == 'Header':
-                #print(self.name)
-                #print(value[2][0])
-                #current_header['c'] = value[2][0]['c'][1][0]['c']
-
-                title = []
-                for v in value[2]:
-                    for vc in v['c'][1:]:
-                        outer = vc
-                        #print('+++', outer[0])
-                        if type(outer) == str:
-                            title.append(outer)
-                            continue
-                        elif type(outer[0]) == str:
-                            title.append(outer[0])
-                            continue
-                        elif 'c' in outer[0]:
-                            title.append(outer[0]['c'])
-                        else:
-                            title.append(' ')
-
-                current_header['c'] = ''.join([str(s) for s in title])
-
-            if key == 'BulletList' or key == 'OrderedList':
-                v = value if key == 'BulletList' else value[1]
-
-                for item in v:
-                    if not item:
+        current_header = ''
+
+        for key, value in self.structure_events(mode):
+            if key == 'header':
+                current_header = value
+
+            if key == 'list':
+                for pos in value:
+                    if pos is None:
                         print(Fore.YELLOW + '\n[empty list item]' + Fore.RESET)
                         continue
 
-                    pos   = item[0]['c'][0][2][0][1].split('@')[-1].split('-')
-                    start = pos[0]
-                    end   = pos[-1]
-
-                    sl, sc = map(int, start.split(':'))
-                    el, ec = map(int, end.split(':'))
+                    (sl, sc), (el, ec) = pos
 
                     obj = {
                         'c': [],
                         'p': tree.get(sl),
                         'v': ''.join(self.raw_lines[(sl-1):(el-1)]),
-                        'h': current_header['c']
+                        'h': current_header
                     }
 
                     if obj['p'] is not None:
@@ -232,74 +479,42 @@ class Article:
                     for i in range(sl, el):
                         tree[i] = obj
 
-            if key == 'Para':
-                start = value[0]['c'][0][2][0][1].split('@')[-1].split('-')[0]
-                end   = value[-1]['c'][0][2][0][1].split('@')[-1].split('-')[-1]
-
-                sl, sc = map(int, start.split(':'))
-                el, ec = map(int, end.split(':'))
+            if key == 'para':
+                (sl, sc), (el, ec) = value
 
                 obj = {
                     'c': [],
                     'p': None,
                     'v': ''.join(self.raw_lines[(sl-1):el]),
-                    'h': current_header['c']
+                    'h': current_header
                 }
 
                 for i in range(sl, el+1):
                     if tree.get(i) is None:
                         tree[i] = obj
 
-        #cm = pp.convert_file(self.fullpath, format='commonmark+sourcepos', to='json')
-        cm = subp.check_output(["pandoc", "--from", "commonmark+sourcepos", "--to", "json", self.fullpath])
-        pf.applyJSONFilters([comp], cm)
-
         return tree
 
-    def proto_context_tree(self):
+    def proto_context_tree(self, mode=None):
         '''
         The ending indexes for Para objects are tighter than those of
         lists; the former properly bound the element, whereas the latter
         add an additional line.
         '''
         tree = {}
-        current_header = {'c': ''}
-
-        def comp(key, value, format, meta):
-            if key == 'Header':
-
-                title = []
-                for v in value[2]:
-                    for vc in v['c'][1:]:
-                        outer = vc
-                        #print('+++', outer[0])
-                        if type(outer) == str:
-                            title.append(outer)
-                            continue
-                        elif type(outer[0]) == str:
-                            title.append(outer[0])
-                            continue
-                        elif 'c' in outer[0]:
-                            title.append(outer[0]['c'])
-                        else:
-                            title.append(' ')
-
-                current_header['c'] = ''.join([str(s) for s in title])
-
-            if key == 'BulletList' or key == 'OrderedList':
-                v = value if key == 'BulletList' else value[1]
-
-                for item in v:
-                    if not item:
+        current_header = ''
+
+        for key, value in self.structure_events(mode):
+            if key == 'header':
+                current_header = value
+
+            if key == 'list':
+                for pos in value:
+                    if pos is None:
                         print(Fore.YELLOW + '\n[empty list item]' + Fore.RESET)
                         continue
 
-                    pos   = item[0]['c'][0][2][0][1].split('@')[-1].split('-')
-                    start = pos[0]
-                    end   = pos[-1]
-
-                    sl, sc = map(int, start.split(':'))
-                    el, ec = map(int, end.split(':'))
+                    (sl, sc), (el, ec) = pos
                     el = el - 1  # list-specific tail index has one extra line in parser
                     
                     while el-1 >= len(self.raw_lines) or not self.raw_lines[el-1].strip():
@@ -309,7 +524,7 @@ class Article:
                         'c': [],
                         'p': tree.get(sl),
                         'v': ''.join(self.raw_lines[(sl-1):el]),
-                        'h': current_header['c'],
+                        'h': current_header,
                         'b': ((sl,sc),(el,ec)),
                         't': 'list',
                     }
@@ -320,19 +535,14 @@ class Article:
                     for i in range(sl, el+1):
                         tree[i] = obj
 
-            
-            if key == 'Para':
-                start = value[0]['c'][0][2][0][1].split('@')[-1].split('-')[0]
-                end   = value[-1]['c'][0][2][0][1].split('@')[-1].split('-')[-1]
-
-                sl, sc = map(int, start.split(':'))
-                el, ec = map(int, end.split(':'))
+            if key == 'para':
+                (sl, sc), (el, ec) = value
 
                 obj = {
                     'c': [],
                     'p': None,
                     'v': ''.join(self.raw_lines[(sl-1):el]),
-                    'h': current_header['c'],
+                    'h': current_header,
                     'b': ((sl,sc),(el,ec)),
                     't': 'para'
                 }
@@ -341,12 +551,19 @@ class Article:
                     if tree.get(i) is None:
                         tree[i] = obj
 
-        #cm = pp.convert_file(self.fullpath, format='commonmark+sourcepos', to='json')
-        cm = subp.check_output(["pandoc", "--from", "commonmark+sourcepos", "--to", "json", self.fullpath])
-        pf.applyJSONFilters([comp], cm)
-
         return tree
 
+    def line_index(self, string):
+        '''
+        `utils.LineIndex` for `string`, built once and shared by every position lookup
+        on the same text (usually `self.content`).
+        '''
+        cached = getattr(self, '_line_index', None)
+        if cached is None or not (cached[0] is string or cached[0] == string):
+            cached = (string, utils.LineIndex(string))
+            self._line_index = cached
+        return cached[1]
+
     def proto_process_linkdata(self, string, offset=0):
         '''
         Offset parameter to allow correction for strings that do not match
@@ -356,13 +573,13 @@ class Article:
         '''
         links = list(link_regex.finditer(string))
         linkdata = defaultdict(list)
+
+        # positional processing, shared by both passes below
+        index = self.line_index(string)
+        positions = [index.position(m.start()) for m in links]
         
         bound_map = defaultdict(lambda: {'c':[None,None],'t':None,'n':[]})
-        for m in links:
-            # positional processing
-            start = m.start()
-            line = string.count('\n', 0, start) +1
-            col = start - string.rfind('\n', 0, start)
+        for m, (line, col) in zip(links, positions):
             name = utils.title_to_fname(m.group(1))
 
             text = '(will be removed)'
@@ -429,11 +646,7 @@ class Article:
                 #comment_str = '<!--[panja::e@{}]-->'.format(line)
                 string_mod.insert(line-offset,comment_str)
                 
-        for m in links:
-            # positional processing
-            start = m.start()
-            line = string.count('\n', 0, start) +1
-            col = start - string.rfind('\n', 0, start)
+        for m, (line, col) in zip(links, positions):
             name = utils.title_to_fname(m.group(1))
 
             text = '(will be removed)'
@@ -469,12 +682,11 @@ class Article:
         '''
         links = link_regex.finditer(string)
         linkdata = defaultdict(list)
+        index = self.line_index(string)
 
         for m in links:
             # positional processing
-            start = m.start()
-            line = string.count('\n', 0, start) +1
-            col = start - string.rfind('\n', 0, start)
+            line, col = index.position(m.start())
             name = utils.title_to_fname(m.group(1))
 
             text = '(will be removed)'
@@ -653,180 +865,72 @@ class Article:
 
     def process_bibdata(self, source=None, citekey=None, url=None):
         '''
-        Should ultimately make calls to a (prebuilt?) DocSync object so we aren't
-        re-indexing the bib every article. Could consider just making this completely
-        external, handled the way the graph association is.
+        Look up the note's BibTeX entry in the shared, process-wide bib index. The bib
+        is only parsed once (and again when it changes on disk), not per article.
         '''
-        BIBTEX_ENTRY_REGEX = re.compile('^@.*{(.*),\n[\s\S]*?\n}',re.MULTILINE)
-        BIBTEX_SOURCE_REGEX  = re.compile('^[^\S\r\n]*?file[^\S\r\n]*?=[^\S\r\n]*?{(.*)}',re.MULTILINE)
-        BIBTEX_URL_REGEX  = re.compile('^[^\S\r\n]*?archive_url[^\S\r\n]*?=[^\S\r\n]*?{(.*)}',re.MULTILINE)
-        BIBTEX_INF_URL_REGEX  = re.compile('^[^\S\r\n]*?url[^\S\r\n]*?=[^\S\r\n]*?{(.*)}',re.MULTILINE)
-
-        bib_path  = Path('/home/smgr/Documents/notes/docs/docsyncbib.bib')
-        wiki_path = Path('/home/smgr/Documents/notes/')
-
-        source  = source.strip() if source is not None else ''
-        citekey = citekey.strip() if citekey is not None else ''
-        url     = url.strip() if url is not None else ''
-
-        bib_ent_by_source  = {}
-        bib_ent_by_citekey = {}
-        bib_ent_by_url     = {}
-        bib_ent_by_inf_url = {}
-
-        bib_content = bib_path.open().read()
-        for m in BIBTEX_ENTRY_REGEX.finditer(bib_content):
-            bib_entry   = m.group(0)
-            bib_citekey = m.group(1)
-            bib_source  = BIBTEX_SOURCE_REGEX.search(bib_entry)
-            bib_url     = BIBTEX_URL_REGEX.search(bib_entry)
-            bib_inf_url = BIBTEX_INF_URL_REGEX.search(bib_entry)
-
-            if bib_source:
-                bib_source = bib_source.group(1)
-                bib_source = str(Path(bib_source).relative_to(wiki_path))
-            else:
-                bib_source = ''
-
-            if bib_url:
-                bib_url = bib_url.group(1).strip()
-            else:
-                bib_url = ''
-
-            if bib_inf_url:
-                bib_inf_url = bib_inf_url.group(1).strip()
-            else:
-                bib_inf_url = ''
-
-            bib_data = {
-                'source':  bib_source,
-                'citekey': bib_citekey,
-                'url':     bib_url,
-                'inf_url': bib_inf_url,
-                'bibtex':  bib_entry,
-            }
-
-            bib_ent_by_citekey[bib_citekey] = bib_data
-            if bib_source:
-                bib_ent_by_source[bib_source] = bib_data
-            if bib_url:
-                bib_ent_by_url[bib_url] = bib_data
-            if bib_inf_url:
-                bib_ent_by_inf_url[bib_inf_url] = bib_data
-
-        # feed pages mostly defined around a URL
-        res = None
-        if citekey:
-            res = bib_ent_by_citekey.get(citekey)
-
-        if url and not res:
-            res = bib_ent_by_url.get(url)
-
-        if url and not res:
-            res = bib_ent_by_inf_url.get(url)
-            if res is not None:
-                # archive_url did not match url in the file; set canonical
-                # URL to the inferred one, since this is what matches the url in
-                # the file.
-                res['url'] = res['inf_url']
-
-        if source and not res:
-            m = re.match(r'(?:\[\[)?([^\]\[]*)(?:\]\])?', source)
-            if m: 
-                rel_src = m.group(1)
-                ful_src = Path(rel_src)
-                res = bib_ent_by_source.get(str(ful_src))
-
-            if res is not None:
-                # url in document did not match either archive_url or the
-                # inferred url. One or both may be defined, however, for the
-                # source file. Default to keeping the archive_url since this is
-                # more accurate (would likely want to override the file URL
-                # with this since the file is directly attached). If no
-                # archive_url is defined, set url to inf_url, as there's good
-                # evidence this url is related to the file
-                if not res.get('url'):
-                    res['url'] = res['inf_url']
-
-        # commented out for; extremely unlikely for a file to have a citekey but no
-        # other source identifiers. If it does have a citekey, there are no instances
-        # where I would want to overwrite listed files of links, in the case of a
-        # (possible) duplicate entry. The other attrs should dictate the entry
-        #if citekey and not res:
-        #    res = bib_ent_by_citekey.get(citekey)
-
-        # for downstream apps: bib data will provide url and inf_url. If url is
-        # present, use it
-        return res if res else {}
+        return bib.get_index(bib.BIB_PATH).lookup(
+            source=source,
+            citekey=citekey,
+            url=url,
+            wiki_path=bib.WIKI_PATH
+        )
 
 
     def transform_links(self, string, path='', graph=None):
-        nt = re.sub(
-            pattern=link_regex,
-            repl=lambda x: utils.title_to_link(x, path, graph),
-            string=string
-        )
+        resolver = utils.get_link_resolver(graph)
+        nt = link_regex.sub(lambda x: resolver.link(x, path), string)
         return nt
 
 
     def transform_tasks(self, string):
-        def repl(m):
-            # probably not the best practice using blanket replace statements
-            s = m.group(0)
-            if m.group(1) == '[S]':
-                s = s.replace(m.group(1), '[ ]')
-                s = s.replace(m.group(2), '<span style="background:var(--hl-green)">'+m.group(2)+'</span>')
-            if m.group(3):
-                s = s.replace(m.group(3), '<span style="color:var(--red)">'+m.group(3)+'</span>')
-            if m.group(4) is not None:
-                s = s.replace(m.group(4), '<span class="tight-box">'+m.group(4)+'</span>')    
-            if m.group(5) is not None:
-                tasklinks = '<button class="arrow ssrc" data-docsource="/simple/task-{id}">←</button>' + \
-                            '<sup><a href="/task-{id}">+</a></sup>'
-                s = s.replace(
-                        m.group(5),
-                        tasklinks.format(id=m.group(6).replace('  #',''))
-                    )
-            s = s.replace(m.group(6), '')
-            return s
-
-        nt = re.sub(
-            pattern=r'\* (\[.\]) (.*?) ?(!{1,3})? ?(\(\d[^\)]*\))? ?(\+\+)?(  #\w{8})',
-            repl=repl,
-            string=string
-        )
-
-        return nt
+        return task_line_regex.sub(self.repl_task, string)
+
+    def repl_task(self, m):
+        # probably not the best practice using blanket replace statements
+        s = m.group(0)
+        if m.group(1) == '[S]':
+            s = s.replace(m.group(1), '[ ]')
+            s = s.replace(m.group(2), '<span style="background:var(--hl-green)">'+m.group(2)+'</span>')
+        if m.group(3):
+            s = s.replace(m.group(3), '<span style="color:var(--red)">'+m.group(3)+'</span>')
+        if m.group(4) is not None:
+            s = s.replace(m.group(4), '<span class="tight-box">'+m.group(4)+'</span>')    
+        if m.group(5) is not None:
+            tasklinks = '<button class="arrow ssrc" data-docsource="/simple/task-{id}">←</button>' + \
+                        '<sup><a href="/task-{id}">+</a></sup>'
+            s = s.replace(
+                    m.group(5),
+                    tasklinks.format(id=m.group(6).replace('  #',''))
+                )
+        s = s.replace(m.group(6), '')
+        return s
 
     def transform_task_headers(self, string, op=False, remove=False):
-        def repl(m):
-            title = m.group(1)
-            body  = m.group(3)
-            opn   = 'open' if op else ''
-            #gantt = task.taskdict_to_gantt_raw({
-            #    title:
-            #    task.get_tasks_from_ids(self.metadata['task_groups'].get(title))
-            #})
-            s = '<details class="tasks" {opn}>' + \
-                    '<summary>{}</summary>' + \
-                    '\n{}\n' + \
-                '</details>'.format()
-                #   '<details>' + \
-                #       '<summary>Gantt view</summary>\n{gantt}\n' + \
-                #   '</details>' + \
-
-            #s = s.format(title, body, gantt=gantt)
-            s = s.format(title, body, opn=opn)
-            #s = '<details class="tasks"><summary>{}<hr class="solid"></summary>\n{}\n</details>'.format(title, body)
-            return s
-
-        nt = re.sub(
-            pattern=r'#{1,6} (.*?) \| (.+)\n((?:.+(?:\n|$))*)',
-            repl=repl if not remove else '',
-            string=string
+        return task_header_regex.sub(
+            (lambda m: self.repl_task_header(m, op)) if not remove else '',
+            string
         )
 
-        return nt
+    def repl_task_header(self, m, op=False):
+        title = m.group(1)
+        body  = m.group(3)
+        opn   = 'open' if op else ''
+        #gantt = task.taskdict_to_gantt_raw({
+        #    title:
+        #    task.get_tasks_from_ids(self.metadata['task_groups'].get(title))
+        #})
+        s = '<details class="tasks" {opn}>' + \
+                '<summary>{}</summary>' + \
+                '\n{}\n' + \
+            '</details>'.format()
+            #   '<details>' + \
+            #       '<summary>Gantt view</summary>\n{gantt}\n' + \
+            #   '</details>' + \
+
+        #s = s.format(title, body, gantt=gantt)
+        s = s.format(title, body, opn=opn)
+        #s = '<details class="tasks"><summary>{}<hr class="solid"></summary>\n{}\n</details>'.format(title, body)
+        return s
     
     def transform_tikz(self, string):
         '''
@@ -835,96 +939,86 @@ class Article:
         detected in image syntax (enabling convenient captioning), the source will simply
         be replaced with the filename.
         '''
-        def repl(m):
-            caption  = m.group(1)
-            tikz_src = m.group(2)
-
-            svg_full_prefix = '/home/smgr/Documents/notes/images/'
-            svg_site_prefix = 'images/'
-            hash_src = tikz_src
-
-            data_dir = '/home/smgr/Documents/notes/data'
-            if hash_src.startswith('\\pgfplotstable'):
-                hash_src += ''.join([Path(data_dir, f).open().read() 
-                                     for f in utils.directory_tree(data_dir)])
-
-            # generate stem filename from source hash
-            svg_stem = utils.src_hash('livetex_', hash_src, '.svg')
-            svg_full_path = str(Path(svg_full_prefix, svg_stem))
-            svg_site_path = str(Path(svg_site_prefix, svg_stem))
-
-            # convert tikz to svg
-            # note: can safely ignore re-render since name is based on source hash
-            if not Path(svg_full_path).exists():
-                print(Fore.YELLOW + 'Rendering TikZ SVG {}'.format(svg_stem))
-                utils.tex.tikz2svg(tikz_src, svg_full_path)
-
-            ## add tikz source (kinda hacky but no better option?)
-            #wrapped_src = '\n'.join(['<code>{}</code>'.format(l) for l in tikz_src.split('\n')])
-            #wrapped_src = '<details class="fig-tex-src nostyle"><summary>TeX source</summary>{}</details>'.format(wrapped_src)
-
-            #return '![{}{}]({})'.format(wrapped_src, caption, svg_site_path)
-            return '![{}]({}){{class="live-tex"}}'.format(caption, svg_site_path)
-
-        nt = re.sub(
-            pattern=r'!\[(.*?)\]\(\s*(\\begin{tikzpicture}.*?\\end{tikzpicture})\s*\)',
-            repl=repl,
-            string=string,
-            flags=re.DOTALL
-        )
-        
+        nt = tikz_regex.sub(self.repl_tikz, string)
+
         # try rendering anything(?) with a backslash in the caption
         # space, sufficiently rare; will reconsider on clash
-        nt = re.sub(
-            pattern=r'!\[(.*?)\]\(\s*(\\.*?)\s*\)',
-            repl=repl,
-            string=nt,
-            flags=re.DOTALL
-        )
+        nt = tex_image_regex.sub(self.repl_tikz, nt)
 
         return nt
 
+    def repl_tikz(self, m):
+        caption  = m.group(1)
+        tikz_src = m.group(2)
+
+        svg_site_prefix = 'images/'
+        hash_src = tikz_src
+
+        # data files enter the hash through their digests, only re-read when changed
+        if hash_src.startswith('\\pgfplotstable'):
+            hash_src += utils.tex.data_digest()
+
+        # generate stem filename from source hash
+        svg_stem = utils.src_hash('livetex_', hash_src, '.svg')
+        svg_site_path = str(Path(svg_site_prefix, svg_stem))
+
+        # convert tikz to svg
+        # note: can safely ignore re-render since name is based on source hash
+        self.render_figure(svg_stem, utils.tex.tikz2svg, tikz_src)
+
+        ## add tikz source (kinda hacky but no better option?)
+        #wrapped_src = '\n'.join(['<code>{}</code>'.format(l) for l in tikz_src.split('\n')])
+        #wrapped_src = '<details class="fig-tex-src nostyle"><summary>TeX source</summary>{}</details>'.format(wrapped_src)
+
+        #return '![{}{}]({})'.format(wrapped_src, caption, svg_site_path)
+        return '![{}]({}){{class="live-tex"}}'.format(caption, svg_site_path)
+
+    def render_figure(self, stem, func, *args):
+        '''
+        Make sure SVG `stem` exists under `render.IMAGE_PATH`, producing it with
+        `func(*args, outfile)` if not. Rendering is queued on the shared
+        `render.RenderQueue` when `render_async` is set, and done in place otherwise.
+        '''
+        if self.render_async:
+            return render.get_queue().submit(stem, func, *args)
+
+        outfile = Path(render.IMAGE_PATH, stem)
+        if not outfile.exists():
+            print(Fore.YELLOW + 'Rendering {}'.format(stem))
+            func(*args, str(outfile))
+
     def transform_pdftex(self, string):
         '''
         Transforms .pdf_tex files that are linked within Markdown images
         '''
-        def repl(m):
-            caption  = m.group(1)
-            texpdf = m.group(2)
-
-            in_full_prefix = '/home/smgr/Documents/notes/'
-            svg_full_prefix = '/home/smgr/Documents/notes/images/'
-            svg_site_prefix = 'images/'
-
-            # generate stem filename from source hash
-            in_full_path = str(Path(in_full_prefix, texpdf))
-            tex_src = ''
-            with open(in_full_path+'.pdf_tex', 'r') as f:
-                tex_src = f.read()
-
-            svg_stem = utils.src_hash('pdftex_', tex_src, '.svg')
-            svg_full_path = str(Path(svg_full_prefix, svg_stem))
-            svg_site_path = str(Path(svg_site_prefix, svg_stem))
-
-            # convert tikz to svg
-            # note: can safely ignore re-render since name is based on source hash
-            if not Path(svg_full_path).exists():
-                print(Fore.YELLOW + 'Rendering PDF TeX {} as {}'.format(texpdf, svg_stem))
-                utils.tex.pdftex2svg(
-                    in_full_path+'.pdf_tex',
-                    in_full_path+'.pdf',
-                    svg_full_path)
-
-            return '![{}]({})'.format(caption, svg_site_path)
-
-        nt = re.sub(
-            pattern=r'!\[(.*?)\]\((.*?)\.pdf_tex\)',
-            repl=repl,
-            string=string,
-            #flags=re.DOTALL
+        return pdftex_regex.sub(self.repl_pdftex, string)
+
+    def repl_pdftex(self, m):
+        caption  = m.group(1)
+        texpdf = m.group(2)
+
+        in_full_prefix = '/home/smgr/Documents/notes/'
+        svg_site_prefix = 'images/'
+
+        # generate stem filename from source hash
+        in_full_path = str(Path(in_full_prefix, texpdf))
+        tex_src = ''
+        with open(in_full_path+'.pdf_tex', 'r') as f:
+            tex_src = f.read()
+
+        svg_stem = utils.src_hash('pdftex_', tex_src, '.svg')
+        svg_site_path = str(Path(svg_site_prefix, svg_stem))
+
+        # convert tikz to svg
+        # note: can safely ignore re-render since name is based on source hash
+        self.render_figure(
+            svg_stem,
+            utils.tex.pdftex2svg,
+            in_full_path+'.pdf_tex',
+            in_full_path+'.pdf'
         )
 
-        return nt
+        return '![{}]({})'.format(caption, svg_site_path)
 
     def transform_pdf_images(self, string):
         '''
@@ -932,44 +1026,6 @@ class Article:
         without anchors are ignored. The image body is replaced with match image numbers
         in a carousel.
         '''
-        def repl(m):
-            caption     = m.group(1)
-            link_target = m.group(2)
-            link        = link_regex.match('[[{}]]'.format(link_target))
-
-            if link:
-                title  = link.group(1) if link.group(1) else ''
-                anchor = link.group(2) if link.group(2) else ''
-
-                if Path(title).suffix != '.pdf': return m.group(0)
-                target = utils.title_to_fname(title)
-            else:
-                return m.group(0)
-            
-            target_rel = str(Path(target).relative_to('docs'))
-            img_path = Path('/home/smgr/Documents/notes/images/pdf/',target_rel)
-            url, pages = utils.wikipdf_to_link(target, anchor)
-            chtml = self.carousel_html(
-                '{} <i>(p. {})</i>'.format(target, anchor),
-                target_rel,
-                img_path,
-                hide=False,
-                pages=pages
-            )
-
-            chtml  = '<figure>' + chtml
-            chtml += '<figcaption aria-hidden="true">{}</figcaption>'.format(caption)
-            chtml += '</figure>'
-
-            return chtml
-
-        nt = re.sub(
-            #pattern=r'!\[(.*?)\]\((.*?\.pdf#.*?)\)',
-            pattern=r'!\[((?:[\s\S](?!!\[))*)\]\((docs\/.*?\.pdf#\d.*?)\)',
-            repl=repl,
-            string=string,
-            #flags=re.DOTALL
-        )
         # note: this pattern may be susceptible to overlapping image problems. Things get
         # murky with all applied transformations, but it's possible for an image target to
         # start a match, and finish at an arbitrary link tail that looks like
@@ -978,62 +1034,126 @@ class Article:
         # has yet to be processed (does yet start with "page="). A regular link to PDF
         # with anchor, for example, will already have been processed and prevent most of
         # these clashes.
+        return pdf_image_regex.sub(self.repl_pdf_image, string)
 
-        return nt
+    def repl_pdf_image(self, m):
+        caption     = m.group(1)
+        link_target = m.group(2)
+        link        = link_regex.match('[[{}]]'.format(link_target))
+
+        if link:
+            title  = link.group(1) if link.group(1) else ''
+            anchor = link.group(2) if link.group(2) else ''
+
+            if Path(title).suffix != '.pdf': return m.group(0)
+            target = utils.title_to_fname(title)
+        else:
+            return m.group(0)
+        
+        target_rel = str(Path(target).relative_to('docs'))
+        img_path = Path('/home/smgr/Documents/notes/images/pdf/',target_rel)
+        url, pages = utils.wikipdf_to_link(target, anchor)
+        chtml = self.carousel_html(
+            '{} <i>(p. {})</i>'.format(target, anchor),
+            target_rel,
+            img_path,
+            hide=False,
+            pages=pages
+        )
+
+        chtml  = '<figure>' + chtml
+        chtml += '<figcaption aria-hidden="true">{}</figcaption>'.format(caption)
+        chtml += '</figure>'
+
+        return chtml
 
     def transform_audio(self, string):
         '''
         Transforms .pdf_tex files that are linked within Markdown images
         '''
-        def repl(m):
-            caption = m.group(1)
-            wavfile = m.group(2)
+        return audio_regex.sub(self.repl_audio, string)
 
-            abs_notes_prefix = '/home/smgr/Documents/notes/'
+    def repl_audio(self, m):
+        caption = m.group(1)
+        wavfile = m.group(2)
 
-            # generate stem filename from source hash
-            abs_wav_path = Path(abs_notes_prefix, wavfile)
-            abs_vtt_path = abs_wav_path.with_suffix('.vtt')
+        abs_notes_prefix = '/home/smgr/Documents/notes/'
 
-            if not abs_vtt_path.exists(): pass
-                # do whisper.cpp processing; separate thread
-            
-            sub_html = ''
-            audio_name = abs_vtt_path.stem
+        # generate stem filename from source hash
+        abs_wav_path = Path(abs_notes_prefix, wavfile)
+        abs_vtt_path = abs_wav_path.with_suffix('.vtt')
 
-            if abs_vtt_path.exists():
-                rel_vtt_path = str(Path(wavfile).with_suffix('.vtt'))
-                sub_html += dedent(f'''
-                    <div class="rabbit-lyrics"
-                        data-media="[data-lyric-id='audio-{audio_name}']"
-                        data-vtt="{rel_vtt_path}">
-                    </div>''')
+        if not abs_vtt_path.exists(): pass
+            # do whisper.cpp processing; separate thread
+        
+        sub_html = ''
+        audio_name = abs_vtt_path.stem
 
+        if abs_vtt_path.exists():
+            rel_vtt_path = str(Path(wavfile).with_suffix('.vtt'))
             sub_html += dedent(f'''
-                <figcaption>
-                <audio data-lyric-id="audio-{audio_name}" controls>
-                    <source src="{wavfile}" type="audio/wav">
-                </audio>
-                </figcaption>''')
+                <div class="rabbit-lyrics"
+                    data-media="[data-lyric-id='audio-{audio_name}']"
+                    data-vtt="{rel_vtt_path}">
+                </div>''')
 
-            return f'<figure>{sub_html}<figcaption>{caption}</figcaption></figure>'
+        sub_html += dedent(f'''
+            <figcaption>
+            <audio data-lyric-id="audio-{audio_name}" controls>
+                <source src="{wavfile}" type="audio/wav">
+            </audio>
+            </figcaption>''')
 
+        return f'<figure>{sub_html}<figcaption>{caption}</figcaption></figure>'
 
-        nt = re.sub(
-            pattern=r'!\[((?:[\s\S](?!!\[))*)\]\((audio\/.*?\.wav)\)',
-            repl=repl,
-            string=string,
-            #flags=re.DOTALL
-        )
+    def transform_footnotes(self, string):
+        return footnote_regex.sub(self.repl_footnote, string)
 
-        return nt
+    def repl_footnote(self, m):
+        return '(fn{}) {}'.format(m.group(1),m.group(2))
 
-    def transform_footnotes(self, string):
-        return re.sub(
-            pattern=footnote_regex,
-            repl=lambda m:'(fn{}) {}'.format(m.group(1),m.group(2)),
-            string=string
-        )
+    def body_transforms(self, audio=False):
+        '''
+        (regex, repl) pairs applied to the article body after links, in order. Same as
+        calling `transform_task_headers(remove=True)`, `transform_tasks`,
+        `transform_tikz`, `transform_pdftex`, `transform_pdf_images` and, if `audio`,
+        `transform_audio`.
+        '''
+        rules = [
+            (task_header_regex, ''),
+            (task_line_regex,   self.repl_task),
+            (tikz_regex,        self.repl_tikz),
+            (tex_image_regex,   self.repl_tikz),
+            (pdftex_regex,      self.repl_pdftex),
+            (pdf_image_regex,   self.repl_pdf_image),
+        ]
+        if audio: rules.append((audio_regex, self.repl_audio))
+        return rules
+
+    def context_transforms(self):
+        '''(regex, repl) pairs applied to backlink contexts after links, in order.'''
+        return [
+            (tikz_regex,      self.repl_tikz),
+            (tex_image_regex, self.repl_tikz),
+            (pdftex_regex,    self.repl_pdftex),
+            (footnote_regex,  self.repl_footnote),
+            (pdf_image_regex, self.repl_pdf_image),
+        ]
+
+    def apply_transforms(self, string, rules, mode=None):
+        '''
+        Apply (regex, repl) `rules` to `string` as successive `regex.sub` calls. In
+        'gated' mode a rule is skipped when its `transform_triggers` entry doesn't occur
+        in the text it would run on; every match contains its trigger, so the output is
+        the same as in 'chain' mode. `mode` defaults to `transform_mode`.
+        '''
+        if mode is None: mode = self.transform_mode
+
+        for regex, repl in rules:
+            trigger = transform_triggers.get(regex) if mode == 'gated' else None
+            if trigger is not None and not trigger.search(string): continue
+            string = regex.sub(repl, string)
+        return string
 
     def add_reflinks(self, string):
         return string + '\n\n' + self.metadata.get('reflinks','')
@@ -1103,14 +1223,60 @@ class Article:
         if filters is None: filters = []
         
         otype = self.output_disambiguation()
-        cmd = ['pandoc', '--from', 'markdown', '--to', otype]
-        cmd += extra_args
-        cmd += [e for f in filters for e in ['-F', f]]
+        return pool.get_pool().convert(content,
+                                       to=otype,
+                                       frm='markdown',
+                                       extra_args=extra_args,
+                                       filters=filters)
 
-        c = subp.check_output(cmd, text=True, input=content, stderr=subp.DEVNULL)
-        return c
+    def convert_batch(self, chunks, suffix='', extra_args=None, filters=None, fast=False):
+        '''
+        Convert a list of Markdown chunks with a single conversion call. Chunks are
+        wrapped in `<!--@bpanja@...-->` markers, joined, converted, and split back
+        apart on the markers (just as `proto_convert_html` does for metadata). `suffix`
+        is appended once after all chunks, e.g. for shared reflink definitions.
+
+        Any chunk whose markers don't survive the conversion is converted on its own.
+        Not for use under citeproc: a single bibliography would be produced for the
+        batch (after the last marker), leaving every chunk without its references (see
+        `uses_citeproc`).
+        '''
+        if not chunks: return []
 
-    def convert_html(self, metamd=None, pdoc_args=None, filters=None, fast=False, graph=None):
+        def convert(content):
+            if fast:
+                return misaka.html(content)
+            return self.conversion_wrapper(content, extra_args=extra_args, filters=filters)
+
+        marked = '\n\n'.join([
+            '<!--@bpanja@s-{i}-->\n\n{c}\n\n<!--@bpanja@e-{i}-->'.format(i=i, c=c)
+            for i, c in enumerate(chunks)
+        ]) + '\n\n' + suffix
+
+        html = convert(marked)
+        split = {
+            int(m.group(1)): m.group(2)
+            for m in re.finditer(
+                r'<!--@bpanja@s-(\d+)-->\s*(.*?)\s*<!--@bpanja@e-\1-->',
+                html,
+                flags=re.DOTALL
+            )
+        }
+
+        out = []
+        for i, chunk in enumerate(chunks):
+            if i not in split:
+                print(Fore.YELLOW + '[batch marker lost] ' + Fore.RESET + '{}#{}'.format(self.name, i))
+                split[i] = convert(chunk + '\n\n' + suffix)
+            out.append(split[i])
+        return out
+
+    @staticmethod
+    def uses_citeproc(args):
+        '''Whether pandoc `args` enable citation processing.'''
+        return any(arg in ('-C', '--citeproc') for arg in args)
+
+    def convert_html(self, metamd=None, pdoc_args=None, filters=None, fast=False, graph=None, batch=None):
         print('reg convert html')
         if metamd is None: metamd = []
         if pdoc_args is None: pdoc_args = []
@@ -1120,17 +1286,16 @@ class Article:
             pdoc_args.append('--toc')
             pdoc_args.append('--toc-depth=4')
 
+        # builds are left to page conversion for articles parsed without them
+        if not self.builds: self.submit_builds()
+
         self.html = {}
         self.html.update(self.metadata)
         
         # these should really become pandoc filters, move function pandocfilters filters
         # in regular location; can be location for all future modifiers (like tikz!)
         content = self.transform_links(self.content, graph=graph)
-        content = self.transform_task_headers(content, remove=True)
-        content = self.transform_tasks(content)
-        content = self.transform_tikz(content)
-        content = self.transform_pdftex(content)
-        content = self.transform_pdf_images(content)
+        content = self.apply_transforms(content, self.body_transforms())
 
         try:
             if fast:
@@ -1160,15 +1325,32 @@ class Article:
             '-M link-bibliography', 
         ]
 
-        # convert backlinks
-        for linklist in self.linkdata.values():
-            for link in linklist:
+        # convert backlinks. contexts are batched into one conversion unless citeproc
+        # runs on them, as each needs its own bibliography
+        if batch is None:
+            batch = fast or not self.uses_citeproc(mmd_args)
+
+        links = [link for linklist in self.linkdata.values() for link in linklist]
+        context_rules = self.context_transforms()
+        if batch:
+            contexts = []
+            for link in links:
                 context = self.transform_links(link['context'])
-                context = self.transform_tikz(context)
-                context = self.transform_pdftex(context)
-                context = self.transform_footnotes(context)
+                context = self.apply_transforms(context, context_rules)
+                contexts.append(context)
+
+            # reflink definitions are shared by all contexts, only append them once
+            for link, html in zip(links, self.convert_batch(contexts,
+                                                            suffix=self.add_reflinks(''),
+                                                            extra_args=mmd_args,
+                                                            filters=filters,
+                                                            fast=fast)):
+                link['html'] = html
+        else:
+            for link in links:
+                context = self.transform_links(link['context'])
+                context = self.apply_transforms(context, context_rules)
                 context = self.add_reflinks(context)
-                context = self.transform_pdf_images(context)
                 context += '\n'+self.metadata['reflinks'] if self.metadata.get('reflinks') else ''
                 if fast:
                     link['html'] = misaka.html(context)
@@ -1208,6 +1390,9 @@ class Article:
             pdoc_args.append('--toc')
             pdoc_args.append('--toc-depth=4')
 
+        # builds are left to page conversion for articles parsed without them
+        if not self.builds: self.submit_builds()
+
         self.html = {}
         self.html.update(self.metadata)
         
@@ -1225,12 +1410,7 @@ class Article:
         marked_html = marked_metadata + '\n'.join(self.marked_lines)
 
         content = self.transform_links(marked_html, graph=graph)
-        content = self.transform_task_headers(content, remove=True)
-        content = self.transform_tasks(content)
-        content = self.transform_tikz(content)
-        content = self.transform_pdftex(content)
-        content = self.transform_pdf_images(content)
-        content = self.transform_audio(content)
+        content = self.apply_transforms(content, self.body_transforms(audio=True))
 
         try:
             if fast:
@@ -1305,3 +1485,39 @@ class Article:
                     flags=re.DOTALL
                 )
                 if m: self.html[key] = m.group(1)
+
+
+if __name__ == '__main__':
+    # position lookup benchmark: python -m panja.article <note.md> [...]
+    import sys
+    from time import perf_counter
+
+    for path in sys.argv[1:]:
+        article = Article(path, Path(path).stem, verbose=False)
+        string = article.content
+        starts = [m.start() for m in link_regex.finditer(string)]
+
+        t0 = perf_counter()
+        old = [(string.count('\n', 0, s)+1, s - string.rfind('\n', 0, s)) for s in starts]
+        t1 = perf_counter()
+        index = utils.LineIndex(string)
+        new = [index.position(s) for s in starts]
+        t2 = perf_counter()
+
+        assert old == new
+        print('{}: {} chars, {} links | count/rfind {:.2f}ms | line index {:.2f}ms ({:.0f}x)'.format(
+            article.name, len(string), len(starts),
+            1000*(t1-t0), 1000*(t2-t1), (t1-t0)/max(t2-t1, 1e-9)))
+
+        # wikilink rendering benchmark, per-match title_to_link vs cached resolver
+        t0 = perf_counter()
+        old = link_regex.sub(lambda x: utils.title_to_link(x, ''), string)
+        t1 = perf_counter()
+        resolver = utils.LinkResolver()
+        new = link_regex.sub(lambda x: resolver.link(x, ''), string)
+        t2 = perf_counter()
+
+        assert old == new
+        print('{}: {} links | title_to_link {:.2f}ms | resolver {:.2f}ms ({:.0f}x)'.format(
+            article.name, len(starts),
+            1000*(t1-t0), 1000*(t2-t1), (t1-t0)/max(t2-t1, 1e-9)))
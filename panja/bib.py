@@ -0,0 +1,154 @@
+import re
+import threading
+from pathlib import Path
+
+BIB_PATH  = '/home/smgr/Documents/notes/docs/docsyncbib.bib'
+WIKI_PATH = '/home/smgr/Documents/notes/'
+
+BIBTEX_ENTRY_REGEX   = re.compile('^@.*{(.*),\n[\s\S]*?\n}',re.MULTILINE)
+BIBTEX_FILE_REGEX    = re.compile('^[^\S\r\n]*?file[^\S\r\n]*?=[^\S\r\n]*?{(.*)}',re.MULTILINE)
+BIBTEX_APATH_REGEX   = re.compile('^[^\S\r\n]*?archive_path[^\S\r\n]*?=[^\S\r\n]*?{(.*)}',re.MULTILINE)
+BIBTEX_AURL_REGEX    = re.compile('^[^\S\r\n]*?archive_url[^\S\r\n]*?=[^\S\r\n]*?{(.*)}',re.MULTILINE)
+BIBTEX_INF_URL_REGEX = re.compile('^[^\S\r\n]*?url[^\S\r\n]*?=[^\S\r\n]*?{(.*)}',re.MULTILINE)
+
+
+def parse_entries(content):
+    '''
+    Parse raw BibTeX into a list of entry dicts. Attribute values are left exactly as
+    they appear in the file (empty string if absent); consumers normalize as needed.
+    '''
+    entries = []
+    for m in BIBTEX_ENTRY_REGEX.finditer(content):
+        bibtex = m.group(0)
+        attrs = {}
+        for key, regex in [('file', BIBTEX_FILE_REGEX),
+                           ('archive_path', BIBTEX_APATH_REGEX),
+                           ('archive_url', BIBTEX_AURL_REGEX),
+                           ('url', BIBTEX_INF_URL_REGEX)]:
+            am = regex.search(bibtex)
+            attrs[key] = am.group(1) if am else ''
+
+        entries.append({'citekey': m.group(1), 'bibtex': bibtex, **attrs})
+    return entries
+
+
+class BibIndex:
+    '''
+    Parsed view of a BibTeX file, indexed by citekey, source file, archive_url and
+    (inferred) url. The file is parsed lazily on first use and only re-parsed when its
+    mtime or size changes, so it can be shared by every Article in a process (see
+    `get_index`).
+    '''
+    def __init__(self, bib_path):
+        self.bib_path = Path(bib_path)
+        self.fingerprint = None
+        self.lock = threading.Lock()
+
+        self.entries    = []
+        self.by_citekey = {}
+        self.by_file    = {}
+        self.by_url     = {}
+        self.by_inf_url = {}
+
+    def refresh(self, force=False):
+        '''Re-parse the bib file if it changed on disk since the last parse.'''
+        try:
+            st = self.bib_path.stat()
+            fingerprint = (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            fingerprint = None
+
+        with self.lock:
+            if not force and self.fingerprint is not None and fingerprint == self.fingerprint:
+                return self
+
+            content = self.bib_path.read_text() if fingerprint is not None else ''
+            self.entries = parse_entries(content)
+            self.by_citekey = {}
+            self.by_file    = {}
+            self.by_url     = {}
+            self.by_inf_url = {}
+
+            for entry in self.entries:
+                self.by_citekey[entry['citekey']] = entry
+                if entry['file']:
+                    self.by_file[str(Path(entry['file']))] = entry
+                if entry['archive_url'].strip():
+                    self.by_url[entry['archive_url'].strip()] = entry
+                if entry['url'].strip():
+                    self.by_inf_url[entry['url'].strip()] = entry
+
+            self.fingerprint = fingerprint
+        return self
+
+    def lookup(self, source=None, citekey=None, url=None, wiki_path=WIKI_PATH):
+        '''
+        Find the entry for a note given its `source`, `citekey` and `url` metadata.
+        Returns a fresh dict with `source` (relative to `wiki_path`), `citekey`, `url`,
+        `inf_url` and `bibtex` keys, or `{}` if nothing matches.
+        '''
+        self.refresh()
+
+        source  = source.strip() if source is not None else ''
+        citekey = citekey.strip() if citekey is not None else ''
+        url     = url.strip() if url is not None else ''
+
+        # feed pages mostly defined around a URL
+        entry = None
+        canonical = 'url'
+        if citekey:
+            entry = self.by_citekey.get(citekey)
+
+        if url and not entry:
+            entry = self.by_url.get(url)
+
+        if url and not entry:
+            entry = self.by_inf_url.get(url)
+            # archive_url did not match url in the file; set canonical URL to the
+            # inferred one, since this is what matches the url in the file.
+            canonical = 'inf_url'
+
+        if source and not entry:
+            m = re.match(r'(?:\[\[)?([^\]\[]*)(?:\]\])?', source)
+            if m:
+                entry = self.by_file.get(str(Path(wiki_path, m.group(1))))
+
+            # url in document did not match either archive_url or the inferred url.
+            # Default to keeping the archive_url since this is more accurate; if no
+            # archive_url is defined, use inf_url as there's good evidence this url is
+            # related to the file
+            canonical = 'url'
+            if entry is not None and not entry['archive_url'].strip():
+                canonical = 'inf_url'
+
+        if entry is None: return {}
+
+        try:
+            bib_source = str(Path(entry['file']).relative_to(wiki_path)) if entry['file'] else ''
+        except ValueError:
+            bib_source = ''
+
+        res = {
+            'source':  bib_source,
+            'citekey': entry['citekey'],
+            'url':     entry['archive_url'].strip(),
+            'inf_url': entry['url'].strip(),
+            'bibtex':  entry['bibtex'],
+        }
+        res['url'] = res[canonical]
+        return res
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_index(bib_path=BIB_PATH, force=False):
+    '''
+    Process-wide `BibIndex` for `bib_path`, refreshed if the file changed. `force`
+    re-parses regardless, e.g. right after writing the file.
+    '''
+    key = str(Path(bib_path).expanduser().resolve())
+    with _indexes_lock:
+        if key not in _indexes:
+            _indexes[key] = BibIndex(key)
+    return _indexes[key].refresh(force=force)
@@ -0,0 +1,460 @@
+import re
+import subprocess as subp
+
+import pandocfilters as pf
+
+ATX_REGEX        = re.compile(r'^(#{1,6})(?:[ \t]+(.*?))?(?:[ \t]+#+)?[ \t]*$')
+FENCE_REGEX      = re.compile(r'^(`{3,}|~{3,})(.*)$')
+HR_REGEX         = re.compile(r'^(?:(?:\*[ \t]*){3,}|(?:-[ \t]*){3,}|(?:_[ \t]*){3,})$')
+SETEXT_REGEX     = re.compile(r'^(?:=+|-+)[ \t]*$')
+BULLET_REGEX     = re.compile(r'^([-+*])(?=[ \t]|$)')
+ORDERED_REGEX    = re.compile(r'^(\d{1,9})([.)])(?=[ \t]|$)')
+REFDEF_REGEX     = re.compile(r'''^ {0,3}\[(?:[^\]\[\\]|\\.)*\S(?:[^\]\[\\]|\\.)*\]:[ \t]*(?:<[^<>\n]*>|[^\s<]\S*)'''
+                              r'''(?:[ \t]+(?:"[^"]*"|'[^']*'|\([^()]*\)))?[ \t]*$''')
+
+HTML_BLOCK_TAGS = (
+    'address|article|aside|base|basefont|blockquote|body|caption|center|col|colgroup|'
+    'dd|details|dialog|dir|div|dl|dt|fieldset|figcaption|figure|footer|form|frame|'
+    'frameset|h[1-6]|head|header|hr|html|iframe|legend|li|link|main|menu|menuitem|nav|'
+    'noframes|ol|optgroup|option|p|param|search|section|summary|table|tbody|td|tfoot|'
+    'th|thead|title|tr|track|ul'
+)
+HTML_ATTR = r'''\s+[A-Za-z_:][\w.:-]*(?:\s*=\s*(?:[^\s"'=<>`]+|'[^']*'|"[^"]*"))?'''
+
+# (start regex, end regex) per CommonMark HTML block type; an end of None means
+# the block runs until a blank line
+HTML_BLOCKS = [
+    (re.compile(r'^<(?:script|pre|style|textarea)(?:\s|>|$)', re.I),
+     re.compile(r'</(?:script|pre|style|textarea)>', re.I)),
+    (re.compile(r'^<!--'), re.compile(r'-->')),
+    (re.compile(r'^<\?'), re.compile(r'\?>')),
+    (re.compile(r'^<![A-Za-z]'), re.compile(r'>')),
+    (re.compile(r'^<!\[CDATA\['), re.compile(r'\]\]>')),
+    (re.compile(r'^</?(?:{})(?:\s|/?>|$)'.format(HTML_BLOCK_TAGS), re.I), None),
+    (re.compile(r'^(?:<[A-Za-z][A-Za-z0-9-]*(?:{})*\s*/?>|</[A-Za-z][A-Za-z0-9-]*\s*>)\s*$'.format(HTML_ATTR)), None),
+]
+
+CONTAINERS = ('document', 'blockquote', 'list', 'item')
+ACCEPTS_LINES = ('para', 'fenced', 'indented', 'html')
+
+
+class Block:
+    def __init__(self, kind, start, parent=None):
+        self.kind = kind
+        self.start = start
+        self.end = None
+        self.last = start[0]
+        self.parent = parent
+        self.children = []
+        self.open = True
+
+        self.lines = []
+        self.offs = []
+        self.text = ''
+        self.data = {}
+
+
+class BlockScanner:
+    '''
+    In-process scanner for the CommonMark block structure of a note. It follows the
+    spec's two-phase line algorithm closely enough to recover the blocks pandoc
+    reports with `commonmark+sourcepos` (headings, lists and their items, paragraphs),
+    including the source ranges used for backlink contexts, without building any
+    inline content.
+
+    Block ranges follow commonmark-hs: a block closed by a line it can't absorb ends
+    at column 1 of that line; single-line blocks end at the start of the next line.
+
+    :param lines: source lines, with or without trailing newlines
+    :param eof:   position reported for blocks still open at the end of input; by
+                  default the start of the line after the last one
+    '''
+    def __init__(self, lines, eof=None):
+        self.lines = [l.rstrip('\n').rstrip('\r') for l in lines]
+        self.eof = eof if eof is not None else (len(self.lines)+1, 1)
+
+        self.doc = Block('document', (1, 1))
+        self.tip = self.doc
+        self.ln = 0
+
+    def scan(self):
+        for i, line in enumerate(self.lines):
+            self.ln = i+1
+            self.add_line(line.expandtabs(4))
+
+        while self.tip is not None:
+            self.finalize(self.tip, self.eof)
+        return self.doc
+
+    def after(self):
+        '''Position right after the current line.'''
+        return (self.ln+1, 1) if self.ln < len(self.lines) else self.eof
+
+    def add_line(self, line):
+        blank = not line.strip()
+        off = 0
+
+        # phase 1: walk down the open blocks the line continues
+        container = self.doc
+        while container.children and container.children[-1].open:
+            child = container.children[-1]
+            noff = self.continues(child, line, off, blank)
+            if noff is None: break
+            container, off = child, noff
+            if container.kind not in CONTAINERS: break
+
+        last_matched = container
+        all_matched = container is self.tip
+
+        # fenced code consumes its closing fence
+        if container.kind == 'fenced' and container.data.get('closing'):
+            self.add_text(container, line, off, blank)
+            self.finalize(container, self.after())
+            return
+
+        # phase 2: open new blocks
+        started = False
+        while container.kind not in ('fenced', 'indented', 'html'):
+            rest = line[off:]
+            stripped = rest.lstrip(' ')
+            indent = len(rest) - len(stripped)
+            nxt = off + indent
+            col = (self.ln, nxt+1)
+
+            if not stripped:
+                break
+
+            if indent >= 4:
+                if self.tip.kind != 'para':
+                    self.close_unmatched(last_matched)
+                    container = self.add_child('indented', (self.ln, off+5), container)
+                    off += 4
+                    started = True
+                break
+
+            if stripped.startswith('>'):
+                self.close_unmatched(last_matched)
+                off = nxt+1
+                if line[off:off+1] == ' ': off += 1
+                container = self.add_child('blockquote', col, container)
+                last_matched = container
+                started = True
+                continue
+
+            m = ATX_REGEX.match(stripped)
+            if m:
+                self.close_unmatched(last_matched)
+                block = self.add_child('heading', col, container)
+                text = m.group(2) or ''
+                block.text = '' if re.fullmatch(r'#*', text.strip()) else text
+                self.finalize(block, self.after())
+                return
+
+            m = FENCE_REGEX.match(stripped)
+            if m and not (m.group(1)[0] == '`' and '`' in m.group(2)):
+                self.close_unmatched(last_matched)
+                block = self.add_child('fenced', col, container)
+                block.data = {'char': m.group(1)[0], 'len': len(m.group(1)), 'indent': indent}
+                return
+
+            html = self.html_start(stripped, container.kind == 'para' or self.tip.kind == 'para')
+            if html is not None:
+                self.close_unmatched(last_matched)
+                block = self.add_child('html', col, container)
+                block.data = {'end': HTML_BLOCKS[html][1]}
+                self.add_text(block, line, off, blank)
+                self.html_end(block, line)
+                return
+
+            if container.kind == 'para' and all_matched and SETEXT_REGEX.match(stripped):
+                self.strip_refdefs(container)
+                if container.lines:
+                    container.kind = 'heading'
+                    container.text = ' '.join(l.strip() for l in container.lines)
+                    container.last = self.ln
+                    self.finalize(container, self.after())
+                    return
+
+            if HR_REGEX.match(stripped):
+                self.close_unmatched(last_matched)
+                block = self.add_child('hr', col, container)
+                self.finalize(block, self.after())
+                return
+
+            item = self.item_start(line, nxt, container)
+            if item is not None:
+                key, width, empty = item
+                self.close_unmatched(last_matched)
+                if container.kind != 'list' or container.data['key'] != key:
+                    container = self.add_child('list', col, container)
+                    container.data = {'key': key}
+                container = self.add_child('item', col, container)
+                # content column relative to the parent's, counting the marker's indent
+                container.data = {'width': nxt - off + width, 'empty': empty}
+                last_matched = container
+                off = nxt + width
+                started = True
+                continue
+
+            break
+
+        # phase 3: add the rest of the line
+        if not started and not all_matched and not blank and self.tip.kind == 'para':
+            # lazy paragraph continuation
+            self.add_text(self.tip, line, off, blank)
+            return
+
+        self.close_unmatched(last_matched)
+        if container.kind in ACCEPTS_LINES:
+            self.add_text(container, line, off, blank)
+            if container.kind == 'html':
+                self.html_end(container, line)
+        elif line[off:].strip():
+            rest = line[off:]
+            block = self.add_child('para', (self.ln, off + len(rest) - len(rest.lstrip(' ')) + 1), container)
+            self.add_text(block, line, off, blank)
+
+    def continues(self, block, line, off, blank):
+        rest = line[off:]
+        indent = len(rest) - len(rest.lstrip(' '))
+
+        if block.kind == 'list':
+            return off
+        if block.kind == 'blockquote':
+            if indent <= 3 and rest.lstrip(' ').startswith('>'):
+                off += indent+1
+                return off+1 if line[off:off+1] == ' ' else off
+            return None
+        if block.kind == 'item':
+            if blank:
+                # an item can begin with at most one blank line
+                if block.data['empty'] and not block.children: return None
+                return off + min(indent, block.data['width'])
+            if indent >= block.data['width']:
+                return off + block.data['width']
+            return None
+        if block.kind == 'para':
+            return None if blank else off
+        if block.kind == 'indented':
+            if blank: return off + min(indent, 4)
+            return off+4 if indent >= 4 else None
+        if block.kind == 'fenced':
+            stripped = rest.lstrip(' ')
+            fence = block.data
+            if indent <= 3 and re.fullmatch(r'{}{{{},}}[ \t]*'.format(re.escape(fence['char']), fence['len']), stripped):
+                fence['closing'] = True
+            return off + min(indent, fence['indent'])
+        if block.kind == 'html':
+            if blank and block.data['end'] is None: return None
+            return off
+        return None
+
+    @staticmethod
+    def html_start(stripped, in_para):
+        for i, (start, _) in enumerate(HTML_BLOCKS):
+            if not start.match(stripped): continue
+            # type 7 blocks can't interrupt a paragraph
+            if i == 6 and in_para: return None
+            return i
+        return None
+
+    def html_end(self, block, line):
+        if block.data['end'] is not None and block.data['end'].search(line):
+            self.finalize(block, self.after())
+
+    def item_start(self, line, nxt, container):
+        rest = line[nxt:]
+        m = BULLET_REGEX.match(rest)
+        if m:
+            key = m.group(1)
+        else:
+            m = ORDERED_REGEX.match(rest)
+            if m is None: return None
+            if container.kind == 'para' and m.group(1) != '1': return None
+            key = m.group(2)
+
+        after = rest[m.end():]
+        empty = not after.strip()
+        if container.kind == 'para' and empty: return None
+
+        spaces = len(after) - len(after.lstrip(' '))
+        if empty or spaces > 4: spaces = 1
+        return key, m.end() + spaces, empty
+
+    def add_child(self, kind, start, container):
+        # close blocks that can't hold the new one (e.g. a paragraph)
+        while not self.can_contain(container, kind):
+            nxt = container.parent
+            self.finalize(container, (self.ln, 1))
+            container = nxt
+
+        block = Block(kind, start, container)
+        container.children.append(block)
+        self.tip = block
+        return block
+
+    @staticmethod
+    def can_contain(parent, kind):
+        if parent.kind == 'list': return kind == 'item'
+        if parent.kind in ('document', 'blockquote', 'item'): return kind != 'item'
+        return False
+
+    def add_text(self, block, line, off, blank):
+        block.lines.append(line[off:])
+        block.offs.append(off)
+        if not blank or block.kind in ('fenced', 'html'):
+            node = block
+            while node is not None:
+                node.last = self.ln
+                node = node.parent
+
+    def close_unmatched(self, last_matched):
+        while self.tip is not last_matched and self.tip is not None:
+            self.finalize(self.tip, (self.ln, 1))
+
+    def finalize(self, block, end):
+        block.open = False
+        block.end = end
+        self.tip = block.parent
+
+        if block.kind == 'para':
+            self.strip_refdefs(block)
+            if not block.lines:
+                block.parent.children.remove(block)
+
+        if block.kind == 'list':
+            block.data['loose'] = self.is_loose(block)
+
+    @staticmethod
+    def strip_refdefs(para):
+        # leading link reference definitions don't produce any output
+        drop = 0
+        while drop < len(para.lines) and REFDEF_REGEX.match(para.lines[drop]):
+            drop += 1
+        if drop:
+            del para.lines[:drop]
+            del para.offs[:drop]
+            para.data['skip'] = para.data.get('skip', 0) + drop
+
+    @staticmethod
+    def is_loose(lst):
+        items = lst.children
+        for a, b in zip(items, items[1:]):
+            if b.start[0] > a.last + 1: return True
+        for item in items:
+            for a, b in zip(item.children, item.children[1:]):
+                if b.start[0] > a.last + 1: return True
+        return False
+
+
+def walk(doc):
+    '''
+    Pre-order walk over the scanned blocks in pandoc's order: all items of a list are
+    visited before the contents of any of them.
+    '''
+    stack = [doc]
+    while stack:
+        block = stack.pop()
+        yield block
+
+        if block.kind == 'list':
+            stack.extend(reversed([c for item in block.children for c in item.children]))
+        else:
+            stack.extend(reversed(block.children))
+
+
+def scan(lines, eof=None):
+    '''
+    Block structure events for the Markdown `lines` (as returned by `readlines`). Each
+    event is one of
+
+    - `('header', text)`
+    - `('list', items)`, with the `((sl,sc),(el,ec))` range of each whole item (from
+      its marker through its last child), or None for an empty item
+    - `('para', ((sl,sc),(el,ec)))`, with the range of the paragraph's text
+
+    in the same order and with the same positions as `pandoc_events`.
+    '''
+    # commonmark-hs reads the input as ending in a newline followed by one more empty
+    # line, which open items absorb; items still open at the end close after it
+    doc = BlockScanner(list(lines)+[''], eof).scan()
+    events = []
+
+    for block in walk(doc):
+        if block.kind == 'heading':
+            events.append(('header', ' '.join(block.text.split())))
+
+        elif block.kind == 'list':
+            events.append(('list', [
+                (item.start, item.end) if item.children else None
+                for item in block.children
+            ]))
+
+        elif block.kind == 'para':
+            parent = block.parent
+            if parent.kind == 'item' and not parent.parent.data.get('loose'):
+                continue  # tight list content is Plain, not Para
+
+            first, last = block.lines[0], block.lines[-1]
+            sl = block.start[0] + block.data.get('skip', 0)
+            sc = block.offs[0] + len(first) - len(first.lstrip()) + 1
+            el = sl + len(block.lines) - 1
+            ec = block.offs[-1] + len(last.rstrip()) + 1
+            events.append(('para', ((sl, sc), (el, ec))))
+
+    return events
+
+
+def pandoc_events(path):
+    '''
+    Block structure events for the file at `path`, as reported by pandoc's
+    `commonmark+sourcepos` reader. Slow (one pandoc process per call); mainly kept to
+    verify `scan`.
+    '''
+    events = []
+
+    def comp(key, value, format, meta):
+        if key == 'Header':
+            title = []
+            for v in value[2]:
+                for vc in v['c'][1:]:
+                    outer = vc
+                    if type(outer) == str:
+                        title.append(outer)
+                        continue
+                    elif type(outer[0]) == str:
+                        title.append(outer[0])
+                        continue
+                    elif 'c' in outer[0]:
+                        title.append(outer[0]['c'])
+                    else:
+                        title.append(' ')
+
+            events.append(('header', ''.join([str(s) for s in title])))
+
+        if key == 'BulletList' or key == 'OrderedList':
+            v = value if key == 'BulletList' else value[1]
+
+            items = []
+            for item in v:
+                if not item:
+                    items.append(None)
+                    continue
+
+                pos = item[0]['c'][0][2][0][1].split('@')[-1].split('-')
+                items.append((_pos(pos[0]), _pos(pos[-1])))
+            events.append(('list', items))
+
+        if key == 'Para':
+            start = value[0]['c'][0][2][0][1].split('@')[-1].split('-')[0]
+            end   = value[-1]['c'][0][2][0][1].split('@')[-1].split('-')[-1]
+            events.append(('para', (_pos(start), _pos(end))))
+
+    cm = subp.check_output(["pandoc", "--from", "commonmark+sourcepos", "--to", "json", str(path)])
+    pf.applyJSONFilters([comp], cm)
+
+    return events
+
+
+def _pos(s):
+    return tuple(map(int, s.split(':')))
@@ -0,0 +1,177 @@
+import json
+import atexit
+import hashlib
+import threading
+import multiprocessing.util
+from pathlib import Path
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor
+
+from colorama import Fore
+
+from . import convert
+from .cache import atomic_open, file_lock
+
+WIKI_PATH  = Path('/home/smgr/Documents/notes/')
+BUILD_PATH = Path(WIKI_PATH, 'build')
+
+
+class BuildQueue:
+    '''
+    Deferred queue for `convert.alias_map` PDF builds. Articles only record their
+    build targets while parsing; `submit` schedules the actual build on a bounded
+    pool of `workers` threads (each build is a pandoc/xelatex subprocess).
+
+    A build is skipped when its output exists and the digest of the source file and
+    target recipe matches the one recorded after the last successful build. Digests
+    are kept in a JSON manifest under `build_path`, shared with other processes
+    (e.g. forked workers): each save merges this process's new entries into the file
+    on disk.
+
+    Job states are `queued`, `running`, `done`, `current` (up to date, skipped) and
+    `failed`; see `status`.
+    '''
+    def __init__(self, workers=2, build_path=BUILD_PATH):
+        self.build_path = Path(build_path)
+        self.manifest_path = Path(self.build_path, '.build-manifest.json')
+        self.lock_path = Path(self.build_path, '.build-manifest.lock')
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+
+        self.jobs = {}
+        self.futures = {}
+        self.manifest = self.load_manifest()
+        self.recorded = {}
+
+    def load_manifest(self):
+        try:
+            with open(self.manifest_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_manifest(self):
+        '''
+        Write the entries recorded by this process over the manifest on disk, keeping
+        the ones other processes saved since it was loaded.
+        '''
+        self.build_path.mkdir(parents=True, exist_ok=True)
+        with file_lock(self.lock_path):
+            manifest = self.load_manifest()
+            with self.lock:
+                manifest.update(self.recorded)
+                self.manifest.update(manifest)
+            with atomic_open(self.manifest_path, 'w') as f:
+                json.dump(manifest, f)
+
+    @staticmethod
+    def digest(src, tgt):
+        '''Digest of the source file contents and the target's pandoc command.'''
+        h = hashlib.sha1()
+        h.update(' '.join(convert.alias_map[tgt].recipe()).encode('utf-8'))
+        h.update(b'\0')
+        h.update(Path(src).read_bytes())
+        return h.hexdigest()
+
+    def is_current(self, src, tgt, outfile):
+        entry = self.manifest.get(str(outfile))
+        if entry is None or not Path(outfile).exists(): return False
+        try:
+            return entry == self.digest(src, tgt)
+        except OSError:
+            return False
+
+    def submit(self, src, tgt, outfile):
+        '''
+        Schedule building `outfile` from `src` with target `tgt`. Returns immediately;
+        a job already queued or running for the same output is not duplicated.
+        '''
+        key = str(outfile)
+        with self.lock:
+            job = self.jobs.get(key)
+            if job is not None and job['state'] in ('queued', 'running'):
+                return job
+
+            job = {'source': str(src), 'target': tgt, 'state': 'queued', 'elapsed': None}
+            self.jobs[key] = job
+            self.futures[key] = self.executor.submit(self._build, key, src, tgt, outfile)
+        return job
+
+    def _build(self, key, src, tgt, outfile):
+        job = self.jobs[key]
+        if self.is_current(src, tgt, outfile):
+            job['state'] = 'current'
+            return job
+
+        job['state'] = 'running'
+        start = perf_counter()
+        try:
+            digest = self.digest(src, tgt)
+            Path(outfile).parent.mkdir(parents=True, exist_ok=True)
+            out = convert.alias_map[tgt](str(src), str(outfile))
+        except Exception as e:
+            print(Fore.RED + '[build failed] ' + Fore.RESET + '{} ({})'.format(key, e))
+            out = False
+        job['elapsed'] = perf_counter() - start
+
+        if not out:
+            job['state'] = 'failed'
+            return job
+
+        job['state'] = 'done'
+        with self.lock:
+            self.manifest[key] = digest
+            self.recorded[key] = digest
+        self.save_manifest()
+        return job
+
+    def status(self, outfile=None):
+        '''
+        Job info for `outfile`, or for all outputs submitted in this process if None.
+        Outputs never submitted but built previously report `built`.
+        '''
+        if outfile is None:
+            with self.lock:
+                return {k: dict(v) for k, v in self.jobs.items()}
+
+        key = str(outfile)
+        job = self.jobs.get(key)
+        if job is not None: return dict(job)
+        if key in self.manifest and Path(outfile).exists():
+            return {'state': 'built'}
+        return {'state': 'missing'}
+
+    def wait(self):
+        '''Block until every submitted build has finished.'''
+        for future in list(self.futures.values()):
+            future.result()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+_queue = None
+
+def get_queue(**kwargs):
+    '''Process-wide build queue, created on first use with `kwargs`.'''
+    global _queue
+    if _queue is None:
+        _queue = BuildQueue(**kwargs)
+        atexit.register(_queue.close)
+    return _queue
+
+def close():
+    '''Finish pending builds and stop the process-wide queue, if it was created.'''
+    if _queue is not None:
+        _queue.close()
+
+def reset_worker():
+    '''
+    Forget the queue inherited by a forked `multiprocessing.Pool` worker, whose threads
+    don't exist in the child. A queue the worker creates is finished by a finalizer
+    when the worker exits normally (after `Pool.close` and `join`); atexit hooks
+    don't run there.
+    '''
+    global _queue
+    _queue = None
+    multiprocessing.util.Finalize(None, close, exitpriority=10)
@@ -1,7 +1,13 @@
 import os
+import stat
+import fcntl
+import pickle as stdpickle
+import sqlite3
+import hashlib
+import tempfile
+from contextlib import contextmanager
 import dill as pickle
 from pathlib import Path
-from datetime import datetime
 
 # can elect to only update backlink pages (based on modified times) when the user requests
 # the backlink buffer i.e. not doing it automatically as they write to files in the wiki.
@@ -26,6 +32,64 @@ from datetime import datetime
 ## loaded).
 
 
+def file_mode(path):
+    '''Permission bits of `path`, or those a new file would get under the umask.'''
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except OSError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+@contextmanager
+def atomic_open(path, mode='wb'):
+    '''
+    Open a temporary file next to `path` for writing and atomically move it into place
+    on successful exit (after flushing and fsyncing), so readers only ever see the old
+    or the new complete file. The temporary file is removed if writing fails. The new
+    file keeps the mode of the one it replaces, or gets the usual umask default.
+    '''
+    path = Path(path)
+    fd, tmp = tempfile.mkstemp(dir=str(path.parent), prefix='.'+path.name+'.', suffix='.tmp')
+    try:
+        # mkstemp creates the file as 0600
+        os.fchmod(fd, file_mode(path))
+        with os.fdopen(fd, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, str(path))
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+    # persist the rename itself
+    try:
+        dfd = os.open(str(path.parent), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dfd)
+    except OSError:
+        pass
+    finally:
+        os.close(dfd)
+
+@contextmanager
+def file_lock(path):
+    '''
+    Hold an exclusive `flock` on `path` (created if missing) for the duration of the
+    block, e.g. around a read-merge-write of a file shared between processes.
+    '''
+    with open(path, 'a') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
 class Cache:
     def __init__(self, name, path, default=None):
         self.name = name
@@ -35,7 +99,7 @@ class Cache:
         self.obj = None
         self.file = Path(path, name)
         self.file = self.file.with_suffix(self.file.suffix + ".pkl")
-        self.rtime = -1
+        self.fingerprint = None
 
         Path(path).mkdir(parents=True, exist_ok=True)
         self.file.touch()
@@ -43,21 +107,277 @@ class Cache:
         # if not self.file.exists():
         # raise FileNotFoundError('Cache "{}" not found at cache path {}'.format(self.name, self.path))
 
+    def stat_fingerprint(self):
+        '''
+        (inode, mtime_ns, size) of the cache file. Writes replace the file, so the inode
+        changes on every write even when mtime granularity is coarse.
+        '''
+        try:
+            st = self.file.stat()
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def changed(self):
+        '''Check if the file on disk differs from what was last loaded or written.'''
+        return self.stat_fingerprint() != self.fingerprint
+
     def load(self):
-        if self.rtime < self.file.stat().st_mtime:
-            if self.file.stat().st_size == 0:
-                if self.default is not None:
-                    self.obj = self.default()
-                    return self.obj
-                else:
-                    return None
-            with self.file.open("rb") as f:
-                self.obj = pickle.load(f)
-            self.rtime = datetime.now().timestamp()
+        fingerprint = self.stat_fingerprint()
+        if fingerprint == self.fingerprint and fingerprint is not None:
+            return self.obj
+
+        if fingerprint is None or fingerprint[2] == 0:
+            self.fingerprint = fingerprint
+            if self.default is not None:
+                self.obj = self.default()
+                return self.obj
+            else:
+                return None
+
+        with self.file.open("rb") as f:
+            # fingerprint the open file, not the path, in case it's replaced mid-read
+            st = os.fstat(f.fileno())
+            self.obj = pickle.load(f)
+        self.fingerprint = (st.st_ino, st.st_mtime_ns, st.st_size)
         return self.obj
 
     def write(self, obj=None):
         if obj is None:
             obj = self.obj
-        with self.file.open("wb") as f:
+        with atomic_open(self.file, "wb") as f:
             pickle.dump(obj, f)
+        self.obj = obj
+        self.fingerprint = self.stat_fingerprint()
+
+
+GRAPH_SCHEMA_VERSION = 1
+
+class GraphCache:
+    '''
+    SQLite-backed cache for an `ArticleGraph`. Unlike `Cache`, which dill-pickles the
+    whole graph into one file, each article is stored as its own record (with its
+    linkdata back-pointers kept local to that record) and each global index as
+    another. This allows:
+
+    - loading a single article or index without touching the rest (`load_article`,
+      `load_index`)
+    - streaming articles out of the store (`iter_articles`)
+    - writing only records that changed since the last write: an article record is
+      stamped with the parse time of the Article object it holds, so only articles
+      parsed since are pickled, and index records are skipped while the graph's
+      revision is the one last written
+    - rejecting caches written with a different schema version; `load` then returns
+      the default instead of failing on stale objects
+
+    Backlink indexes (`bl_map`, `bl_head`) hold references to other articles, so they
+    aren't stored; a full `load` re-indexes the graph from the stored articles.
+    '''
+    index_names = ['fgraph', 'bgraph', 'tag_map', 'tag_fgraph', 'series_map']
+
+    def __init__(self, name, path, default=None):
+        self.name = name
+        self.path = path
+        self.default = default
+
+        self.obj = None
+        self.file = Path(path, name)
+        self.file = self.file.with_suffix(self.file.suffix + ".sqlite")
+        self.digests = {}
+        self.written = None
+
+        Path(path).mkdir(parents=True, exist_ok=True)
+
+    def connect(self):
+        con = sqlite3.connect(str(self.file))
+        con.executescript('''
+            create table if not exists meta    (key text primary key, value text);
+            create table if not exists records (kind text, name text, digest text, data blob,
+                                                primary key (kind, name));
+        ''')
+        return con
+
+    def is_current(self, con):
+        row = con.execute("select value from meta where key='schema_version'").fetchone()
+        return row is not None and row[0] == str(GRAPH_SCHEMA_VERSION)
+
+    def load(self):
+        from .graph import ArticleGraph
+
+        con = self.connect()
+        try:
+            if not self.is_current(con):
+                self.obj = self.default() if self.default is not None else None
+                return self.obj
+
+            # indexes are re-derived from the articles (O(total degree)) so the graph
+            # can be updated incrementally afterwards; stored index records are only
+            # for on-demand `load_index` access
+            graph = ArticleGraph()
+            for article in self._iter_records(con, 'article'):
+                graph.article_map[article.name] = article
+                graph.index_article(article)
+
+            self.digests = dict(((k, n), d) for k, n, d in
+                                con.execute('select kind, name, digest from records'))
+        finally:
+            con.close()
+
+        self.obj = graph
+        return self.obj
+
+    def load_article(self, name):
+        '''Load a single Article record, or None if absent or stale.'''
+        con = self.connect()
+        try:
+            if not self.is_current(con): return None
+            return self._load_record(con, 'article', name)
+        finally:
+            con.close()
+
+    def load_index(self, name):
+        '''Load a single graph index (e.g. `tag_map`) as a plain dict.'''
+        con = self.connect()
+        try:
+            if not self.is_current(con): return None
+            return self._load_record(con, 'index', name)
+        finally:
+            con.close()
+
+    def iter_articles(self):
+        '''Yield stored Articles one record at a time.'''
+        con = self.connect()
+        try:
+            if not self.is_current(con): return
+            yield from self._iter_records(con, 'article')
+        finally:
+            con.close()
+
+    def article_names(self):
+        con = self.connect()
+        try:
+            if not self.is_current(con): return []
+            return [r[0] for r in con.execute(
+                "select name from records where kind='article'")]
+        finally:
+            con.close()
+
+    def write(self, obj=None):
+        '''
+        Write `obj` (default: the loaded graph), only touching records that changed
+        (see the class docstring) and deleting records for articles no longer in the
+        graph.
+        '''
+        if obj is None:
+            obj = self.obj
+
+        con = self.connect()
+        try:
+            with con:
+                if not self.is_current(con):
+                    con.execute('delete from records')
+                    con.execute("insert or replace into meta values ('schema_version', ?)",
+                                (str(GRAPH_SCHEMA_VERSION),))
+                    self.digests = {}
+                    self.written = None
+                elif not self.digests:
+                    self.digests = dict(((k, n), d) for k, n, d in
+                                        con.execute('select kind, name, digest from records'))
+
+                for name, article in obj.article_map.items():
+                    stamp = 'ctime:{!r}'.format(article.ctime)
+                    if self.digests.get(('article', name)) == stamp: continue
+                    self.put(con, 'article', name, stamp, article)
+
+                revision = (id(obj), obj.revision)
+                if self.written != revision:
+                    for idx in self.index_names:
+                        # plain containers only (no defaultdict factories), sets sorted
+                        # so serialized records are stable across runs
+                        record = {
+                            k: sorted(v) if isinstance(v, set) else dict(v)
+                            for k, v in getattr(obj, idx).items()
+                        }
+                        data = stdpickle.dumps(record, protocol=stdpickle.HIGHEST_PROTOCOL)
+                        digest = hashlib.sha1(data).hexdigest()
+                        if self.digests.get(('index', idx)) != digest:
+                            self.put(con, 'index', idx, digest, data)
+
+                keep = {('article', name) for name in obj.article_map}
+                keep.update(('index', idx) for idx in self.index_names)
+                for key in set(self.digests) - keep:
+                    con.execute('delete from records where kind=? and name=?', key)
+                    del self.digests[key]
+            self.written = revision
+        finally:
+            con.close()
+
+    def put(self, con, kind, name, digest, record):
+        '''Store `record` (an object, or its pickled bytes) under (`kind`, `name`).'''
+        if not isinstance(record, bytes):
+            record = stdpickle.dumps(record, protocol=stdpickle.HIGHEST_PROTOCOL)
+        con.execute('insert or replace into records values (?, ?, ?, ?)',
+                    (kind, name, digest, record))
+        self.digests[(kind, name)] = digest
+
+    @staticmethod
+    def _load_record(con, kind, name):
+        row = con.execute('select data from records where kind=? and name=?',
+                          (kind, name)).fetchone()
+        return stdpickle.loads(row[0]) if row else None
+
+    @staticmethod
+    def _iter_records(con, kind):
+        for (data,) in con.execute('select data from records where kind=?', (kind,)):
+            yield stdpickle.loads(data)
+
+
+class DiffStore:
+    '''
+    Content-addressed SQLite store for computed file diffs. Entries are keyed by a
+    digest of the pre and post texts (see `key`), so a pair of file states seen in an
+    earlier run is never diffed again, whatever files or dates it belongs to. Values
+    are opaque strings; callers store name-independent templates.
+    '''
+    def __init__(self, name, path):
+        self.file = Path(path, name)
+        self.file = self.file.with_suffix(self.file.suffix + ".sqlite")
+        Path(path).mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(pre, post):
+        '''Key for the diff of text `pre` against text `post`.'''
+        return '{}:{}'.format(
+            hashlib.sha1(pre.encode('utf-8')).hexdigest(),
+            hashlib.sha1(post.encode('utf-8')).hexdigest()
+        )
+
+    def connect(self):
+        con = sqlite3.connect(str(self.file))
+        con.execute('create table if not exists diffs (key text primary key, diff_text text, diff_table text)')
+        return con
+
+    def get_many(self, keys):
+        '''Dict of key -> (text, table) for the stored `keys`.'''
+        keys = list(keys)
+        found = {}
+        con = self.connect()
+        try:
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i+500]
+                found.update((k, (t, tb)) for k, t, tb in con.execute(
+                    'select key, diff_text, diff_table from diffs where key in ({})'.format(
+                        ','.join('?'*len(chunk))), chunk))
+        finally:
+            con.close()
+        return found
+
+    def put_many(self, items):
+        '''Store (key, (text, table)) pairs.'''
+        con = self.connect()
+        try:
+            with con:
+                con.executemany('insert or replace into diffs values (?, ?, ?)',
+                                ((k, t, tb) for k, (t, tb) in items))
+        finally:
+            con.close()
@@ -21,6 +21,8 @@ def md2pdf(func):
 
         return outfile
 
+    # exposed so build tools can fingerprint the command
+    wrapper.recipe = func
     return wrapper
 
 @md2pdf
@@ -2,13 +2,19 @@ from pathlib import Path
 import glob
 import subprocess
 import re
+import bisect
+import itertools
+import multiprocessing
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from time import perf_counter
 from tqdm import tqdm
+from colorama import Fore
 from difflib import unified_diff, HtmlDiff
 from datetime import datetime
 from typing import Optional
 
-from panja.cache import Cache
+from panja.cache import Cache, DiffStore
 from panja.article import Article
 from panja import utils
 
@@ -103,6 +109,41 @@ class IncrementFile:
             self.post_bu_diff = round((d2-d1).total_seconds()/60)
 
 
+# placeholders for the parts of a diff that depend on where it occurs rather than on
+# the texts compared, so computed diffs can be stored by content
+FROM_MARK  = '\x00from\x00'
+TO_MARK    = '\x00to\x00'
+TABLE_MARK = '\x00table\x00'
+
+def diff_templates(pre_lines, post_lines):
+    '''
+    Unified diff text and HTML diff table of `pre_lines` against `post_lines`, as
+    made by `IncrementDiff.compute_diff_text` and `compute_diff_table` but with file
+    descriptions and the table's anchor number left as placeholders; see
+    `IncrementDiff.fill_templates`. Run in worker processes.
+    '''
+    text = ''.join(unified_diff(pre_lines, post_lines, fromfile=FROM_MARK, tofile=TO_MARK))
+
+    html_diff = HtmlDiff(tabsize=4,wrapcolumn=1000)
+    table = html_diff.make_table(
+        pre_lines,
+        post_lines,
+        fromdesc=FROM_MARK,
+        todesc=TO_MARK,
+        context=True,
+        numlines=1,
+    )
+    table = re.sub(pattern=r'nowrap="nowrap"', repl='', string=table)
+
+    # every anchor of a table carries the same number, e.g. id="from3_12"
+    table = re.sub(
+        pattern=r'((?:id="|href="#)(?:difflib_chg_)?(?:from|to))\d+_',
+        repl=lambda m: m.group(1)+TABLE_MARK+'_',
+        string=table
+    )
+    return text, table
+
+
 class IncrementDiff:
     '''
     Intended usage: `inc_post` is an increment file representing a change captured by
@@ -154,6 +195,28 @@ class IncrementDiff:
         )
         self.diff_table = re.sub(pattern=r'nowrap="nowrap"', repl='', string=table)
 
+    def diff_key(self):
+        '''`DiffStore` key of the restored pre and post texts.'''
+        return DiffStore.key(
+            ''.join(self.inc_pre.read_restore()),
+            ''.join(self.inc_post.read_restore())
+        )
+
+    def fill_templates(self, text, table, table_id):
+        '''
+        Set `diff_text` and `diff_table` from `diff_templates` output, numbering the
+        table's anchors with `table_id`.
+        '''
+        fromfile = '{}@{}'.format(self.inc_pre.name,self.inc_pre.date)
+        tofile   = '{}@{}'.format(self.inc_post.name,self.inc_post.date)
+        post_int = self.inc_pre.post_bu_diff
+        post_str = '(+{}m)'.format(post_int) if post_int else ''
+
+        self.diff_text  = text.replace(FROM_MARK, fromfile).replace(TO_MARK, tofile)
+        self.diff_table = table.replace(FROM_MARK, fromfile+post_str) \
+                               .replace(TO_MARK, tofile) \
+                               .replace(TABLE_MARK, str(table_id))
+
     def compute_stats(self):
         self.inc_pre.compute_stats()
         self.inc_post.compute_stats()
@@ -167,30 +230,131 @@ class IncrementDiff:
         })
 
 
+class RestoreScheduler:
+    '''
+    Restores increment files with up to `workers` rdiff-backup processes in flight at
+    all times; a slot is refilled as soon as any restore finishes. Failed restores
+    are retried up to `retries` times. `run` yields each file name once all of its
+    increments are restored, so its diffs can be computed while the rest of the
+    archive is still being restored.
+
+    Per-increment outcomes are kept in `results`, keyed by (name, date), with the
+    `state` (`restored`, `skipped` or `failed`), number of `attempts` and `elapsed`
+    seconds.
+    '''
+    def __init__(self, tmp_path, workers=16, retries=2, verbose=False):
+        self.tmp_path = tmp_path
+        self.workers  = workers
+        self.retries  = retries
+        self.verbose  = verbose
+        self.results  = {}
+
+    def restore(self, fs):
+        start = perf_counter()
+        for attempt in range(1, self.retries+2):
+            proc = fs.restore(self.tmp_path)
+            if proc is None:
+                if self.verbose:
+                    print('Skipping {}@{}.{}'.format(fs.name,fs.date,fs.event))
+                return {'state': 'skipped', 'attempts': attempt-1, 'elapsed': perf_counter()-start}
+
+            if proc.wait() == 0:
+                return {'state': 'restored', 'attempts': attempt, 'elapsed': perf_counter()-start}
+
+            # clear any partial output, which would otherwise count as restored
+            if fs.restore_path is not None and fs.restore_path.is_file():
+                fs.restore_path.unlink()
+
+        return {'state': 'failed', 'attempts': attempt, 'elapsed': perf_counter()-start}
+
+    def run(self, groups):
+        '''
+        Restore every IncrementFile in `groups` (a dict of name -> list of increments),
+        yielding each name when its group is finished. Increments that could not be
+        restored are removed from their group.
+        '''
+        remaining = {name: len(incs) for name, incs in groups.items()}
+        for name in [name for name, count in remaining.items() if not count]:
+            del remaining[name]
+            yield name
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {
+                executor.submit(self.restore, fs): (name, fs)
+                for name, incs in groups.items()
+                for fs in incs
+            }
+            for future in as_completed(futures):
+                name, fs = futures[future]
+                result = future.result()
+                self.results[(name, fs.date)] = result
+
+                if result['state'] == 'failed':
+                    print(Fore.RED + '[restore failed] ' + Fore.RESET + '{}@{} after {} attempts'.format(
+                        name, fs.date, result['attempts']))
+                    groups[name].remove(fs)
+
+                remaining[name] -= 1
+                if not remaining[name]:
+                    yield name
+
+    def report(self):
+        times = sorted(r['elapsed'] for r in self.results.values() if r['state'] == 'restored')
+        counts = defaultdict(int)
+        for r in self.results.values():
+            counts[r['state']] += 1
+        retried = sum(1 for r in self.results.values() if r['attempts'] > 1)
+
+        print('restores: {} | retried {}'.format(
+            ', '.join('{} {}'.format(v, k) for k, v in sorted(counts.items())), retried))
+        if times:
+            print('restore time: {:.1f}s total, mean {:.2f}s, p50 {:.2f}s, max {:.2f}s'.format(
+                sum(times), sum(times)/len(times), times[len(times)//2], times[-1]))
+
+
 class DiffStat:
+    # state carried over from the previous run by `update`
+    state_attrs = (
+        'sessions', 'sorted_session_dates', 'inc_dict', 'diff_dict', 'dated_diffs',
+        'local_stats', 'local_inter_stats', 'global_stats', 'file_traces', 'link_traces',
+        'last_updated', 'last_session', 'table_count',
+    )
+
     def __init__(self,
         backup_path,
         tmp_path='/var/tmp/rdiff-stat/',
         diff_cache: Optional[Cache]=None,
         verbose=False,
-        earlier_paths: Optional[list]=None
+        earlier_paths: Optional[list]=None,
+        diff_store: Optional[DiffStore]=None,
+        diff_workers=None
     ):
         self.backup_path       = Path(backup_path)
         self.backup_data_path  = Path(self.backup_path, 'rdiff-backup-data')
         self.increment_path    = Path(self.backup_data_path, 'increments')
         self.tmp_path          = Path(tmp_path)
         self.diff_cache        = diff_cache.load() if diff_cache is not None else None
-        self.group_size        = 16
+        self.restore_workers   = 16
+        self.restore_retries   = 2
+        self.restore_results   = {}
+        self.diff_store        = diff_store if diff_store is not None else DiffStore('diffs', tmp_path)
+        self.diff_workers      = diff_workers
         self.verbose           = verbose
         self.earlier_paths     = earlier_paths if earlier_paths else []
         self.earlier_inc_paths = []
         self.last_updated      = None
+        self.last_session      = None
+
+        # diff tables filled in so far, numbering their anchors uniquely across runs
+        self.table_count       = 0
         
         if earlier_paths is not None:
             self.earlier_inc_paths  = [Path(p, 'rdiff-backup-data/increments') for p in earlier_paths]
 
         self.inc_dict    = defaultdict(list)
         self.diff_dict   = defaultdict(list)
+        self.diff_jobs   = {}
+        self.queued_diffs = defaultdict(list)
         self.dated_diffs = defaultdict(list)
 
         # session metadata on all backup attempts
@@ -201,8 +365,8 @@ class DiffStat:
         self.local_stats       = defaultdict(dict)
         self.local_inter_stats = defaultdict(dict)
         
-        # dated global system stats
-        self.global_stats = defaultdict(lambda: defaultdict(int))
+        # dated global system stats, summed from the file traces
+        self.global_stats = {}
         
         # raw per-file traces, origin stats at -1 and diffs thereafter
         # very similar to diff_dict but with whole system. Any files of
@@ -228,123 +392,236 @@ class DiffStat:
 
         self.sorted_session_dates = sorted(self.sessions.keys())
 
-    def process_increments(self):
-        wait_group = []
+    def set_post_bu_time(self, fs):
+        # set nearest backup time following increment
+        sess_loc = utils.bs(self.sorted_session_dates, fs.date)
+        sess_len = len(self.sorted_session_dates)
+        if sess_loc < sess_len:
+            if self.sorted_session_dates[sess_loc] == fs.date and sess_loc < sess_len-1:
+                sess_loc += 1
+            fs.set_post_bu_time(self.sorted_session_dates[sess_loc])
 
-        # PROCESS MD RESTORATIONS
+    def process_increments(self):
+        # COLLECT MD INCREMENTS
         for inc_path in self.earlier_inc_paths+[self.increment_path]:
-            for i,increment in enumerate(tqdm(glob.glob(str(Path(inc_path, '*.md.[0-9]*'))),
-                                    desc='restore MD archives')):
+            for increment in tqdm(glob.glob(str(Path(inc_path, '*.md.[0-9]*'))),
+                                  desc='collect MD increments'):
                 fs = IncrementFile(inc_path, increment)
-                
-                # set nearest backup time following increment
-                sess_loc = utils.bs(self.sorted_session_dates, fs.date)
-                sess_len = len(self.sorted_session_dates)
-                if sess_loc < sess_len:
-                    if self.sorted_session_dates[sess_loc] == fs.date and sess_loc < sess_len-1:
-                        sess_loc += 1
-                    fs.set_post_bu_time(self.sorted_session_dates[sess_loc])
-
+                self.set_post_bu_time(fs)
                 self.inc_dict[fs.name].append(fs)
 
-                rproc = fs.restore(self.tmp_path)
-                if rproc is None:
-                    if self.verbose:
-                        print('Skipping {}@{}.{}'.format(fs.name,fs.date,fs.event))
-                    continue
-                else:
-                    wait_group.append(rproc)
-
-                # wait for group processes
-                if len(wait_group) >= self.group_size:
-                    print('file {}'.format(i))
-                    exits = [p.wait() for p in wait_group]
-                    wait_group = []
-
-        # wait on any last processes
-        exits = [p.wait() for p in wait_group]
-
-
-        # COMPUTE MD DIFFS
-        for fname, datelist in tqdm(self.inc_dict.items(),
-                                    desc='compute full diff history'):
-            datelist.sort(key=lambda x: x.date)
-            f1d = datelist[0]
-
-            for f2d in datelist[1:]:
-                inc_diff = IncrementDiff(f1d, f2d)
-                inc_diff.compute_diff_text()
-                inc_diff.compute_diff_table()
-
-                self.diff_dict[fname].append(inc_diff)
-                f1d = f2d
-
-            # create current increment file as tail
-            f2d      = IncrementFile('','')
-            f2d.name = fname
-            f2d.date = 'latest'
-
-            if f1d.event == 'snapshot':
-                # if last event is snapshot, create contrived missing `latest` increment.
-                # logically consistent with processing as stats represent state prior to
-                # listed date; file is missing all the way up to @latest. there will
-                # further be no later increments (this is @latest) and thus no diff
-                # computed _through_ this increment (by definition impossible by date).
-                f2d.event = 'missing'
-            else:
-                # other call event `static` and set the `restore_path`, which should
-                # always exist if the last event is not a snapshot. restoring this event
-                # will do nothing, but reading to get content at the path as expected.
-                f2d.event        = 'static'
-                f2d.restore_path = Path(str(Path(self.backup_path, fname))+'.md')
-
+        # PROCESS MD RESTORATIONS, queuing each file's diffs once its increments are in.
+        # diff workers are spawned rather than forked, as restore threads are running
+        scheduler = RestoreScheduler(
+            self.tmp_path,
+            workers=self.restore_workers,
+            retries=self.restore_retries,
+            verbose=self.verbose
+        )
+        with ProcessPoolExecutor(max_workers=self.diff_workers,
+                                 mp_context=multiprocessing.get_context('spawn')) as executor:
+            for fname in tqdm(scheduler.run(self.inc_dict),
+                              total=len(self.inc_dict),
+                              desc='restore MD archives'):
+                if self.inc_dict[fname]:
+                    self.process_diffs(fname, executor)
+
+            self.restore_results = scheduler.results
+            scheduler.report()
+            self.collect_diffs()
+
+    def process_diffs(self, fname, executor=None, start=0):
+        """
+        Build the diff history of `fname` from its restored increments, starting at
+        increment `start` (earlier diffs are kept). Diffs not in the diff store are
+        computed on `executor` if given (see `collect_diffs`), in place otherwise.
+        """
+        datelist = self.inc_dict[fname]
+        datelist.sort(key=lambda x: x.date)
+        f1d = datelist[start]
+
+        for f2d in datelist[start+1:]:
             inc_diff = IncrementDiff(f1d, f2d)
             self.diff_dict[fname].append(inc_diff)
-            
-            # otherwise compute final diff to current file state
-            inc_diff.compute_diff_text()
-            inc_diff.compute_diff_table()
+            f1d = f2d
+
+        # create current increment file as tail
+        f2d      = IncrementFile('','')
+        f2d.name = fname
+        f2d.date = 'latest'
+
+        if f1d.event == 'snapshot':
+            # if last event is snapshot, create contrived missing `latest` increment.
+            # logically consistent with processing as stats represent state prior to
+            # listed date; file is missing all the way up to @latest. there will
+            # further be no later increments (this is @latest) and thus no diff
+            # computed _through_ this increment (by definition impossible by date).
+            f2d.event = 'missing'
+        else:
+            # other call event `static` and set the `restore_path`, which should
+            # always exist if the last event is not a snapshot. restoring this event
+            # will do nothing, but reading to get content at the path as expected.
+            f2d.event        = 'static'
+            f2d.restore_path = Path(str(Path(self.backup_path, fname))+'.md')
+
+        inc_diff = IncrementDiff(f1d, f2d)
+        self.diff_dict[fname].append(inc_diff)
+        
+        # otherwise compute final diff to current file state
+        self.queue_diffs(self.diff_dict[fname][start:], executor)
+        if executor is None: self.collect_diffs()
+
+    def next_table_id(self):
+        self.table_count += 1
+        return self.table_count - 1
+
+    def queue_diffs(self, diffs, executor=None):
+        '''
+        Look up `diffs` in the diff store by content, submitting those missing to
+        `executor`; identical pairs across files and dates are computed once.
+        '''
+        keyed = [(diff.diff_key(), diff) for diff in diffs]
+        stored = self.diff_store.get_many({key for key, _ in keyed} - set(self.diff_jobs))
+
+        for key, diff in keyed:
+            if key in stored:
+                diff.fill_templates(*stored[key], self.next_table_id())
+                continue
+
+            self.queued_diffs[key].append(diff)
+            if key in self.diff_jobs: continue
+
+            args = (diff.inc_pre.read_restore(), diff.inc_post.read_restore())
+            if executor is None:
+                self.diff_jobs[key] = diff_templates(*args)
+            else:
+                self.diff_jobs[key] = executor.submit(diff_templates, *args)
+
+    def collect_diffs(self):
+        '''Wait for queued diffs, fill them in and add them to the diff store.'''
+        results = []
+        for key, job in tqdm(self.diff_jobs.items(), desc='compute diffs',
+                             disable=not self.diff_jobs):
+            templates = job.result() if hasattr(job, 'result') else job
+            for diff in self.queued_diffs[key]:
+                diff.fill_templates(*templates, self.next_table_id())
+            results.append((key, templates))
+
+        self.diff_store.put_many(results)
+        self.diff_jobs = {}
+        self.queued_diffs = defaultdict(list)
+
+    def update(self):
+        """
+        Bring the stats up to date with the backup. If `diff_cache` holds the DiffStat
+        of an earlier run, its state is carried over and only increments it hasn't seen
+        (those from newer rdiff sessions) are restored and diffed; each affected file's
+        history is extended from its last known increment, and global stats are
+        re-aggregated from the file traces. Calling it again
+        continues from this instance's own state; without any previous run, everything
+        is processed from scratch.
+        """
+        prev = self.diff_cache if self.diff_cache is not None else self
+        # don't keep the previous run around, it would be pickled along with this one
+        self.diff_cache = None
+
+        if getattr(prev, 'last_session', None) is None:
+            self.process_sessions()
+            self.process_increments()
+            self.compute_stats()
+            self.compute_inter_stats()
+            return
+
+        if prev is not self:
+            for attr in self.state_attrs:
+                # attributes added since the previous run keep their initial value
+                setattr(self, attr, getattr(prev, attr, getattr(self, attr)))
+
+        self.process_sessions()
+        seen = {str(fs.path) for incs in self.inc_dict.values() for fs in incs}
+
+        new_incs = defaultdict(list)
+        for inc_path in self.earlier_inc_paths+[self.increment_path]:
+            for increment in glob.glob(str(Path(inc_path, '*.md.[0-9]*'))):
+                if increment in seen: continue
+                fs = IncrementFile(inc_path, increment)
+                self.set_post_bu_time(fs)
+                new_incs[fs.name].append(fs)
+
+        if not new_incs:
+            print('no new increments since session {}'.format(self.last_session))
+            self.last_updated = datetime.now().timestamp()
+            return
+
+        # restore the new increments, along with each file's last known increment
+        # (normally still restored under tmp_path) which its history continues from.
+        # The latter's following backup may be one of the new sessions
+        for name in new_incs:
+            if self.inc_dict.get(name):
+                self.set_post_bu_time(self.inc_dict[name][-1])
+
+        groups = {
+            name: self.inc_dict[name][-1:] + incs if name in self.inc_dict else incs
+            for name, incs in new_incs.items()
+        }
+
+        scheduler = RestoreScheduler(
+            self.tmp_path,
+            workers=self.restore_workers,
+            retries=self.restore_retries,
+            verbose=self.verbose
+        )
+        updated = {}
+        with ProcessPoolExecutor(max_workers=self.diff_workers,
+                                 mp_context=multiprocessing.get_context('spawn')) as executor:
+            for fname in tqdm(scheduler.run(groups),
+                              total=len(groups),
+                              desc='restore new MD increments'):
+                known = self.inc_dict.get(fname, [])
+                incs = [fs for fs in groups[fname] if fs not in known]
+                if not incs or (known and known[-1] not in groups[fname]): continue
+
+                # the diff to the current file state is replaced by diffs through the
+                # new increments
+                if fname in self.diff_dict:
+                    tail = self.diff_dict[fname].pop()
+                    self.dated_diffs[tail.date].remove(tail)
+                    if not self.dated_diffs[tail.date]:
+                        del self.dated_diffs[tail.date]
+
+                start = len(self.diff_dict[fname])
+                self.inc_dict[fname].extend(incs)
+                self.process_diffs(fname, executor, start)
+                updated[fname] = start
+
+            self.restore_results.update(scheduler.results)
+            scheduler.report()
+            self.collect_diffs()
+
+        # STATS FOR UPDATED FILES
+        for fname, start in tqdm(updated.items(), desc='compute updated file stats'):
+            self.compute_file_stats(fname, start)
+
+        if updated:
+            self.aggregate_global_stats()
+        self.compute_inter_stats()
+
+        print('updated {} files from {} new increments'.format(
+            len(updated), sum(len(incs) for incs in new_incs.values())))
+        self.last_updated = datetime.now().timestamp()
+        self.last_session = self.sorted_session_dates[-1]
 
     def compute_stats(self):
         # GLOBAL STAT COMPUTATION
 
         for fname, difflist in tqdm(self.diff_dict.items(),
                                     desc='compute local file stats'):
-            
-            # place absolute stats one date shifted earlier. since stats at inc_pre
-            # give state up to but not including inc_pre.date, we want inc_pre.date to
-            # to tell us stats happening _after_ the diff there. so we assign the next
-            # stats in the chain to that last date
-            last_date = '-1'
-            difflist[0].compute_stats()
-            self.file_traces[fname]['-1'] = difflist[0].inc_pre.stats
-            self.link_traces[fname]['-1'] = difflist[0].inc_pre.wlinks
-
-            for i, diff in enumerate(difflist):
-                diff.compute_stats()
-                self.local_stats[fname][last_date] = diff.inc_pre.stats
-                self.file_traces[fname][diff.date] = diff.stats
-                self.link_traces[fname][diff.date] = diff.wlinks
-                self.dated_diffs[diff.date].append(diff)
-                last_date = diff.date
-                
-                
-            # add the state stats _after_ the last inc_pre.date, i.e. the absolute stats
-            # of the file's current representation. The last inc_pre considered in the loop
-            # gives stats up to but not including inc_pre.date, and are assigned to the date
-            # before it. this means we don't get the absolute stats for current, so we add it
-            # using the last diff's inc_post
-            self.local_stats[fname][last_date] = diff.inc_post.stats
-
-            # we now also add the diff_dict base to global_stats, where we
-            # need to add _all_ diff_dict, not just those in diff_dict and currently in 
-            # the backup path. This ensures we get snapshots that were present back in early
-            # dates but no longer available; their diffs will bring stats down if we don't
-            # account for their origin here.
-            self.global_stats['-1'] = {
-                k: self.global_stats['-1'][k]+v
-                for k,v in difflist[0].inc_pre.stats.items()
-            }
+            # the diff_dict base goes into the file traces (and so into global stats)
+            # for _all_ diff_dict, not just those currently in the backup path. This
+            # ensures we get snapshots that were present back in early dates but no
+            # longer available; their diffs will bring stats down if we don't account
+            # for their origin here.
+            self.compute_file_stats(fname)
 
 
         # add files not seen in increments (they don't change through the date range we've
@@ -372,53 +649,108 @@ class DiffStat:
             self.local_stats[fname]['-1'] = bfile.stats
             self.file_traces[fname]['-1'] = bfile.stats
             self.link_traces[fname]['-1'] = bfile.wlinks
-
-            self.global_stats['-1'] = {
-                k: self.global_stats['-1'][k]+v
-                for k,v in bfile.stats.items()
-            }
             
             
+        # GLOBAL AGGREGATION
+        self.aggregate_global_stats()
+
         print('diff_dict size: {}'.format(len(self.diff_dict)))
         print('global stat: {}'.format(self.global_stats['-1']))
 
+        # timing
+        self.last_updated = datetime.now().timestamp()
+        if self.sorted_session_dates:
+            self.last_session = self.sorted_session_dates[-1]
+
+    def compute_file_stats(self, fname, start=0):
+        '''
+        Traces and absolute stats for `fname` from its diff at index `start` on (all of
+        them by default), registering those diffs in `dated_diffs`.
+        '''
+        difflist = self.diff_dict[fname]
 
-        # GLOBAL AGGREGATION
-        last_date = '-1'
-        for date in tqdm(sorted(self.dated_diffs.keys()),
-                         desc='final global aggregation'):
-            self.global_stats[date] = self.global_stats[last_date]
+        if start == 0:
+            # place absolute stats one date shifted earlier. since stats at inc_pre
+            # give state up to but not including inc_pre.date, we want inc_pre.date to
+            # to tell us stats happening _after_ the diff there. so we assign the next
+            # stats in the chain to that last date
+            last_date = '-1'
+            difflist[0].compute_stats()
+            self.file_traces[fname]['-1'] = difflist[0].inc_pre.stats
+            self.link_traces[fname]['-1'] = difflist[0].inc_pre.wlinks
+        else:
+            last_date = difflist[start-1].date
+
+        for diff in difflist[start:]:
+            diff.compute_stats()
+            self.local_stats[fname][last_date] = diff.inc_pre.stats
+            self.file_traces[fname][diff.date] = diff.stats
+            self.link_traces[fname][diff.date] = diff.wlinks
+            self.dated_diffs[diff.date].append(diff)
+            last_date = diff.date
             
-            for diff in self.dated_diffs[date]:
-                self.global_stats[date] = {
-                    k: diff.stats[k]+v
-                    for k,v in self.global_stats[date].items()
-                }
-                
-            last_date = date
+        # add the state stats _after_ the last inc_pre.date, i.e. the absolute stats
+        # of the file's current representation. The last inc_pre considered in the loop
+        # gives stats up to but not including inc_pre.date, and are assigned to the date
+        # before it. this means we don't get the absolute stats for current, so we add it
+        # using the last diff's inc_post
+        self.local_stats[fname][last_date] = diff.inc_post.stats
+
+    def aggregate_global_stats(self):
+        '''
+        Cumulative global stats for '-1' and every diff date: the sum of all file bases
+        plus every diff up to the date, computed column-wise by `stat_store`.
+        '''
+        store = self.stat_store()
+        self.global_stats = {
+            str(date): dict(zip(store.metrics, row))
+            for date, row in zip(store.dates, store.totals().tolist())
+        }
+
+    def stat_store(self):
+        '''Columnar `StatStore` of the file traces, for slicing by file and date.'''
+        from panja.stat_store import StatStore
+        return StatStore.from_traces(self.file_traces)
+
+    def link_index(self):
+        '''
+        Inverted index of `link_traces`: link target -> list of (date, source, delta),
+        sorted by date, built in one pass over all traces.
+        '''
+        index = defaultdict(list)
+        for source, trace in self.link_traces.items():
+            for date, links in trace.items():
+                for target, delta in links.items():
+                    index[target].append((date, source, delta))
 
-        # timing
-        self.last_updated = datetime.now().timestamp()
+        for events in index.values():
+            events.sort(key=lambda x: x[0])
+        return index
+
+    @staticmethod
+    def inbound_timeline(events):
+        '''
+        Running inbound link count at each date in `events` (as from `link_index`),
+        i.e. prefix sums over the per-date deltas.
+        '''
+        if not events: return {}
+
+        dates, deltas = [], []
+        for date, group in itertools.groupby(events, key=lambda x: x[0]):
+            dates.append(date)
+            deltas.append(sum(delta for _, _, delta in group))
+
+        # '-1' holds the (empty) state before the first date, unless it is one itself
+        timeline = {'-1': {}}
+        for date, total in zip(dates, itertools.accumulate(deltas)):
+            timeline[date] = {'linked_to': total}
+        return timeline
 
     def compute_inter_stats(self):
+        link_index = self.link_index()
         for fname in tqdm(self.link_traces.keys(),
                           desc='compute local inter file stats'):
-            self.local_inter_stats[fname] = self.stitch_traces([
-                {
-                    date:{'linked_to':links.get(fname,0)}
-                    for date, links in trace.items()
-                    if fname in links
-                }
-                for trace in self.link_traces.values()
-            ])
-        #full_trace = self.stitch_traces(list(self.link_traces.values()))
-        #for date, stats in tqdm(full_trace.items(),
-        #                        desc='compute local inter file stats'):
-        #    for fname, count in stats.items():
-        #        self.local_inter_stats[fname][date] = {
-        #            'linked_to': stats.get(fname,0)
-        #        }
-
+            self.local_inter_stats[fname] = self.inbound_timeline(link_index.get(fname))
 
     @staticmethod
     def stitch_traces(trace_list):
@@ -427,22 +759,21 @@ class DiffStat:
 
         trace_list: list of traces i.e. dated dictionaries of stats dicts
         '''
-        timeline = defaultdict(lambda: defaultdict(int))
         datediff = defaultdict(list)
         for trace in trace_list:
             for date, stat in trace.items():
                 datediff[date].append(stat)
+        if not datediff: return {}
 
+        timeline = {'-1': {}}
         last_date = '-1'
         for date in sorted(datediff.keys()):
-            timeline[date] = timeline[last_date]
+            # one copy per date; stats are accumulated into it
+            temp = {**timeline[last_date]}
             for stat in datediff[date]:
-                temp = {**timeline[date]}
-                temp.update({
-                    k: timeline[date].get(k,0)+v
-                    for k,v in stat.items()
-                })
-                timeline[date] = temp
+                for k,v in stat.items():
+                    temp[k] = temp.get(k,0)+v
+            timeline[date] = temp
             last_date = date
 
         return timeline
@@ -451,6 +782,12 @@ class DiffStat:
 if __name__ == '__main__':
     backup_path = '/media/smgr/data/backups/arch_incremental/notes-rdiff/'
 
+    stats_cache = Cache(
+        'newstat_samg.com',
+        '/home/smgr/.cache/panja/',
+    )
+
+    # picks up from the cached stats, if any, processing only newer increments
     stats = DiffStat(
         backup_path,
         tmp_path='/var/tmp/rdiff-stat',
@@ -459,15 +796,9 @@ if __name__ == '__main__':
             '/media/smgr/data/backups/arch_incremental/notes-rdiff-pre080322/',
             '/media/smgr/data/backups/arch_incremental/rdiff-notes-pre041022/',
             '/media/smgr/data/backups/arch_incremental/notes-rdiff-pre042622/',
-        ]
-    )
-    stats.process_sessions()
-    stats.process_increments()
-    stats.compute_stats()
-    stats.compute_inter_stats()
-
-    stats_cache = Cache(
-        'newstat_samg.com',
-        '/home/smgr/.cache/panja/',
+        ],
+        diff_cache=stats_cache,
     )
+    stats.update()
     stats_cache.write(stats)
+    stats.stat_store().save('/home/smgr/.cache/panja/newstat_samg.npz')
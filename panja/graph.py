@@ -1,11 +1,53 @@
+import os
 import json
+import hashlib
+import multiprocessing
+from pathlib import Path
+from time import perf_counter
 from collections import defaultdict
 from datetime import datetime
 
+from colorama import Fore
+from tqdm import tqdm
+
 from . import filedata
 from . import utils
+from . import pool
+from . import build
+from .article import Article
+
+
+def _init_ingest_worker():
+    # pandoc servers inherited from the parent belong to the parent; the worker's own
+    # are stopped when it exits
+    pool.reset_worker(workers=1)
+    # same for any PDF builds (ingested articles leave them to page conversion)
+    build.reset_worker()
+
+
+def _ingest(fullpath):
+    '''
+    Parse one note for `ArticleGraph.from_directory`. Returns `(fullpath, record,
+    timings, error)`, where `record` is the article's `Article.to_record`: its body
+    and context tree stay behind, so only metadata and link data cross processes.
+    '''
+    try:
+        t0 = perf_counter()
+        article = Article(fullpath, Path(fullpath).stem, verbose=False, builds=False)
+        t1 = perf_counter()
+        article.proto_process_structure()
+        t2 = perf_counter()
+    except Exception as e:
+        return fullpath, None, {}, '{}: {}'.format(type(e).__name__, e)
+
+    return fullpath, article.to_record(), {'metadata': t1-t0, 'structure': t2-t1}, None
+
 
 class ArticleGraph:
+    # metadata kept on slim edge list nodes (`get_edge_list(slim=True)`), in addition to
+    # name/link/valid/num_links. Full nodes carry all of an article's metadata
+    graph_node_keys = []
+
     def __init__(self):
         '''
         ArticleGraph class
@@ -25,6 +67,38 @@ class ArticleGraph:
         self.bl_map = defaultdict(lambda: defaultdict(list))
         self.bl_head = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
 
+        # what each article contributed to the indexes, for incremental updates
+        self.index_state = {}
+
+        # revision counter and export caches; see `refresh_exports`
+        self.revision = 0
+        self.reset_exports()
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+        # graphs pickled before index states were tracked
+        if 'index_state' not in state:
+            self.index_state = {
+                name: self.get_index_state(article)
+                for name, article in self.article_map.items()
+            }
+
+        if 'revision' not in state or 'export_slim_nodes' not in state:
+            self.revision = state.get('revision', 0)
+            self.reset_exports()
+
+    def reset_exports(self):
+        '''Drop all cached exports, marking every article and tag for a rebuild.'''
+        self.export_nodes = {}
+        self.export_slim_nodes = {}
+        self.export_edges = {}
+        self.export_tag_nodes = {}
+        self.export_tag_edges = {}
+        self.export_json = {}
+        self.export_dirty = set(self.article_map)
+        self.export_tag_dirty = set(self.tag_fgraph)
+
     def get_article(self, name):
         return self.article_map.get(name) 
 
@@ -32,7 +106,7 @@ class ArticleGraph:
         return list(self.article_map.values())
 
     def get_article_list_as_json(self):
-        return json.dumps(self.fgraph)
+        return self._cached_json('adj', lambda: self.fgraph)
 
     def get_adj_list(self):
         return self.fgraph
@@ -59,79 +133,139 @@ class ArticleGraph:
     def get_headlinks(self, name):
         return self.bl_head.get(name, {})
 
-    def get_edge_list(self):
-        nodes = []
-        edges = []
-        for aname, links in self.fgraph.items():
-            article = self.article_map[aname]
-            data = {
-                'name': article.name,
-                'link': article.link,
-                'valid': article.valid,
-                'num_links': sum(self.bgraph[aname].values())
-            }
-            data.update(article.metadata)
-            nodes.append(data)
-
-            for target, val in links.items():
-                if target in self.article_map:
-                    edges.append({
-                        'source': aname,
-                        'target': target,
-                        'value': val
-                    })
+    def get_fingerprint(self, name):
+        '''
+        Digest of the graph data a rendered page for `name` depends on: the article's
+        own source, its incoming backlink contexts, and the tag and series membership
+        indexed under `name`. Meant for `Site` fingerprints so pages are only re-rendered
+        when one of these changes.
+        '''
+        h = hashlib.sha1()
+        article = self.article_map.get(name)
+        if article is not None:
+            h.update(article.fingerprint().encode('utf-8'))
 
-        return {'nodes': nodes, 'links': edges}
+        backlinks = self.bl_map.get(name, {})
+        for src in sorted(backlinks):
+            for link in backlinks[src]:
+                h.update('bl\0{}\0{}\0{}\0'.format(src, link['header'], link['context']).encode('utf-8'))
 
-    def get_tag_edge_list(self):
-        nodes = []
-        edges = []
-        for tname, pairs in self.tag_fgraph.items():
-            data = {
-                'name': tname,
-                'link': tname,
-                'title': tname,
-                'num_links': len(self.tag_map[tname])
-            }
-            nodes.append(data)
+        for tagged in sorted(self.tag_map.get(name, [])):
+            h.update('tag\0{}\0'.format(tagged).encode('utf-8'))
 
-            for target, val in pairs.items():
-                edges.append({
-                    'source': tname,
-                    'target': target,
-                    'value': val
-                })
+        for series in sorted(self.series_map.get(name, [])):
+            h.update('series\0{}\0'.format(series).encode('utf-8'))
 
-        return {'nodes': nodes, 'links': edges}
+        return h.hexdigest()
 
-    def get_subgraph(self, name):
+    def get_node(self, name, keys=None):
+        '''
+        Graph node for article `name`, with the metadata fields in `keys` (all of its
+        metadata if None).
+        '''
         article = self.article_map[name]
         data = {
             'name': article.name,
             'link': article.link,
             'valid': article.valid,
-            'num_links': sum(self.bgraph[name].values())
+            'num_links': sum(self.bgraph.get(name, {}).values())
         }
-        data.update(article.metadata)
-        node_track = set([article.name])
+        if keys is None:
+            data.update(article.metadata)
+        else:
+            data.update({k: article.metadata[k] for k in keys if k in article.metadata})
+        return data
+
+    def refresh_exports(self):
+        '''
+        Rebuild cached nodes and edges only for the articles and tags touched since the
+        last export. `add_article`/`remove_article` mark an article, the targets whose
+        backlink counts changed, and the articles linking to it as dirty, so this is
+        proportional to the degree of the changes rather than the size of the graph.
+        '''
+        for name in self.export_dirty:
+            if name in self.article_map and name in self.fgraph:
+                self.export_nodes[name] = self.get_node(name)
+                self.export_slim_nodes[name] = self.get_node(name, self.graph_node_keys)
+                self.export_edges[name] = [
+                    {'source': name, 'target': target, 'value': val}
+                    for target, val in self.fgraph[name].items()
+                    if target in self.article_map
+                ]
+            else:
+                self.export_nodes.pop(name, None)
+                self.export_slim_nodes.pop(name, None)
+                self.export_edges.pop(name, None)
+
+        for tname in self.export_tag_dirty:
+            if tname in self.tag_fgraph:
+                self.export_tag_nodes[tname] = {
+                    'name': tname,
+                    'link': tname,
+                    'title': tname,
+                    'num_links': len(self.tag_map.get(tname, []))
+                }
+                self.export_tag_edges[tname] = [
+                    {'source': tname, 'target': target, 'value': val}
+                    for target, val in self.tag_fgraph[tname].items()
+                ]
+            else:
+                self.export_tag_nodes.pop(tname, None)
+                self.export_tag_edges.pop(tname, None)
+
+        self.export_dirty = set()
+        self.export_tag_dirty = set()
+
+    def get_edge_list(self, slim=False):
+        '''
+        Nodes and links of the article graph. Nodes carry all article metadata, or with
+        `slim` only the fields in `graph_node_keys`.
+        '''
+        self.refresh_exports()
+        nodes = self.export_slim_nodes if slim else self.export_nodes
+        return {
+            'nodes': list(nodes.values()),
+            'links': [e for edges in self.export_edges.values() for e in edges]
+        }
+
+    def get_edge_list_as_json(self, slim=False):
+        if slim:
+            return self._cached_json('edges-slim', lambda: self.get_edge_list(slim=True))
+        return self._cached_json('edges', self.get_edge_list)
+
+    def get_tag_edge_list(self):
+        self.refresh_exports()
+        return {
+            'nodes': list(self.export_tag_nodes.values()),
+            'links': [e for edges in self.export_tag_edges.values() for e in edges]
+        }
+
+    def get_tag_edge_list_as_json(self):
+        return self._cached_json('tags', self.get_tag_edge_list)
+
+    def _cached_json(self, key, build):
+        '''Serialized export for `key`, reused until the graph revision changes.'''
+        cached = self.export_json.get(key)
+        if cached is None or cached[0] != self.revision:
+            cached = (self.revision, json.dumps(build()))
+            self.export_json[key] = cached
+        return cached[1]
+
+    def get_subgraph(self, name):
+        data = self.get_node(name)
+        node_track = set([name])
         nodes = [data]
         edges = []
 
-        for tname, count in [*self.fgraph[name].items(), *self.bgraph[name].items()]:
+        fedges = self.fgraph.get(name, {})
+        bedges = self.bgraph.get(name, {})
+        for tname, count in [*fedges.items(), *bedges.items()]:
             if tname not in self.article_map: continue
-            target = self.article_map[tname]
-            if target.name not in node_track:
-                data = {
-                    'name': target.name,
-                    'link': target.link,
-                    'valid': target.valid,
-                    'num_links': sum(self.bgraph[target.name].values())
-                }
-                data.update(target.metadata)
-                nodes.append(data)
-                node_track.add(target.name)
+            if tname not in node_track:
+                nodes.append(self.get_node(tname))
+                node_track.add(tname)
             
-        for tname, count in self.fgraph[name].items():
+        for tname, count in fedges.items():
             if tname not in self.article_map: continue
             edges.append({
                 'source': name,
@@ -139,7 +273,7 @@ class ArticleGraph:
                 'value': count
             })
 
-        for tname, count in self.bgraph[name].items():
+        for tname, count in bedges.items():
             if tname not in self.article_map: continue
             edges.append({
                 'source': tname,
@@ -149,29 +283,172 @@ class ArticleGraph:
 
         return {'nodes': nodes, 'links': edges}
 
+    @classmethod
+    def from_directory(cls, path, workers=1, suffix='.md', verbose=True):
+        '''
+        Build a graph from every `suffix` file under `path`. Notes are parsed
+        (`process_metadata` + `proto_process_structure`) in `workers` forked processes
+        and merged into the graph indexes in the parent, in path order. Articles come
+        back without their body, which is read from disk on first access.
+
+        Per-stage timings are kept on the graph as `load_timings`: `scan`, `parse` and
+        `merge` are wall times in the parent, `metadata` and `structure` are summed
+        over all notes.
+        '''
+        timings = defaultdict(float)
+        start = perf_counter()
+
+        paths = sorted(os.path.join(path, relpath) for relpath in utils.directory_tree(path)
+                       if relpath.endswith(suffix))
+        timings['scan'] = perf_counter() - start
+
+        graph = cls()
+        errors = []
+        desc = 'graph load ({} workers)'.format(workers) if workers > 1 else 'graph load'
+
+        def merge(results):
+            for fullpath, record, stage_times, error in tqdm(results,
+                                                              total=len(paths),
+                                                              desc=desc,
+                                                              colour='blue',
+                                                              disable=not verbose):
+                if error is not None:
+                    errors.append((fullpath, error))
+                    continue
+                for stage, elapsed in stage_times.items():
+                    timings[stage] += elapsed
+
+                t0 = perf_counter()
+                graph.add_article(Article.from_record(record))
+                timings['merge'] += perf_counter() - t0
+
+        parse_start = perf_counter()
+        if workers > 1:
+            ctx = multiprocessing.get_context('fork')
+            with ctx.Pool(workers, _init_ingest_worker) as procs:
+                merge(procs.imap(_ingest, paths, chunksize=max(1, len(paths)//(8*workers))))
+                # exit workers normally (rather than terminate) so their finalizers run
+                procs.close()
+                procs.join()
+        else:
+            merge(map(_ingest, paths))
+        timings['parse'] = perf_counter() - parse_start - timings['merge']
+        timings['total'] = perf_counter() - start
+
+        graph.load_timings = dict(timings)
+
+        if verbose:
+            for fullpath, error in errors:
+                print(Fore.RED + '[load failed] ' + Fore.RESET + '{} ({})'.format(fullpath, error))
+            print(Fore.BLUE + '[graph load] ' + Fore.RESET +
+                  '{} notes, {} workers | '.format(len(graph.article_map), workers) +
+                  ' | '.join('{} {:.2f}s'.format(stage, timings[stage])
+                             for stage in ['scan', 'metadata', 'structure', 'parse', 'merge', 'total']))
+
+        return graph
+
     def add_article(self, article):
-        # reset indexes if article previously processed
+        '''
+        Add or update an article. If an article with the same name was indexed before,
+        exactly the entries it contributed are removed first, so the cost is
+        proportional to the degree of the old and new versions rather than the size of
+        the graph.
+        '''
         if article.name in self.article_map:
-            cur_article = self.article_map[article.name]
-            self.fgraph[article.name] = {}
-            for name in cur_article.links:
-                self.bgraph[name].pop(article.name, None)
-                self.bl_map[name].pop(article.name, None)
-                for struct_dict in self.bl_head[name].values():
-                    struct_dict.pop(article.name, None)
-
-            for tag in cur_article.metadata.get('tag_links', []):
-                self.tag_map[tag].remove(article.name)
-
-            for ref in cur_article.metadata.get('series_links', []):
-                self.series_map[ref].remove(article.name)
-        
+            self.unindex_article(article.name)
+
         self.article_map[article.name] = article
+        self.index_article(article)
+        self.process_data(article)
+
+    def remove_article(self, name):
+        '''
+        Remove an article and everything it contributed to the indexes. Links _to_ the
+        article from other articles are kept (targets need not be articles). Returns the
+        removed article, or None if it wasn't in the graph.
+        '''
+        if name not in self.article_map: return None
+        self.unindex_article(name)
+        return self.article_map.pop(name)
+
+    def index_article(self, article):
+        '''
+        Add an article's links, tags, series and backlinks to the indexes, and record
+        what was added so `unindex_article` can undo it even if the article object is
+        later modified in place.
+        '''
         self.process_links(article)
         self.process_tags(article)
         self.process_series(article)
         self.process_backlinks(article)
-        self.process_data(article)
+
+        self.index_state[article.name] = self.get_index_state(article)
+        self.touch(article.name, self.index_state[article.name])
+
+    @staticmethod
+    def get_index_state(article):
+        return {
+            'links':    dict(article.links),
+            'linkdata': {name: list(data) for name, data in article.linkdata.items()},
+            'tags':     list(article.metadata.get('tag_links', {}).keys()),
+            'series':   list(article.metadata['series_links'])
+                        if 'series_links' in article.metadata else None,
+        }
+
+    def unindex_article(self, name):
+        state = self.index_state.pop(name, None)
+        if state is None: return
+        self.touch(name, state)
+
+        self.fgraph.pop(name, None)
+        for link in state['links']:
+            self._discard(self.bgraph, link, name)
+
+        for target, data in state['linkdata'].items():
+            self._discard(self.bl_map, target, name)
+            for header in {link['header'] for link in data}:
+                if target in self.bl_head and header in self.bl_head[target]:
+                    self.bl_head[target][header].pop(name, None)
+                    if not self.bl_head[target][header]:
+                        del self.bl_head[target][header]
+                    if not self.bl_head[target]:
+                        del self.bl_head[target]
+
+        tags = state['tags']
+        for i, tag in enumerate(tags):
+            self._discard(self.tag_map, tag, name)
+            for pair in (tags[:i]+tags[i+1:]):
+                if pair not in self.tag_fgraph.get(tag, {}): continue
+                self.tag_fgraph[tag][pair] -= 1
+                if self.tag_fgraph[tag][pair] <= 0:
+                    del self.tag_fgraph[tag][pair]
+            if tag in self.tag_fgraph and not self.tag_fgraph[tag]:
+                del self.tag_fgraph[tag]
+
+        if state['series'] is not None:
+            self._discard(self.series_map, name, name)
+            for ref in state['series']:
+                self._discard(self.series_map, ref, name)
+
+    def touch(self, name, state):
+        '''Bump the revision and mark exports affected by (un)indexing `name`.'''
+        self.revision += 1
+        self.export_dirty.add(name)
+        self.export_dirty.update(state['links'])
+        self.export_dirty.update(self.bgraph.get(name, {}))
+        self.export_tag_dirty.update(state['tags'])
+
+    @staticmethod
+    def _discard(index, key, member):
+        '''Remove `member` from the set/dict at `index[key]`, dropping it if empty.'''
+        if key not in index: return
+        container = index[key]
+        if isinstance(container, set):
+            container.discard(member)
+        else:
+            container.pop(member, None)
+        if not container:
+            del index[key]
 
     def process_links(self, article):
         for link, count in article.links.items():
@@ -199,6 +476,44 @@ class ArticleGraph:
             for link in data:
                 self.bl_head[name][link['header']][article.name] += [link]
 
+    def check_consistency(self):
+        '''
+        Compare the incrementally maintained indexes against a graph rebuilt from
+        scratch out of the current articles. Returns a list of human-readable
+        differences; an empty list means the indexes are consistent. Empty containers
+        and zero counts are ignored on both sides.
+        '''
+        fresh = ArticleGraph()
+        for article in self.article_map.values():
+            fresh.article_map[article.name] = article
+            fresh.index_article(article)
+
+        def plain(obj):
+            if isinstance(obj, dict):
+                out = {}
+                for k, v in obj.items():
+                    v = plain(v)
+                    if v not in ({}, set(), [], 0):
+                        out[k] = v
+                return out
+            if isinstance(obj, set):
+                return set(obj)
+            if isinstance(obj, list):
+                # backlink entries are compared by identity
+                return [id(e) if isinstance(e, dict) else e for e in obj]
+            return obj
+
+        diffs = []
+        for idx in ['fgraph', 'bgraph', 'tag_map', 'tag_fgraph',
+                    'series_map', 'bl_map', 'bl_head']:
+            cur = plain(getattr(self, idx))
+            exp = plain(getattr(fresh, idx))
+            for key in sorted(set(cur) | set(exp), key=str):
+                if cur.get(key) != exp.get(key):
+                    diffs.append('{}[{!r}]: have {!r}, expected {!r}'.format(
+                        idx, key, cur.get(key), exp.get(key)))
+        return diffs
+
     def process_data(self, article):
         if not (article.metadata.get('type') == 'journal' and 
                 article.metadata.get('filedata')):
@@ -0,0 +1,268 @@
+import json
+import atexit
+import queue
+import socket
+import logging
+import threading
+import multiprocessing.util
+import subprocess as subp
+import urllib.request
+import urllib.error
+from time import perf_counter, sleep
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+
+class PandocPool:
+    '''
+    Bounded pool of long-lived pandoc workers. Conversions are sent to one of
+    `workers` `pandoc server` processes over HTTP instead of forking a new pandoc for
+    every call. Requests using options the server can't express (filters, citeproc
+    with an on-disk bibliography, arbitrary metadata flags) fall back to a regular
+    pandoc subprocess, still bounded by the same concurrency limit. So do requests
+    that find their server has exited, or the servers stopped.
+
+    Per-call latency is recorded by mode (`server` or `cli`) and is available through
+    `stats()` or `report()`.
+
+    :param workers: max number of concurrent conversions (and number of servers)
+    :param server:  attempt to use `pandoc server` workers; if False or if the
+                    servers fail to start, all calls go through the CLI
+    :param timeout: per-request timeout in seconds
+    '''
+    def __init__(self, workers=4, server=True, timeout=120):
+        self.workers = workers
+        self.timeout = timeout
+        self.use_server = server
+
+        self.slots = threading.BoundedSemaphore(workers)
+        self.ports = queue.Queue()
+        self.servers = {}
+        self.started = False
+        self.lock = threading.Lock()
+
+        self.latency = defaultdict(list)
+
+    def start(self):
+        '''Spawn server workers. Called lazily on first conversion.'''
+        with self.lock:
+            if self.started: return
+            self.started = True
+            if not self.use_server: return
+
+            self._clear_ports()
+            try:
+                for _ in range(self.workers):
+                    port = self._free_port()
+                    proc = subp.Popen(
+                        ['pandoc', 'server', '--port', str(port), '--timeout', str(self.timeout)],
+                        stdout=subp.DEVNULL,
+                        stderr=subp.DEVNULL
+                    )
+                    self.servers[port] = proc
+                    self._wait_ready(proc, port)
+                    self.ports.put(port)
+            except (OSError, RuntimeError) as e:
+                logger.warning('pandoc server unavailable ({}), using CLI workers'.format(e))
+                self._stop_servers()
+                self.use_server = False
+
+    def close(self):
+        with self.lock:
+            self._stop_servers()
+            self.started = False
+
+    def convert(self, content, to='html5', frm='markdown', extra_args=None, filters=None):
+        '''
+        Convert `content` from `frm` to `to`. `extra_args` and `filters` take the same
+        form as they would on the pandoc command line.
+        '''
+        if extra_args is None: extra_args = []
+        if filters is None: filters = []
+        if not self.started: self.start()
+
+        opts = None
+        if self.use_server and not filters:
+            opts = self.server_options(extra_args)
+
+        with self.slots:
+            start = perf_counter()
+            out = None
+            if opts is not None:
+                mode = 'server'
+                out = self._convert_server(content, to, frm, opts)
+            if out is None:
+                mode = 'cli'
+                out = self._convert_cli(content, to, frm, extra_args, filters)
+            elapsed = perf_counter() - start
+
+        self.latency[mode].append(elapsed)
+        logger.debug('pandoc [{}] {:.1f}ms'.format(mode, 1000*elapsed))
+        return out
+
+    @staticmethod
+    def server_options(extra_args):
+        '''
+        Translate CLI args to `pandoc server` JSON options. Returns None if any
+        argument has no server equivalent.
+        '''
+        opts = {}
+        for arg in extra_args:
+            if arg == '--toc':
+                opts['table-of-contents'] = True
+            elif arg.startswith('--toc-depth='):
+                opts['toc-depth'] = int(arg.split('=', 1)[1])
+            elif arg in ('-s', '--standalone'):
+                opts['standalone'] = True
+            elif arg == '--section-divs':
+                opts['section-divs'] = True
+            else:
+                return None
+        return opts
+
+    def stats(self):
+        '''Latency summary (in seconds) per conversion mode.'''
+        summary = {}
+        for mode, times in self.latency.items():
+            if not times: continue
+            srt = sorted(times)
+            summary[mode] = {
+                'calls': len(srt),
+                'total': sum(srt),
+                'mean':  sum(srt)/len(srt),
+                'p50':   srt[len(srt)//2],
+                'max':   srt[-1],
+            }
+        return summary
+
+    def report(self):
+        for mode, s in self.stats().items():
+            logger.info('pandoc [{}] {} calls, {:.2f}s total, mean {:.1f}ms, p50 {:.1f}ms, max {:.1f}ms'.format(
+                mode, s['calls'], s['total'], 1000*s['mean'], 1000*s['p50'], 1000*s['max']))
+
+    def _convert_server(self, content, to, frm, opts):
+        '''
+        Convert on the next free server. Returns None if there is none to use (the
+        servers were stopped, or this one exited), for the caller to use the CLI.
+        '''
+        port = self.ports.get()
+        if port is None:
+            # servers stopped: pass the sentinel on to the next waiting thread
+            self.ports.put(None)
+            return None
+
+        try:
+            proc = self.servers.get(port)
+            if proc is None or proc.poll() is not None:
+                return None
+
+            body = dict(opts, text=content, to=to)
+            body['from'] = frm
+            req = urllib.request.Request(
+                'http://127.0.0.1:{}/'.format(port),
+                data=json.dumps(body).encode('utf-8'),
+                headers={'Content-Type': 'application/json', 'Accept': 'application/json'}
+            )
+            try:
+                with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                    res = json.loads(resp.read().decode('utf-8'))
+            except (urllib.error.URLError, OSError) as e:
+                if proc.poll() is not None:
+                    logger.warning('pandoc server on port {} exited, using CLI'.format(port))
+                    return None
+                raise RuntimeError('pandoc server request failed: {}'.format(e))
+        finally:
+            self.ports.put(port)
+
+        if 'output' not in res:
+            raise RuntimeError('pandoc server error: {}'.format(res.get('error', res)))
+        return res['output']
+
+    @staticmethod
+    def _convert_cli(content, to, frm, extra_args, filters):
+        cmd = ['pandoc', '--from', frm, '--to', to]
+        cmd += extra_args
+        cmd += [e for f in filters for e in ['-F', f]]
+
+        try:
+            return subp.check_output(cmd, text=True, input=content, stderr=subp.DEVNULL)
+        except subp.CalledProcessError as e:
+            raise RuntimeError('pandoc exited with code {}'.format(e.returncode))
+
+    @staticmethod
+    def _free_port():
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.bind(('127.0.0.1', 0))
+            return s.getsockname()[1]
+
+    @staticmethod
+    def _wait_ready(proc, port, wait=10):
+        start = perf_counter()
+        while perf_counter() - start < wait:
+            if proc.poll() is not None:
+                raise RuntimeError('server exited with code {}'.format(proc.returncode))
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+                return
+            except OSError:
+                sleep(0.05)
+        raise RuntimeError('server on port {} not ready after {}s'.format(port, wait))
+
+    def _clear_ports(self):
+        with self.ports.mutex:
+            self.ports.queue.clear()
+
+    def _stop_servers(self):
+        for proc in self.servers.values():
+            proc.terminate()
+        for proc in self.servers.values():
+            try:
+                proc.wait(timeout=5)
+            except subp.TimeoutExpired:
+                proc.kill()
+        self.servers = {}
+
+        # the queue is shared with threads waiting on it, so it is emptied in place and
+        # left with a sentinel that wakes them
+        self._clear_ports()
+        self.ports.put(None)
+
+
+_pool = None
+_pool_kwargs = {}
+
+def get_pool(**kwargs):
+    '''
+    Process-wide pandoc pool, created on first use. `kwargs` are passed to
+    `PandocPool` only on creation.
+    '''
+    global _pool
+    if _pool is None:
+        _pool = PandocPool(**{**_pool_kwargs, **kwargs})
+        atexit.register(_pool.close)
+    return _pool
+
+def close():
+    '''Stop the process-wide pool's servers, if it was created.'''
+    if _pool is not None:
+        _pool.close()
+
+def reset_worker(**kwargs):
+    '''
+    `reset` for a forked `multiprocessing.Pool` worker. Atexit hooks don't run in
+    pool workers, so the worker's own servers are stopped by a finalizer instead,
+    which runs when the worker exits normally (after `Pool.close` and `join`).
+    '''
+    reset(**kwargs)
+    multiprocessing.util.Finalize(None, close, exitpriority=10)
+
+def reset(**kwargs):
+    '''
+    Forget the process-wide pool without stopping its servers, e.g. in a forked child
+    process where they belong to the parent. The next `get_pool` call creates a new
+    pool with `kwargs`.
+    '''
+    global _pool, _pool_kwargs
+    _pool = None
+    _pool_kwargs = kwargs
@@ -17,6 +17,7 @@ import pdf2bib
 pdf2bib.config.set('verbose',False)
 
 from panja import utils
+from panja import bib
 
 
 ARCHIVE_PATH = '/media/smgr/data/archivebox/archive'
@@ -126,10 +127,10 @@ class DocSync():
     ds.rename_existing()
     ds.sync_to_bib()
     '''
-    BIBTEX_ENTRY_REGEX = re.compile('^@.*{(.*),\n[\s\S]*?\n}',re.MULTILINE)
-    BIBTEX_FILE_REGEX  = re.compile('^[^\S\r\n]*?file[^\S\r\n]*?=[^\S\r\n]*?{(.*)}',re.MULTILINE)
-    BIBTEX_APATH_REGEX = re.compile('^[^\S\r\n]*?archive_path[^\S\r\n]*?=[^\S\r\n]*?{(.*)}',re.MULTILINE)
-    BIBTEX_AURL_REGEX  = re.compile('^[^\S\r\n]*?archive_url[^\S\r\n]*?=[^\S\r\n]*?{(.*)}',re.MULTILINE)
+    BIBTEX_ENTRY_REGEX = bib.BIBTEX_ENTRY_REGEX
+    BIBTEX_FILE_REGEX  = bib.BIBTEX_FILE_REGEX
+    BIBTEX_APATH_REGEX = bib.BIBTEX_APATH_REGEX
+    BIBTEX_AURL_REGEX  = bib.BIBTEX_AURL_REGEX
     BIBTEX_TITLE_REGEX = re.compile('^[^\S\r\n]*?title[^\S\r\n]*?=[^\S\r\n]*?{(.*?)}',re.MULTILINE|re.DOTALL)
 
     def __init__(self, pdf_path, bib_path):
@@ -168,22 +169,19 @@ class DocSync():
         self.bib_entries_by_aurl = {}
         self.bib_file2key = {}
 
-        bib_content = self.bib_path.open().read()
-        for m in self.BIBTEX_ENTRY_REGEX.finditer(bib_content):
-            self.bib_entries[m.group(1)] = m.group(0)
+        for entry in bib.get_index(self.bib_path).entries:
+            citekey, bibtex = entry['citekey'], entry['bibtex']
+            self.bib_entries[citekey] = bibtex
 
-            file_attr = self.BIBTEX_FILE_REGEX.search(m.group(0))
-            if file_attr:
-                self.bib_entries_by_file[str(Path(file_attr.group(1)))] = m.group(0)
-                self.bib_file2key[str(Path(file_attr.group(1)))] = m.group(1)
+            if entry['file']:
+                self.bib_entries_by_file[str(Path(entry['file']))] = bibtex
+                self.bib_file2key[str(Path(entry['file']))] = citekey
 
-            archive_path_attr = self.BIBTEX_APATH_REGEX.search(m.group(0))
-            if archive_path_attr:
-                self.bib_entries_by_apath[str(Path(archive_path_attr.group(1)))] = m.group(0)
+            if entry['archive_path']:
+                self.bib_entries_by_apath[str(Path(entry['archive_path']))] = bibtex
 
-            archive_url_attr = self.BIBTEX_AURL_REGEX.search(m.group(0))
-            if archive_url_attr:
-                self.bib_entries_by_aurl[archive_url_attr.group(1)] = m.group(0)
+            if entry['archive_url']:
+                self.bib_entries_by_aurl[entry['archive_url']] = bibtex
 
         # parse blacklist
         self.blk_path.touch(exist_ok=True)
@@ -418,6 +416,7 @@ class DocSync():
     def rewrite_bib(self, entries):
         if entries:
             self.bib_path.write_text('\n\n'.join(entries))
+            bib.get_index(self.bib_path, force=True)
             self.parse_bib()
 
     def prepend_bib(self, new_entries):
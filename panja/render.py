@@ -0,0 +1,165 @@
+import os
+import json
+import atexit
+import threading
+import multiprocessing.util
+from pathlib import Path
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor
+
+from colorama import Fore
+
+from . import utils
+from .cache import atomic_open
+
+IMAGE_PATH = Path('/home/smgr/Documents/notes/images/')
+
+
+class RenderQueue:
+    '''
+    Background renderer for live TeX figures (TikZ sources and .pdf_tex drawings).
+    Transforms name the SVG after the source hash and `submit` the render; the job
+    runs on a pool of `workers` threads (each render is a pdflatex + pdf2svg
+    subprocess pair), so a page can be written before its figures exist.
+
+    Jobs are deduplicated by SVG name: a figure already queued, running or on disk is
+    not rendered again. Outcomes are recorded in a JSON manifest under `image_path`;
+    a source that failed to render is not retried (its name, and so its source, is
+    unchanged) unless `retry_failed` is set.
+
+    Job states are `queued`, `running`, `done`, `failed` and `skipped` (failed
+    previously); see `status`.
+    '''
+    def __init__(self, workers=2, image_path=IMAGE_PATH, retry_failed=False):
+        self.image_path = Path(image_path)
+        self.manifest_path = Path(self.image_path, '.render-manifest.json')
+        self.retry_failed = retry_failed
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+
+        self.jobs = {}
+        self.futures = {}
+        self.manifest = self.load_manifest()
+
+    def load_manifest(self):
+        try:
+            with open(self.manifest_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_manifest(self):
+        self.image_path.mkdir(parents=True, exist_ok=True)
+        with self.lock:
+            data = json.dumps(self.manifest)
+        with atomic_open(self.manifest_path, 'w') as f:
+            f.write(data)
+
+    def submit(self, stem, render, *args):
+        '''
+        Schedule `render(*args, outfile)` to produce `image_path/stem`, e.g. with
+        `utils.tex.tikz2svg` and the TikZ source. Returns the job immediately.
+        '''
+        outfile = Path(self.image_path, stem)
+        with self.lock:
+            job = self.jobs.get(stem)
+            if job is not None and job['state'] in ('queued', 'running', 'done'):
+                return job
+
+            if outfile.exists():
+                job = {'state': 'done', 'elapsed': None}
+                self.jobs[stem] = job
+                return job
+
+            entry = self.manifest.get(stem)
+            if entry is not None and entry['state'] == 'failed' and not self.retry_failed:
+                job = {'state': 'skipped', 'elapsed': None, 'error': entry.get('error')}
+                self.jobs[stem] = job
+                return job
+
+            job = {'state': 'queued', 'elapsed': None}
+            self.jobs[stem] = job
+            self.futures[stem] = self.executor.submit(self._render, stem, render, args, outfile)
+        return job
+
+    def _render(self, stem, render, args, outfile):
+        job = self.jobs[stem]
+        job['state'] = 'running'
+        print(Fore.YELLOW + 'Rendering {}'.format(stem))
+
+        # render next to the target and move into place, so a partial SVG is never
+        # mistaken for a finished one
+        tmpfile = outfile.with_name(outfile.stem + '.tmp' + outfile.suffix)
+        start = perf_counter()
+        error = None
+        try:
+            render(*args, str(tmpfile))
+            if not tmpfile.exists():
+                raise RuntimeError('no output written')
+            os.replace(tmpfile, outfile)
+        except Exception as e:
+            print(Fore.RED + '[render failed] ' + Fore.RESET + '{} ({})'.format(stem, e))
+            error = str(e)
+            try:
+                tmpfile.unlink()
+            except OSError:
+                pass
+        job['elapsed'] = perf_counter() - start
+
+        job['state'] = 'failed' if error else 'done'
+        with self.lock:
+            self.manifest[stem] = {'state': job['state'], 'elapsed': job['elapsed']}
+            if error: self.manifest[stem]['error'] = error
+        self.save_manifest()
+        return job
+
+    def status(self, stem=None):
+        '''
+        Job info for SVG `stem`, or for all figures submitted in this process if None.
+        Figures not submitted in this process report their manifest entry, or
+        `missing`.
+        '''
+        if stem is None:
+            with self.lock:
+                return {k: dict(v) for k, v in self.jobs.items()}
+
+        job = self.jobs.get(stem)
+        if job is not None: return dict(job)
+        if Path(self.image_path, stem).exists():
+            return {'state': 'done'}
+        return dict(self.manifest.get(stem, {'state': 'missing'}))
+
+    def wait(self):
+        '''Block until every submitted render has finished.'''
+        for future in list(self.futures.values()):
+            future.result()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+_queue = None
+
+def get_queue(**kwargs):
+    '''Process-wide render queue, created on first use with `kwargs`.'''
+    global _queue
+    if _queue is None:
+        _queue = RenderQueue(**kwargs)
+        atexit.register(_queue.close)
+    return _queue
+
+def close():
+    '''Finish pending renders and stop the process-wide queue, if it was created.'''
+    if _queue is not None:
+        _queue.close()
+
+def reset_worker():
+    '''
+    Forget the queue inherited by a forked `multiprocessing.Pool` worker, whose threads
+    don't exist in the child. A queue the worker creates is finished by a finalizer
+    when the worker exits normally (after `Pool.close` and `join`); atexit hooks
+    don't run there.
+    '''
+    global _queue
+    _queue = None
+    multiprocessing.util.Finalize(None, close, exitpriority=10)
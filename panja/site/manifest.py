@@ -0,0 +1,114 @@
+import os
+import json
+import hashlib
+
+MANIFEST_VERSION = 1
+
+
+class Unfingerprintable(Exception):
+    pass
+
+
+def fingerprint(obj):
+    """Return a stable digest string for *obj*, or ``None`` if it can't be computed.
+
+    Plain JSON-like values (and containers of them) are supported directly. Any other
+    object may define a ``fingerprint()`` method returning a string; callables are
+    identified by their qualified name. Everything else is unfingerprintable, in which
+    case a template depending on it is always considered dirty.
+
+    :param obj: the value to fingerprint
+    """
+    try:
+        return hashlib.sha1(_canonical(obj).encode('utf-8')).hexdigest()
+    except Unfingerprintable:
+        return None
+
+
+def _canonical(obj):
+    if obj is None or isinstance(obj, (str, int, float, bool)):
+        return json.dumps(obj)
+    if hasattr(obj, 'fingerprint') and callable(obj.fingerprint):
+        return 'fp:' + str(obj.fingerprint())
+    if isinstance(obj, dict):
+        items = sorted((str(k), _canonical(v)) for k, v in obj.items())
+        return '{' + ','.join('{}:{}'.format(json.dumps(k), v) for k, v in items) + '}'
+    if isinstance(obj, (list, tuple)):
+        return '[' + ','.join(_canonical(v) for v in obj) + ']'
+    if isinstance(obj, (set, frozenset)):
+        return '{' + ','.join(sorted(_canonical(v) for v in obj)) + '}'
+    if callable(obj) and hasattr(obj, '__qualname__'):
+        return 'fn:{}.{}'.format(getattr(obj, '__module__', ''), obj.__qualname__)
+    raise Unfingerprintable(type(obj).__name__)
+
+
+def file_digest(path):
+    """SHA1 of a file's bytes, or ``None`` if it can't be read."""
+    h = hashlib.sha1()
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 16), b''):
+                h.update(chunk)
+    except (OSError, TypeError):
+        return None
+    return h.hexdigest()
+
+
+class BuildManifest(object):
+    """Persisted record of the last successful render of each template.
+
+    Each entry stores the template's source hash (``src``), the hashes of the
+    partials it pulls in (``deps``), a digest of its resolved context (``ctx``), any
+    external fingerprints registered with the Site (``ext``), and the output path
+    (``out``). A template whose current record matches its stored one, and whose
+    recorded output still exists, doesn't need to be re-rendered.
+
+    :param path: location of the manifest file, typically under the output path
+    """
+    keys = ('src', 'deps', 'ctx', 'ext')
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+
+        if data.get('version') != MANIFEST_VERSION:
+            data = {}
+        self.entries = data.get('entries', {})
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'version': MANIFEST_VERSION, 'entries': self.entries}, f)
+        os.replace(tmp, self.path)
+
+    def is_current(self, name, record):
+        """Check if *record* matches the stored entry for template *name*."""
+        old = self.entries.get(name)
+        if old is None:
+            return False
+        for key in self.keys:
+            if record.get(key) is None or record.get(key) != old.get(key):
+                return False
+        # without a recorded output there's no telling whether it was removed
+        if not old.get('out') or not os.path.exists(old['out']):
+            return False
+        return True
+
+    def update(self, name, record):
+        self.entries[name] = record
+
+    def prune(self, names):
+        """Drop entries for templates not in *names*."""
+        names = set(names)
+        for name in list(self.entries):
+            if name not in names:
+                del self.entries[name]
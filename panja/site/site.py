@@ -8,6 +8,8 @@ Uses Jinja2 to compile templates.
 
 import inspect
 import logging
+import logging.handlers
+import multiprocessing
 import os
 import sys
 import re
@@ -18,11 +20,47 @@ from pathlib import Path
 from colorama import Fore
 from tqdm import tqdm
 
-from jinja2 import Environment, FileSystemLoader, Template
-from jinja2.exceptions import TemplateSyntaxError
+from jinja2 import Environment, FileSystemLoader, Template, meta
+from jinja2.exceptions import TemplateSyntaxError, TemplateNotFound
 from livereload import Server
 
 from .. import utils
+from .. import pool
+from .. import build
+from .. import render
+from .manifest import BuildManifest, fingerprint, file_digest
+
+
+# Site instance inherited by forked render workers; see `Site.render_templates`
+_worker_site = None
+
+
+def _init_render_worker(log_queue):
+    """Set up a forked render worker: rebuild the Jinja environment, send log
+    records back to the parent, and drop the inherited pandoc pool, build queue
+    and figure render queue so the worker starts its own (finished when the worker
+    exits).
+    """
+    site = _worker_site
+    site.env = site.env.overlay()
+    site._dep_cache = {}
+
+    site.logger.handlers = [logging.handlers.QueueHandler(log_queue)]
+    site.logger.propagate = False
+    pool.reset_worker(workers=1)
+    build.reset_worker()
+    render.reset_worker()
+
+
+def _render_in_worker(args):
+    template_name, force = args
+    site = _worker_site
+    template = site.get_template(template_name)
+    record = site.render_one(template, force=force)
+    # figures queued by the page must exist before the parent copies static files,
+    # and a terminated worker would drop them
+    render.get_queue().wait()
+    return template_name, record
 
 
 def _has_argument(func):
@@ -76,6 +114,16 @@ class Site(object):
         contexts list will be merged (in order) to get the final context.
         Otherwise, only the first matching regex is used. Defaults to
         ``False``.
+
+    :param fingerprints:
+        A list of *(regex, function)* pairs. *function* takes the Site and a
+        template and returns a JSON-like value (or string digest) describing
+        any external data the template's output depends on, e.g.
+        ``ArticleGraph.get_fingerprint``. Used by the build manifest to decide
+        whether a template needs re-rendering. Templates handled by a rule are
+        only skipped if they match a fingerprint and the rule returns the path
+        it wrote to; rules typically read data the manifest can't see.
+        Defaults to ``[]``.
     """
 
     def __init__(self,
@@ -90,7 +138,8 @@ class Site(object):
                  staticpaths=None,
                  basepath=None,
                  mergecontexts=False,
-                 postreload=None
+                 postreload=None,
+                 fingerprints=None
                  ):
         self.env = environment
         self.searchpaths = searchpaths
@@ -105,6 +154,10 @@ class Site(object):
         self.mergecontexts = mergecontexts
         self.postreload = postreload
         self.postrender = False
+        self.fingerprints = fingerprints or []
+
+        self.manifest = BuildManifest(os.path.join(outpath, '.panja', 'manifest.json'))
+        self._dep_cache = {}
 
     @classmethod
     def make_site(cls,
@@ -123,6 +176,7 @@ class Site(object):
                   env_kwargs=None,
                   mergecontexts=False,
                   postreload=None,
+                  fingerprints=None,
                   verbose=True
                   ):
         """Create a :class:`Site <Site>` object.
@@ -201,6 +255,11 @@ class Site(object):
             the contexts list will be merged (in order) to get the final
             context.  Otherwise, only the first matching regex is used.
             Defaults to ``False``.
+
+        :param fingerprints:
+            A list of *(regex, function)* pairs describing external inputs of
+            matching templates for incremental builds. See :class:`Site`.
+            Defaults to ``[]``.
         """
         # TODO: Determine if there is a better way to write do this
         calling_module = inspect.getmodule(inspect.stack()[-1][0])
@@ -258,7 +317,8 @@ class Site(object):
                    staticpaths=staticpaths,
                    basepath=basepath,
                    mergecontexts=mergecontexts,
-                   postreload=postreload
+                   postreload=postreload,
+                   fingerprints=fingerprints
                    )
 
     @property
@@ -443,20 +503,109 @@ class Site(object):
                 filepath = os.path.join(self.outpath, template.name)
 
             template.stream(**context).dump(filepath, self.encoding)
+            return filepath if isinstance(filepath, str) else None
         else:
-            rule(self, template, **context)
+            # rules may return the path they wrote to for the build manifest
+            out = rule(self, template, **context)
+            return out if isinstance(out, str) else None
+
+    def get_template_dependencies(self, template_name):
+        """Get the set of partials *template_name* includes, extends or
+        imports, followed transitively. If a template references another
+        dynamically, it is assumed to depend on every partial.
+
+        :param template_name: the name of the template
+        """
+        if template_name in self._dep_cache:
+            return self._dep_cache[template_name]
+
+        self._dep_cache[template_name] = set()
+        try:
+            source, _, _ = self.env.loader.get_source(self.env, template_name)
+            refs = set(meta.find_referenced_templates(self.env.parse(source)))
+        except (TemplateSyntaxError, TemplateNotFound, UnicodeError):
+            refs = set()
+
+        if None in refs:
+            refs.discard(None)
+            refs.update(self.env.list_templates(filter_func=self.is_partial))
+
+        deps = set(refs)
+        for ref in refs:
+            deps.update(self.get_template_dependencies(ref))
+
+        self._dep_cache[template_name] = deps
+        return deps
+
+    def get_build_record(self, template, context):
+        """Build the manifest record describing the inputs of a render of
+        *template* with *context*.
+
+        :param template: the template to describe
+        :param context: the context the template will be rendered with
+        """
+        deps = {}
+        for dep in sorted(self.get_template_dependencies(template.name)):
+            deps[dep] = file_digest(self.find_searchpath(dep))
+        if any(v is None for v in deps.values()):
+            deps = None
+
+        ext = []
+        for regex, fingerprint_func in self.fingerprints:
+            if re.match(regex, template.name):
+                ext.append(fingerprint(fingerprint_func(self, template)))
+
+        # a rule may render from anything (e.g. the whole article graph), so without a
+        # fingerprint describing its inputs the template is always dirty
+        if not ext and any(re.match(regex, template.name) for regex, _ in self.rules):
+            ext = [None]
+
+        return {
+            'src':  file_digest(template.filename),
+            'deps': deps,
+            'ctx':  fingerprint(context),
+            'ext':  None if None in ext else ext,
+            'out':  None,
+        }
+
+    def render_one(self, template, filepath=None, force=False):
+        """Render *template* unless the build manifest shows it is current.
+        Returns the new manifest record, or ``None`` if skipped.
+        """
+        context = self.get_context(template)
+        record = self.get_build_record(template, context)
+
+        if not force and self.manifest.is_current(template.name, record):
+            self.logger.info("Template %s unchanged, skipping." % template.name)
+            return None
 
-    def render_templates(self, templates, filepath=None):
+        record['out'] = self.render_template(template, context, filepath)
+        return record
+
+    def render_templates(self, templates, filepath=None, force=False, workers=1):
         """Render a collection of :class:`jinja2.Template` objects.
 
+        Templates whose source, partials, context and registered fingerprints
+        match the build manifest are skipped unless *force* is set.
+
         :param templates:
-            A collection of Templates to render.
+            A collection of Templates (or template names) to render.
 
         :param filepath:
             Optional. A file or file-like object to dump the complete template
             stream into. Defaults to to ``os.path.join(self.outpath,
             template.name)``.
 
+        :param force:
+            Render every template regardless of the build manifest.
+
+        :param workers:
+            Number of processes to render with. Each forked worker rebuilds
+            its Jinja environment and pandoc pool; log output is merged back
+            through this Site's logger. Falls back to rendering in this
+            process when ``workers <= 1``, when *filepath* is given, or when
+            ``fork`` isn't available.
+
         """
         #rlogger = logging.getLogger(__name__+'a')
         #rlogger.setLevel(logging.INFO)
@@ -471,11 +620,50 @@ class Site(object):
         else:
             size = len(self.template_names)
 
-        for template in tqdm(templates,
-                             total=size,
-                             desc='site render',
-                             colour='green'):
-            self.render_template(template, filepath)
+        self._dep_cache = {}
+        if workers > 1 and filepath is None and \
+                'fork' in multiprocessing.get_all_start_methods():
+            names = [t if isinstance(t, str) else t.name for t in templates]
+            self._render_parallel(names, force, workers)
+        else:
+            for template in tqdm(templates,
+                                 total=size,
+                                 desc='site render',
+                                 colour='green'):
+                if isinstance(template, str):
+                    template = self.get_template(template)
+                record = self.render_one(template, filepath, force)
+                if record is not None:
+                    self.manifest.update(template.name, record)
+
+        self.manifest.save()
+
+    def _render_parallel(self, template_names, force, workers):
+        global _worker_site
+        ctx = multiprocessing.get_context('fork')
+        log_queue = ctx.Queue()
+        listener = logging.handlers.QueueListener(log_queue, *self.logger.handlers)
+
+        _worker_site = self
+        listener.start()
+        try:
+            with ctx.Pool(workers, _init_render_worker, (log_queue,)) as procs:
+                results = procs.imap_unordered(_render_in_worker,
+                                               [(name, force) for name in template_names])
+                for name, record in tqdm(results,
+                                         total=len(template_names),
+                                         desc='site render ({} workers)'.format(workers),
+                                         colour='green'):
+                    if record is not None:
+                        self.manifest.update(name, record)
+
+                # let workers exit on their own so their finalizers (pandoc servers)
+                # run; leaving the block would terminate them
+                procs.close()
+                procs.join()
+        finally:
+            listener.stop()
+            _worker_site = None
 
     def find_searchpath(self, name):
         for searchpath in self.searchpaths:
@@ -520,7 +708,8 @@ class Site(object):
         else:
             return []
 
-    def render(self, build=True, server=False, reloader=False, livereload=False, liveport=35729, port=8000):
+    def render(self, build=True, server=False, reloader=False, livereload=False, liveport=35729, port=8000,
+               incremental=True, workers=1):
         """Generate the site. A number of options may be specified to control the behavior
         of site's build process and downstream access to output files. 
 
@@ -531,6 +720,12 @@ class Site(object):
         :param reloader: Watch and reload files that change in the search paths. These
                          changed files will be reprocessed according the compilation rules
                          of the site object.
+        :param incremental: Skip templates whose inputs are unchanged according to the
+                         build manifest stored under the output path. Set to False to
+                         force a full rebuild.
+        :param workers:  Number of processes to render templates with during the build.
+                         The post-render hook still only runs once all templates are
+                         done.
         :param liveport: Start a livereload server, which automatically reloads a browser
                          tab (which is current accessing the site files) when a file
                          changes in the output directory. Unless you plan to modify the
@@ -555,7 +750,12 @@ class Site(object):
         requires me to add _more_ logic instead of taking it away).
         """
         if build:
-            self.render_templates(self.templates)
+            templates = self.templates if workers <= 1 else self.template_names
+            self.render_templates(templates, force=not incremental, workers=workers)
+            self.manifest.prune(self.template_names)
+            self.manifest.save()
+            # live TeX figures render in the background; copy them once they exist
+            render.get_queue().wait()
             self.copy_static(self.static_names)
             self.postreload(self)
             self.postrender = True
@@ -655,7 +855,7 @@ class Site(object):
                 templates = self.get_dependencies(template_name)
                 # for now, ignore root template; require site restart
                 if self.is_partial(template_name): continue
-                self.render_templates(templates)
+                self.render_templates(templates, force=True)
 
         if self.postreload:
             self.postreload(self, map(lambda t:self.get_template(t),template_names)) 
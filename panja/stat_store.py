@@ -0,0 +1,125 @@
+from pathlib import Path
+
+import numpy as np
+
+METRICS = ('lines', 'words', 'links', 'reflinks', 'headings', 'files')
+
+
+class StatStore:
+    '''
+    Columnar form of `DiffStat` stats. Dates make up a sorted axis, starting from the
+    '-1' base, and each metric is a column over it. Per-file changes are kept sparse:
+    file `i`'s delta matrix is `deltas[file_ptr[i]:file_ptr[i+1]]`, one row of metric
+    deltas per date index in the same slice of `event_dates`, and `base` holds each
+    file's stats at '-1'.
+
+    Absolute stats at a date are the base plus the cumulative sum of deltas up to and
+    including it, i.e. `global_stats` for the whole set and `local_stats` for a file.
+    '''
+    def __init__(self, dates, files, base, file_ptr, event_dates, deltas, metrics=METRICS):
+        self.dates       = np.asarray(dates)
+        self.files       = np.asarray(files)
+        self.metrics     = tuple(metrics)
+        self.base        = np.asarray(base, dtype=np.int64)
+        self.file_ptr    = np.asarray(file_ptr, dtype=np.int64)
+        self.event_dates = np.asarray(event_dates, dtype=np.int64)
+        self.deltas      = np.asarray(deltas, dtype=np.int64).reshape(-1, len(self.metrics))
+
+        self.file_index = {str(f): i for i, f in enumerate(self.files)}
+        self._global = None
+
+    @classmethod
+    def from_traces(cls, file_traces, metrics=METRICS):
+        '''
+        Build from `DiffStat.file_traces`: fname -> {date: stats}, with base stats at
+        '-1' and diff stats at every other date.
+        '''
+        files = sorted(file_traces)
+        dates = ['-1'] + sorted({
+            date for trace in file_traces.values() for date in trace if date != '-1'
+        })
+        date_index = {date: i for i, date in enumerate(dates)}
+
+        base = np.zeros((len(files), len(metrics)), dtype=np.int64)
+        file_ptr = [0]
+        event_dates, deltas = [], []
+        for i, fname in enumerate(files):
+            trace = file_traces[fname]
+            if '-1' in trace:
+                base[i] = [trace['-1'].get(m, 0) for m in metrics]
+            for date in sorted(trace):
+                if date == '-1': continue
+                event_dates.append(date_index[date])
+                deltas.append([trace[date].get(m, 0) for m in metrics])
+            file_ptr.append(len(event_dates))
+
+        return cls(dates, files, base, file_ptr, event_dates, deltas, metrics)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(
+                data['dates'], data['files'], data['base'], data['file_ptr'],
+                data['event_dates'], data['deltas'], [str(m) for m in data['metrics']],
+            )
+
+    def save(self, path):
+        '''Write the store as a compressed `.npz` archive.'''
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'wb') as f:
+            np.savez_compressed(
+                f,
+                dates=self.dates, files=self.files, metrics=np.array(self.metrics),
+                base=self.base, file_ptr=self.file_ptr,
+                event_dates=self.event_dates, deltas=self.deltas,
+            )
+
+    def column(self, metric):
+        return self.metrics.index(metric)
+
+    def date_loc(self, date):
+        '''Index of the last axis date at or before `date` (-1 if before the axis).'''
+        return int(np.searchsorted(self.dates, date, side='right')) - 1
+
+    def file_deltas(self, fname):
+        '''Axis indices and delta matrix of the dates `fname` changed at.'''
+        i = self.file_index[fname]
+        lo, hi = self.file_ptr[i], self.file_ptr[i+1]
+        return self.event_dates[lo:hi], self.deltas[lo:hi]
+
+    def daily_deltas(self, fname=None):
+        '''Dense (dates x metrics) deltas, summed over all files if `fname` is None.'''
+        out = np.zeros((len(self.dates), len(self.metrics)), dtype=np.int64)
+        if fname is None:
+            np.add.at(out, self.event_dates, self.deltas)
+            out[0] += self.base.sum(axis=0)
+        else:
+            idx, deltas = self.file_deltas(fname)
+            np.add.at(out, idx, deltas)
+            out[0] += self.base[self.file_index[fname]]
+        return out
+
+    def totals(self, fname=None):
+        '''Dense (dates x metrics) absolute stats, for all files or just `fname`.'''
+        if fname is not None:
+            return np.cumsum(self.daily_deltas(fname), axis=0)
+        if self._global is None:
+            self._global = np.cumsum(self.daily_deltas(), axis=0)
+        return self._global
+
+    def window(self, start=None, end=None, fname=None):
+        '''Axis dates within [start, end] and the absolute stats at each of them.'''
+        lo = 0 if start is None else int(np.searchsorted(self.dates, start, side='left'))
+        hi = len(self.dates) if end is None else self.date_loc(end)+1
+        return self.dates[lo:hi], self.totals(fname)[lo:hi]
+
+    def at(self, date, fname=None):
+        '''Absolute stats in effect at `date`, as a metric dict.'''
+        loc = self.date_loc(date)
+        if loc < 0: return {m: 0 for m in self.metrics}
+        return dict(zip(self.metrics, self.totals(fname)[loc].tolist()))
+
+    def change(self, start, end, fname=None):
+        '''Net change in each metric over the dates in (start, end].'''
+        before, after = self.at(start, fname), self.at(end, fname)
+        return {m: after[m]-before[m] for m in self.metrics}
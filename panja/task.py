@@ -11,6 +11,10 @@
 
 from tasklib import TaskWarrior, Task
 from datetime import datetime
+import os
+import time
+import threading
+import functools
 import textwrap
 
 DEFAULT_DATA = '~/.task/'
@@ -21,6 +25,14 @@ DEFAULT_KWARGS = dict(
    taskrc_location=DEFAULT_RC,
 )
 
+# files whose change means the task data changed (TaskWarrior 2.x and 3.x)
+TASK_DATA_FILES = ('pending.data', 'completed.data', 'taskchampion.sqlite3')
+
+# seconds a task export (and the filter results from it) is reused while the task data
+# is unchanged; urgency and relative-date filters (due:today, end.after:sow) change with
+# time, so results can't be kept indefinitely
+QUERY_TTL = 30
+
 DEFAULT_VIEWPORT_VIRTUAL_TAGS = ("-DELETED", "-PARENT")
 DEFAULT_SORT_ORDER = "status+,end+,due+,priority-,project+"
 
@@ -51,8 +63,186 @@ COMPLETION_RECUR = """
 """.split()
 
 
+def rc_fingerprint(taskrc_location):
+    try:
+        st = os.stat(os.path.expanduser(taskrc_location))
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+_tw_pool = {}
+_tw_pool_lock = threading.Lock()
+_compiled_filters = {}
+
+def get_tw(data_location=DEFAULT_DATA, taskrc_location=DEFAULT_RC):
+    '''
+    Pooled `TaskWarrior` instance for the given locations, replaced when the taskrc
+    changes (its config is read once per instance).
+    '''
+    key = (data_location, taskrc_location)
+    rc = rc_fingerprint(taskrc_location)
+    with _tw_pool_lock:
+        entry = _tw_pool.get(key)
+        if entry is None or entry[0] != rc:
+            entry = (rc, TaskWarrior(data_location=data_location, taskrc_location=taskrc_location))
+            _tw_pool[key] = entry
+    return entry[1]
+
+
+class TaskStore:
+    '''
+    In-memory copy of all TaskWarrior tasks, indexed by uuid (and by the 8 character
+    short uuids used in notes). Tasks are exported with a single `task export` and
+    only re-exported when one of the data files changes (mtime or size), or when the
+    export is older than `ttl` seconds: computed fields like `urgency` drift with
+    time. A build touching many task groups runs TaskWarrior once instead of once
+    per task.
+
+    Filter queries still go through TaskWarrior, but only to get the matching uuids;
+    results are reused for the lifetime of an export and are resolved against the
+    index.
+    '''
+    def __init__(self, data_location=DEFAULT_DATA, taskrc_location=DEFAULT_RC, ttl=QUERY_TTL):
+        self.data_location = data_location
+        self.taskrc_location = taskrc_location
+        self.ttl = ttl
+        self.lock = threading.RLock()
+
+        self.tw = None
+        self.fingerprint = None
+        self.exported = None
+        self.tasks = []
+        self.by_uuid = {}
+        self.by_short = {}
+        self.queries = {}
+
+    def data_fingerprint(self):
+        fingerprint = []
+        for name in TASK_DATA_FILES:
+            try:
+                st = os.stat(os.path.join(os.path.expanduser(self.data_location), name))
+            except OSError:
+                continue
+            fingerprint.append((name, st.st_mtime_ns, st.st_size))
+        return tuple(fingerprint)
+
+    def refresh(self, force=False):
+        '''Re-export all tasks if the data files changed or the export expired.'''
+        fingerprint = self.data_fingerprint()
+        now = time.monotonic()
+        with self.lock:
+            if not force and self.tw is not None and fingerprint == self.fingerprint \
+                    and now - self.exported <= self.ttl:
+                return self
+
+            self.tw = get_tw(self.data_location, self.taskrc_location)
+            self.tasks = list(self.tw.tasks.all())
+            self.by_uuid = {t['uuid']: t for t in self.tasks}
+            self.by_short = {t['uuid'][:8]: t for t in self.tasks}
+            self.queries = {}
+            self.fingerprint = fingerprint
+            self.exported = now
+        return self
+
+    def get(self, uuid):
+        '''Task with full or short `uuid`, or None.'''
+        self.refresh()
+        task = self.by_uuid.get(uuid) or self.by_short.get(uuid)
+        if task is None and len(uuid) != 8:
+            # other prefix lengths; TaskWarrior matches uuid prefixes too
+            matches = [t for u, t in self.by_uuid.items() if u.startswith(uuid)]
+            task = matches[-1] if matches else None
+        return task
+
+    def get_many(self, uuid_list):
+        tasks = [self.get(uuid) for uuid in uuid_list]
+        return [t for t in tasks if t]
+
+    def query(self, taskfilter_args):
+        '''
+        List of the store's tasks matching the (already processed) filter args. Only
+        the matching uuids come from TaskWarrior, once per export.
+        '''
+        self.refresh()
+        key = tuple(taskfilter_args)
+        with self.lock:
+            uuids = self.queries.get(key)
+            if uuids is None:
+                uuids = [t['uuid'] for t in self.tw.tasks.filter(*taskfilter_args)]
+                self.queries[key] = uuids
+        return [self.by_uuid[u] for u in uuids if u in self.by_uuid]
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_store(data_location=DEFAULT_DATA, taskrc_location=DEFAULT_RC):
+    '''Process-wide `TaskStore` for the given TaskWarrior locations.'''
+    key = (data_location, taskrc_location)
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = TaskStore(data_location, taskrc_location)
+    return _stores[key]
+
+
 # TaskWiki utility conversions
-def filterstring_to_tasks(filterstring, tw=None, use_presets=True):
+@functools.lru_cache(maxsize=1024)
+def tw_modstring_to_args(line):
+    '''Split a TaskWarrior modstring into args, honoring quotes and escapes.'''
+    output = []
+    escape_global_chars = ('"', "'")
+    line = line.strip()
+
+    current_escape = None
+    current_part = ''
+    local_escape_pos = None
+
+    for i in range(len(line)):
+        char = line[i]
+        ignored = False
+        process_next_part = False
+
+        # If previous char was \, add to current part no matter what
+        if local_escape_pos == i - 1:
+            local_escape_pos = None
+        # If current char is \, use it as escape mark and ignore it
+        elif char == '\\':
+            local_escape_pos = i
+            ignored = True
+        # If current char is ' or ", open or close an escaped seq
+        elif char in escape_global_chars:
+            # First test if we're finishing an escaped sequence
+            if current_escape == char:
+                current_escape = None
+                ignored = True
+            # Do we have ' inside "" or " inside ''?
+            elif current_escape is not None:
+                pass
+            # Opening ' or "
+            else:
+                current_escape = char
+                ignored = True
+        elif current_escape is not None:
+            pass
+        elif char == ' ':
+            ignored = True
+            process_next_part = True
+
+        if not ignored:
+            current_part += char
+
+        if process_next_part and current_part:
+            output.append(current_part)
+            current_part = ''
+
+    if current_part:
+        output.append(current_part)
+
+    return tuple(output)
+
+
+def compile_filter(filterstring, tw, use_presets=True):
     """
     This method processes taskfilter in the form or filter string,
     parses it into list of filter args, processing any syntax sugar
@@ -68,66 +258,12 @@ def filterstring_to_tasks(filterstring, tw=None, use_presets=True):
     * Interpret !?DELETED as removing both +DELETED and -DELETED.
     """
 
-    def tw_modstring_to_args(line):
-        output = []
-        escape_global_chars = ('"', "'")
-        line = line.strip()
-
-        current_escape = None
-        current_part = ''
-        local_escape_pos = None
-
-        for i in range(len(line)):
-            char = line[i]
-            ignored = False
-            process_next_part = False
-
-            # If previous char was \, add to current part no matter what
-            if local_escape_pos == i - 1:
-                local_escape_pos = None
-            # If current char is \, use it as escape mark and ignore it
-            elif char == '\\':
-                local_escape_pos = i
-                ignored = True
-            # If current char is ' or ", open or close an escaped seq
-            elif char in escape_global_chars:
-                # First test if we're finishing an escaped sequence
-                if current_escape == char:
-                    current_escape = None
-                    ignored = True
-                # Do we have ' inside "" or " inside ''?
-                elif current_escape is not None:
-                    pass
-                # Opening ' or "
-                else:
-                    current_escape = char
-                    ignored = True
-            elif current_escape is not None:
-                pass
-            elif char == ' ':
-                ignored = True
-                process_next_part = True
-
-            if not ignored:
-                current_part += char
-
-            if process_next_part and current_part:
-                output.append(current_part)
-                current_part = ''
-
-        if current_part:
-            output.append(current_part)
-
-        return output
-
-
     # Get the initial version of the taskfilter args
-    tw = tw if tw else TaskWarrior(**DEFAULT_KWARGS)
     taskfilter_args = list(DEFAULT_VIEWPORT_VIRTUAL_TAGS)
     #if use_presets:
      #   taskfilter_args += list(preset.PresetHeader.from_line(self.line_number, self.cache).taskfilter)
     taskfilter_args += "("
-    taskfilter_args += tw_modstring_to_args(filterstring)
+    taskfilter_args += list(tw_modstring_to_args(filterstring))
     taskfilter_args += ")"
 
     # Process syntactic sugar: Context expansion
@@ -137,7 +273,7 @@ def filterstring_to_tasks(filterstring, tw=None, use_presets=True):
         context_definition = tw.config.get(context_variable_name)
 
         if context_definition:
-            context_args = tw_modstring_to_args(context_definition)
+            context_args = list(tw_modstring_to_args(context_definition))
             detected_contexts.append((token, context_args))
         else:
             raise print("Context definition for '{0}' "
@@ -244,7 +380,24 @@ def filterstring_to_tasks(filterstring, tw=None, use_presets=True):
     deempty_parenthesize(taskfilter_args)
 
     # All syntactic processing done, return the resulting filter args
-    return tw.tasks.filter(*taskfilter_args)
+    return tuple(taskfilter_args)
+
+def filterstring_to_tasks(filterstring, tw=None, use_presets=True):
+    '''
+    List of the tasks matching a taskwiki-style filter string (see `compile_filter`).
+    Without an explicit `tw`, the compiled filter is cached per taskrc version and
+    the results come from the shared task store.
+    '''
+    if tw is not None:
+        return list(tw.tasks.filter(*compile_filter(filterstring, tw, use_presets)))
+
+    store = get_store()
+    key = (filterstring, use_presets, store.taskrc_location, rc_fingerprint(store.taskrc_location))
+    args = _compiled_filters.get(key)
+    if args is None:
+        args = compile_filter(filterstring, get_tw(store.data_location, store.taskrc_location), use_presets)
+        _compiled_filters[key] = args
+    return store.query(args)
 
 def prepare_task_header(query):
     '''
@@ -266,23 +419,18 @@ def prepare_task_header(query):
 
 
 def get_all_tasks(tw=None):
-    tw = tw if tw else TaskWarrior(**DEFAULT_KWARGS)
+    tw = tw if tw else get_tw()
     return tw.tasks
 
 def get_task_by_id(uuid, tw=None):
-    tw = tw if tw else TaskWarrior(**DEFAULT_KWARGS)
-    task = tw.tasks.filter(uuid=uuid)
+    if tw is None:
+        return get_store().get(uuid)
 
+    task = tw.tasks.filter(uuid=uuid)
     return task[-1] if task else None
 
 def get_tasks_from_ids(uuid_list):
-    tw = TaskWarrior(**DEFAULT_KWARGS)
-
-    tasks = []
-    for uuid in uuid_list:
-        task = get_task_by_id(uuid, tw=tw)
-        if task: tasks.append(task)
-    return tasks
+    return get_store().get_many(uuid_list)
 
 def taskdict_to_gantt_raw(taskdict, title='Gantt'):
     '''
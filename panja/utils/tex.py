@@ -3,34 +3,146 @@
 
 import os
 import re
+import json
 import shutil
 import sys
+import hashlib
 from subprocess import call, DEVNULL
 from tempfile import mkdtemp
 from pathlib import Path
 
 from pandocfilters import toJSONFilter, Para, Image, get_filename4code, get_extension
 
+from . import util
+
 PREAMBLE = '/home/smgr/Documents/projects/templates/latex/standard/preamble.sty'
+DATA_DIR = '/home/smgr/Documents/notes/data'
+WORKSPACE_ROOT = os.path.expanduser('~/.cache/panja/tex/')
+
+
+def file_sha1(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def workspace(preamble=None):
+    '''
+    Shared LaTeX workspace for `preamble`: a directory under `WORKSPACE_ROOT` named
+    after the preamble's digest, holding a copy of it. Created once and reused by
+    every render with the same preamble; point TEXINPUTS at it.
+    '''
+    if preamble is None:
+        path = Path(WORKSPACE_ROOT, 'plain')
+        path.mkdir(parents=True, exist_ok=True)
+        return path
+
+    path = Path(WORKSPACE_ROOT, 'ws-' + file_sha1(preamble)[:16])
+    target = Path(path, Path(preamble).name)
+    if not target.exists():
+        path.mkdir(parents=True, exist_ok=True)
+        tmp = Path(path, '.{}.{}'.format(target.name, os.getpid()))
+        shutil.copy(preamble, tmp)
+        os.replace(tmp, target)
+    return path
+
+
+class DigestIndex:
+    '''
+    Per-file SHA1 digests of the files under `root` (as listed by
+    `utils.directory_tree`), keyed by relative path and kept with each file's size
+    and mtime. `digest()` only re-hashes files whose stat changed since the last
+    call, and the index is saved to `index_path` so this holds across runs too.
+    '''
+    def __init__(self, root=DATA_DIR, index_path=None):
+        self.root = root
+        if index_path is None:
+            index_path = Path(WORKSPACE_ROOT, 'data-digests.json')
+        self.index_path = Path(index_path)
+        self.files = self.load()
+
+    def load(self):
+        try:
+            with open(self.index_path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if data.get('root') != str(self.root): return {}
+        return data.get('files', {})
+
+    def save(self):
+        # imported here so `panja.utils` doesn't need the cache module's dependencies
+        from ..cache import atomic_open
+
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        with atomic_open(self.index_path, 'w') as f:
+            json.dump({'root': str(self.root), 'files': self.files}, f)
+
+    def refresh(self):
+        '''Bring the index up to date with `root`; returns the number of files hashed.'''
+        current = {}
+        hashed = 0
+        for rel in sorted(util.directory_tree(self.root)):
+            try:
+                st = os.stat(Path(self.root, rel))
+            except OSError:
+                continue
+            stamp = [st.st_size, st.st_mtime_ns]
+            entry = self.files.get(rel)
+            if entry is None or entry[0] != stamp:
+                entry = [stamp, file_sha1(Path(self.root, rel))]
+                hashed += 1
+            current[rel] = entry
+
+        changed = hashed or len(current) != len(self.files)
+        self.files = current
+        if changed: self.save()
+        return hashed
+
+    def digest(self):
+        '''Digest of all file paths and contents under `root`.'''
+        self.refresh()
+        h = hashlib.sha1()
+        for rel, (_, sha) in sorted(self.files.items()):
+            h.update('{}\0{}\n'.format(rel, sha).encode('utf-8'))
+        return h.hexdigest()
+
+
+_data_index = None
+
+def data_digest():
+    '''Digest of `DATA_DIR`, via a shared `DigestIndex`.'''
+    global _data_index
+    if _data_index is None:
+        _data_index = DigestIndex()
+    return _data_index.digest()
 
 def standalone2pdf(instr, outfile, preamble=None, extra_files=None):
     '''
     Future: support local data directory for tikz/pgf plots from tabular data
+
+    Compiles in a fresh job directory inside the preamble's `workspace`, which is
+    found through TEXINPUTS; `extra_files` and the notes data directory are linked in
+    rather than copied. pdflatex runs with the job directory as its working
+    directory rather than changing the process's, so renders can run concurrently
+    (see `panja.render`).
     '''
-    tmpdir = mkdtemp()
-    olddir = os.getcwd()
-
-    if preamble is not None:
-        shutil.copy(preamble, tmpdir)
-            
-    if extra_files is not None:
-        for file in extra_files:
-            shutil.copy(file, tmpdir)
-
-    os.chdir(tmpdir)
-    shutil.copytree('/home/smgr/Documents/notes/data', str(Path(tmpdir,'data')))
-    
-    with open('stal.tex', 'w') as f:
+    ws = workspace(preamble)
+    jobdir = mkdtemp(dir=ws, prefix='job-')
+
+    files = {Path(file).name: file for file in (extra_files or [])}
+    files['data'] = DATA_DIR
+    for name, src in files.items():
+        try:
+            os.symlink(os.path.abspath(src), Path(jobdir, name))
+        except OSError:
+            if Path(src).is_dir():
+                shutil.copytree(src, str(Path(jobdir, name)))
+            else:
+                shutil.copy(src, Path(jobdir, name))
+
+    with open(Path(jobdir, 'stal.tex'), 'w') as f:
         f.write("""\\documentclass{standalone}
                  \\usepackage{preamble}
                  \\begin{document}
@@ -38,11 +150,16 @@ def standalone2pdf(instr, outfile, preamble=None, extra_files=None):
         f.write(instr)
         f.write("\n\\end{document}\n")
 
-    rcode = call(["pdflatex", 'stal.tex'])#, stdout=DEVNULL)
-    os.chdir(olddir)
+    # trailing separator keeps the default search path after the workspace
+    env = dict(os.environ, TEXINPUTS=str(ws) + os.pathsep + os.environ.get('TEXINPUTS', ''))
+
+    # no stdin, so a TeX error stops the run instead of waiting at a prompt
+    rcode = call(["pdflatex", 'stal.tex'], cwd=jobdir, env=env, stdin=DEVNULL)#, stdout=DEVNULL)
 
-    shutil.copyfile(tmpdir + '/stal.pdf', outfile)
-    shutil.rmtree(tmpdir)
+    try:
+        shutil.copyfile(Path(jobdir, 'stal.pdf'), outfile)
+    finally:
+        shutil.rmtree(jobdir)
     return rcode
 
 def pdf2svg(infile, outfile=None, remove_pdf=False):
@@ -62,12 +179,12 @@ def pdftex2svg(tex_file, pdf_file, outfile):
     '''
     print('pdftex2svg: in {}, pdf {}'.format(tex_file, pdf_file))
     #outpdf = Path(tex_file).with_suffix('.pdf')
-    outpdf = Path(tex_file).with_suffix('.pdf.tmp').name
+    outpdf = Path(outfile).with_suffix('.pdf.tmp')
     print('pdftex2svg: out pdf {}'.format(outpdf))
     standalone2pdf('\\input{'+Path(tex_file).name+'}', outpdf, PREAMBLE,
                    extra_files=[tex_file, pdf_file])
     print('pdftex2svg: standalone conversion to {}'.format(outfile))
-    pdf2svg(outpdf, outfile)
+    pdf2svg(outpdf, outfile, remove_pdf=True)
 
 def tikz2svg(tikz_src, outfile):
     '''
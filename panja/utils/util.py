@@ -5,6 +5,9 @@ import sys
 import re
 import logging
 import hashlib
+import bisect
+import weakref
+import functools
 from datetime import datetime
 from pathlib import Path
 from colorama import Fore
@@ -31,8 +34,13 @@ def check_dir(path):
 def fname_to_title(fname):
     return fname.replace('_', ' ')
 
+fname_newline_regex = re.compile(r' *\n *')
+anchor_tail_regex   = re.compile(r'#[^#]*$')
+anchor_strip_regex  = re.compile(r'[^\w\s-]')
+
 def title_to_fname(title):
-    title = re.sub(r' *\n *', ' ', title)
+    if '\n' in title:
+        title = fname_newline_regex.sub(' ', title)
     return title.replace(' ', '_')
 
 def title_to_link(match, path='', graph=None):
@@ -96,6 +104,84 @@ def title_to_link(match, path='', graph=None):
 
     return link_txt
 
+class LinkResolver:
+    '''
+    Wikilink renderer for one revision of an ArticleGraph (or for no graph). Heading
+    maps are looked up the first time a target is linked to with an anchor and kept
+    per target, and rendered links are kept in an LRU cache keyed on (title, anchor,
+    desc, path), so repeated links cost a dict lookup. Output is identical to
+    `title_to_link`; use `get_link_resolver` to get the resolver matching a graph's
+    current revision.
+    '''
+    def __init__(self, graph=None, cache_size=8192):
+        self.graph = graph
+        self.revision = getattr(graph, 'revision', None)
+        self.hmaps = {}
+        self.render = functools.lru_cache(maxsize=cache_size)(self._render)
+
+    def heading_map(self, target):
+        '''Heading map of article `target`, or None if it isn't in the graph.'''
+        if self.graph is None: return None
+        if target not in self.hmaps:
+            article = self.graph.article_map.get(target)
+            self.hmaps[target] = None if article is None else article.metadata.get('heading_map')
+        return self.hmaps[target]
+
+    def link(self, match, path=''):
+        '''Render a `link_regex` match.'''
+        return self.render(match.group(1) or '', match.group(2) or '', match.group(3) or '', path)
+
+    def _render(self, title, anchor, desc, path):
+        if desc:
+            display = desc
+        elif anchor:
+            display = title + anchor.replace('#','<span style="color:rgba(var(--violet-rgb),1.0)">§</span>')
+        else:
+            display = title
+
+        target = title_to_fname(title)
+        pdf = Path(target).suffix == '.pdf'
+        hmap = self.heading_map(target) if anchor else None
+
+        if pdf:
+            url, _ = wikipdf_to_link(target, anchor)
+            url_preview = target
+        else:
+            url = url_join(path, target + parse_anchor(anchor, hmap))
+            url_preview = url
+
+            # URL to use for previews
+            if not path:
+                url_preview = url_join(path, target + parse_anchor(anchor, hmap) + '?mode=simp')
+
+        return '<a class="wikilink" data-docsource="'+url_preview+'" href="'+url+'">'+display+'</a>'
+
+
+def url_join(path, tail):
+    '''`str(Path('/', path, tail))`, with plain string operations where possible.'''
+    if path.startswith('//') or tail.startswith('//') or (tail.startswith('/') and path):
+        return str(Path('/', path, tail))
+    parts = [p for p in (path+'/'+tail).split('/') if p and p != '.']
+    return '/' + '/'.join(parts)
+
+
+_resolvers = weakref.WeakKeyDictionary()
+_plain_resolver = None
+
+def get_link_resolver(graph=None):
+    '''Shared `LinkResolver` for `graph`, rebuilt whenever the graph's revision changes.'''
+    global _plain_resolver
+    if graph is None:
+        if _plain_resolver is None:
+            _plain_resolver = LinkResolver()
+        return _plain_resolver
+
+    resolver = _resolvers.get(graph)
+    if resolver is None or resolver.revision != getattr(graph, 'revision', None):
+        resolver = LinkResolver(graph)
+        _resolvers[graph] = resolver
+    return resolver
+
 def wikipdf_to_link(fname, anchor):
     '''Map PDF wikilinks to proper links, handling syntax-specific anchors.'''
     base_url = str(Path('/pdf.html?file=',fname))
@@ -128,10 +214,10 @@ def parse_anchor(anchor_str, hmap=None):
     if hmap is not None and anchor_str[1:] in hmap:
         return '#'+hmap[anchor_str[1:]]
 
-    m = re.findall(r'#[^#]*$', anchor_str)
+    m = anchor_tail_regex.findall(anchor_str)
     tail = m[-1] if m else ''
     tail = tail.lower().replace(' ', '-')
-    tail = re.sub(r'[^\w\s-]','',tail)
+    tail = anchor_strip_regex.sub('',tail)
     tail = '#'+tail if tail else tail
     return tail
 
@@ -202,6 +288,26 @@ def bs(arr, t):
     else:
         return bs(arr[:mid],t)
 
+class LineIndex:
+    '''
+    Newline offsets of a string, for mapping character offsets to 1-indexed
+    (line, column) pairs in O(log n). `position(i)` agrees with
+    `(s.count('\\n', 0, i)+1, i - s.rfind('\\n', 0, i))`.
+    '''
+    def __init__(self, string):
+        self.newlines = [m.start() for m in re.finditer('\n', string)]
+
+    def line(self, offset):
+        return bisect.bisect_left(self.newlines, offset) + 1
+
+    def position(self, offset):
+        k = bisect.bisect_left(self.newlines, offset)
+        return k+1, offset - (self.newlines[k-1] if k else -1)
+
+    def line_start(self, line):
+        '''Offset of the first character on 1-indexed `line`.'''
+        return self.newlines[line-2]+1 if line > 1 else 0
+
 #class TqdmLoggingHandler(logging.Handler):
 class TqdmLoggingHandler(logging.StreamHandler):
     def __init__(self, level=logging.NOTSET):
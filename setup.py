@@ -19,7 +19,8 @@ setuptools.setup(
         'tqdm',
         'livereload',
         'docopt',
-        'colorama'
+        'colorama',
+        'numpy'
     ],
     classifiers=[
         "Programming Language :: Python :: 3",